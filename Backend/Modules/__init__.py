@@ -1,17 +1,32 @@
 # Modules/__init__.py
 
 from.startup import Startup
+from .acceptor import Acceptor
+from .artifacts import ArtifactIndex
 from .backend import Backend
+from .channel import Channel
 from .commands import Commands
 from .controller import Controller
+from .database import DatabaseWriter
+from .events import EventBus
+from .fanout import FanOut
+from .heartbeat import Heartbeat
+from .history import ConnectionHistory
 from .logger import init_logger
+from .liveness import PassiveMonitor
+from .metrics import MetricsRegistry
 from .operations import Operations
 from .screenshot import Screenshot
+from .registry import EndpointRegistry
 from .server import Server
+from .storage import StorageStats
+from .snapshots import TaskSnapshots
 from .utils import Handlers
 
 from .sysinfo import Sysinfo
 from .tasks import Tasks
+from .thumbnails import ThumbnailPool
+from .tracing import Tracer
 
 # Package version
 __version__ = "1.0.0"
@@ -19,14 +34,29 @@ __version__ = "1.0.0"
 # Exposed modules
 __all__ = [
     "Startup",
+    "Acceptor",
+    "ArtifactIndex",
     "Backend",
+    "Channel",
     "Commands",
     "Controller",
+    "DatabaseWriter",
+    "EventBus",
+    "FanOut",
+    "Heartbeat",
+    "ConnectionHistory",
     "init_logger",
+    "PassiveMonitor",
+    "MetricsRegistry",
     "Operations",
     "Screenshot",
+    "EndpointRegistry",
     "Server",
+    "StorageStats",
+    "TaskSnapshots",
     "Handlers",
     "Sysinfo",
-    "Tasks"
+    "Tasks",
+    "ThumbnailPool",
+    "Tracer"
 ]
@@ -0,0 +1,200 @@
+from .logger import init_logger
+from .protocol import FrameDecoder, MessageType, ProtocolError, encode_frame
+from collections import OrderedDict
+import selectors
+import time
+import json
+
+
+class PendingConnection:
+    def __init__(self, conn, ip, deadline, max_handshake_size):
+        self.conn = conn
+        self.ip = ip
+        self.deadline = deadline
+        self.accepted_at = time.monotonic()
+        self.decoder = FrameDecoder(max_size=max_handshake_size)
+        self.gate_passed = False
+
+    def __repr__(self):
+        return (f"PendingConnection(ip={self.ip}, gate_passed={self.gate_passed}, "
+                f"buffered={len(self.decoder)})")
+
+
+class Acceptor:
+    """Non-blocking accept and handshake engine.
+
+    A single selector watches the listening socket and every connection that
+    has not finished its handshake yet, so a slow or silent agent never blocks
+    the others. Completed handshakes are handed to ``on_handshake`` as
+    ``(conn, ip, handshake)`` with the socket switched back to blocking mode.
+    """
+    welcome = "Connection Established!"
+
+    def __init__(self, server_socket, on_handshake, log_path,
+                 handshake_timeout=10.0, max_pending=10000, max_handshake_size=1024 * 1024):
+        self.server_socket = server_socket
+        self.on_handshake = on_handshake
+        self.log_path = log_path
+        self.handshake_timeout = float(handshake_timeout)
+        self.max_pending = int(max_pending)
+        self.max_handshake_size = int(max_handshake_size)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.selector = selectors.DefaultSelector()
+        self.pending = OrderedDict()
+        self.running = False
+        self.paused = False
+
+    def __str__(self):
+        return f"Acceptor(pending={len(self.pending)}, handshake_timeout={self.handshake_timeout})"
+
+    def __repr__(self):
+        return (f"Acceptor(pending={len(self.pending)}, handshake_timeout={self.handshake_timeout}, "
+                f"max_pending={self.max_pending}, running={self.running})")
+
+    def run(self) -> None:
+        self.logger.info(f'Running acceptor...')
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, data=None)
+        self.running = True
+
+        while self.running:
+            for key, mask in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    self.accept_ready()
+
+                else:
+                    self.read_ready(key.data)
+
+            self.expire_pending()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def accept_ready(self) -> None:
+        while len(self.pending) < self.max_pending:
+            try:
+                conn, (ip, port) = self.server_socket.accept()
+
+            except (BlockingIOError, InterruptedError):
+                return
+
+            except OSError as e:
+                self.logger.error(f'Accept failed: {e}')
+                return
+
+            self.logger.debug('Connection from %s accepted.', ip)
+            conn.setblocking(False)
+            pending = PendingConnection(conn, ip, time.monotonic() + self.handshake_timeout,
+                                        self.max_handshake_size)
+            try:
+                conn.send(encode_frame(MessageType.TEXT, f"@Server: {self.welcome}"))
+
+            except OSError as e:
+                self.logger.error(f'Failed sending welcome message to {ip}: {e}')
+                conn.close()
+                continue
+
+            self.pending[conn] = pending
+            self.selector.register(conn, selectors.EVENT_READ, data=pending)
+
+        # Too many handshakes in flight: stop watching the listening socket
+        # until some of them complete or expire.
+        if not self.paused:
+            self.logger.debug('Pending handshake limit reached (%s).', self.max_pending)
+            self.selector.unregister(self.server_socket)
+            self.paused = True
+
+    def read_ready(self, pending) -> None:
+        try:
+            data = pending.conn.recv(65536)
+
+        except (BlockingIOError, InterruptedError):
+            return
+
+        except OSError as e:
+            self.logger.error(f'{pending.ip}: {e}')
+            self.drop(pending)
+            return
+
+        if not data:
+            self.logger.debug('%s closed the connection during handshake.', pending.ip)
+            self.drop(pending)
+            return
+
+        try:
+            frames = pending.decoder.feed(data)
+
+        except ProtocolError as e:
+            self.logger.error(f'{pending.ip}: {e}')
+            self.drop(pending)
+            return
+
+        for msg_type, payload in frames:
+            if not self.parse(pending, msg_type, payload):
+                return
+
+    def parse(self, pending, msg_type, payload) -> bool:
+        if not pending.gate_passed:
+            if msg_type != MessageType.HELLO or payload.decode(errors='replace').lower()[:6] != 'client':
+                self.logger.error(f'GATE-KEEPER: {pending.ip} failed.')
+                self.drop(pending)
+                return False
+
+            pending.gate_passed = True
+            self.logger.info(f"Handshake completed for {pending.ip}.")
+            return True
+
+        if msg_type != MessageType.HANDSHAKE:
+            self.logger.error(f'{pending.ip}: expected HANDSHAKE, got {msg_type.name}.')
+            self.drop(pending)
+            return False
+
+        try:
+            handshake = json.loads(payload)
+
+        except ValueError as e:
+            self.logger.error(f'{pending.ip}: {e}')
+            self.drop(pending)
+            return False
+
+        self.complete(pending, handshake)
+        return False
+
+    def complete(self, pending, handshake) -> None:
+        self.release(pending)
+        elapsed = time.monotonic() - pending.accepted_at
+        self.logger.debug("Client data from %s received in %.3fs.", pending.ip, elapsed)
+        try:
+            pending.conn.setblocking(True)
+            self.on_handshake(pending.conn, pending.ip, handshake)
+
+        except Exception as e:
+            self.logger.error(f'Failed registering {pending.ip}: {e}')
+            pending.conn.close()
+
+    def expire_pending(self) -> None:
+        now = time.monotonic()
+        while self.pending:
+            pending = next(iter(self.pending.values()))
+            if pending.deadline > now:
+                break
+
+            self.logger.error(f'Handshake with {pending.ip} timed out.')
+            self.drop(pending)
+
+    def release(self, pending) -> None:
+        self.pending.pop(pending.conn, None)
+        try:
+            self.selector.unregister(pending.conn)
+
+        except (KeyError, ValueError):
+            pass
+
+        if self.paused and len(self.pending) < self.max_pending:
+            self.selector.register(self.server_socket, selectors.EVENT_READ, data=None)
+            self.paused = False
+
+    def drop(self, pending) -> None:
+        self.release(pending)
+        pending.conn.close()
@@ -0,0 +1,245 @@
+from .logger import init_logger
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import hashlib
+import sqlite3
+import os
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Artifact:
+    __slots__ = ('ident', 'type', 'path', 'size', 'timestamp', 'hash')
+
+    def __init__(self, ident, artifact_type, path, size, timestamp, digest):
+        self.ident = ident
+        self.type = artifact_type
+        self.path = path
+        self.size = size
+        self.timestamp = timestamp
+        self.hash = digest
+
+    def __repr__(self):
+        return f"Artifact(ident={self.ident}, type={self.type}, path={self.path}, size={self.size})"
+
+    def to_row(self) -> tuple:
+        return self.path, self.ident, self.type, self.size, self.timestamp, self.hash
+
+    def to_dict(self) -> dict:
+        return {
+            "ident": self.ident,
+            "type": self.type,
+            "filename": os.path.basename(self.path),
+            "size": self.size,
+            "timestamp": self.timestamp,
+            "hash": self.hash
+        }
+
+
+class ArtifactIndex:
+    """Index of every artifact received from the endpoints.
+
+    Each artifact is kept in memory by path and per endpoint, and the newest
+    artifact of each type per endpoint is tracked as it is recorded, so "latest
+    sysinfo for this endpoint" is a dict lookup instead of a directory scan. The
+    index is persisted to SQLite; at startup ``rebuild`` reconciles it with
+    ``main_path`` by scanning the endpoint directories in parallel, reusing
+    stored hashes for files whose size and mtime did not change.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS artifacts (
+        path TEXT PRIMARY KEY,
+        ident TEXT NOT NULL,
+        type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        timestamp REAL NOT NULL,
+        hash TEXT NOT NULL
+    )
+    """
+
+    def __init__(self, main_path, log_path, db_path=None, workers=8):
+        self.main_path = os.path.abspath(main_path)
+        self.log_path = log_path
+        self.db_path = db_path or os.path.join(self.main_path, 'artifacts.db')
+        self.workers = int(workers)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.by_path = {}
+        self.by_ident = {}
+        self.latest_by_type = {}
+        self.listeners = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute(self.schema)
+        self.db.commit()
+
+    def __str__(self):
+        return f"ArtifactIndex(artifacts={len(self)})"
+
+    def __repr__(self):
+        return (f"ArtifactIndex(artifacts={len(self)}, endpoints={len(self.by_ident)}, "
+                f"db_path={self.db_path})")
+
+    def __len__(self):
+        return len(self.by_path)
+
+    @staticmethod
+    def classify(filename):
+        name = filename.lower()
+        if name.endswith('.jpg'):
+            return 'screenshot'
+
+        if name.startswith('systeminfo') and name.endswith('.txt'):
+            return 'sysinfo'
+
+        if name.startswith('tasks') and name.endswith('.txt'):
+            return 'tasks'
+
+        return None
+
+    @staticmethod
+    def file_hash(path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def record(self, ident, path, artifact_type=None):
+        """Index a freshly received artifact and return it, or None if it is not one."""
+        path = os.path.abspath(path)
+        artifact_type = artifact_type or self.classify(os.path.basename(path))
+        if artifact_type is None:
+            return None
+
+        try:
+            stat = os.stat(path)
+            artifact = Artifact(ident, artifact_type, path, stat.st_size, stat.st_mtime, self.file_hash(path))
+
+        except OSError as e:
+            self.logger.error(f"Failed indexing {path}: {e}")
+            return None
+
+        with self.lock:
+            self._add(artifact)
+            self.db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)", artifact.to_row())
+            self.db.commit()
+
+        self.logger.debug("Indexed %s", artifact)
+        for listener in self.listeners:
+            try:
+                listener(artifact)
+
+            except Exception as e:
+                self.logger.error(f"Artifact listener {listener} failed: {e}")
+
+        return artifact
+
+    def subscribe(self, listener) -> None:
+        """Call ``listener(artifact)`` for every newly recorded artifact."""
+        self.listeners.append(listener)
+
+    def _add(self, artifact) -> None:
+        self.by_path[artifact.path] = artifact
+        self.by_ident.setdefault(artifact.ident, {})[artifact.path] = artifact
+        key = (artifact.ident, artifact.type)
+        latest = self.latest_by_type.get(key)
+        if latest is None or artifact.timestamp >= latest.timestamp:
+            self.latest_by_type[key] = artifact
+
+    def latest(self, ident, artifact_type):
+        return self.latest_by_type.get((ident, artifact_type))
+
+    def get(self, path):
+        return self.by_path.get(os.path.abspath(path))
+
+    def artifacts(self, ident, artifact_type=None) -> list:
+        with self.lock:
+            items = list(self.by_ident.get(ident, {}).values())
+
+        if artifact_type is not None:
+            items = [artifact for artifact in items if artifact.type == artifact_type]
+
+        return sorted(items, key=lambda artifact: artifact.timestamp, reverse=True)
+
+    def forget(self, ident) -> None:
+        """Drop every artifact of ``ident``, e.g. after its local directory was cleared."""
+        with self.lock:
+            removed = self.by_ident.pop(ident, {})
+            for path in removed:
+                self.by_path.pop(path, None)
+
+            for key in [key for key in self.latest_by_type if key[0] == ident]:
+                del self.latest_by_type[key]
+
+            self.db.execute("DELETE FROM artifacts WHERE ident = ?", (ident,))
+            self.db.commit()
+
+        self.logger.info(f"Forgot {len(removed)} artifacts of {ident}.")
+
+    def scan_endpoint(self, ident, known) -> list:
+        found = []
+        base = os.path.join(self.main_path, ident)
+        for directory in (base, os.path.join(base, 'images')):
+            try:
+                entries = list(os.scandir(directory))
+
+            except OSError:
+                continue
+
+            for entry in entries:
+                artifact_type = self.classify(entry.name)
+                if artifact_type is None or not entry.is_file():
+                    continue
+
+                try:
+                    stat = entry.stat()
+                    previous = known.get(entry.path)
+                    if previous and previous.size == stat.st_size and previous.timestamp == stat.st_mtime:
+                        digest = previous.hash
+
+                    else:
+                        digest = self.file_hash(entry.path)
+
+                except OSError as e:
+                    self.logger.error(f"Failed indexing {entry.path}: {e}")
+                    continue
+
+                found.append(Artifact(ident, artifact_type, entry.path, stat.st_size, stat.st_mtime, digest))
+
+        return found
+
+    def rebuild(self) -> None:
+        self.logger.info(f"Rebuilding artifact index from {self.main_path}...")
+        with self.lock:
+            known = {row[0]: Artifact(row[1], row[2], row[0], row[3], row[4], row[5])
+                     for row in self.db.execute("SELECT path, ident, type, size, timestamp, hash FROM artifacts")}
+
+        try:
+            idents = [entry.name for entry in os.scandir(self.main_path) if entry.is_dir()]
+
+        except OSError as e:
+            self.logger.error(f"Failed scanning {self.main_path}: {e}")
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ArtifactScan") as executor:
+            results = list(executor.map(lambda ident: self.scan_endpoint(ident, known), idents))
+
+        with self.lock:
+            self.by_path.clear()
+            self.by_ident.clear()
+            self.latest_by_type.clear()
+            for found in results:
+                for artifact in found:
+                    self._add(artifact)
+
+            self.db.execute("DELETE FROM artifacts")
+            self.db.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                                [artifact.to_row() for artifact in self.by_path.values()])
+            self.db.commit()
+
+        self.logger.info(f"Artifact index rebuilt: {len(self)} artifacts for {len(idents)} endpoints.")
@@ -1,11 +1,23 @@
-from flask import Flask, request, jsonify, send_from_directory, url_for, redirect, session
+from flask import Flask, Response, request, jsonify, send_from_directory, send_file, make_response, \
+    stream_with_context, url_for, redirect, session
 from datetime import datetime, timezone
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
 from flask_cors import CORS
+from werkzeug.utils import safe_join
+import mimetypes
+import json
+import zlib
 import os
 
+from .artifacts import ArtifactIndex
 from .controller import Controller
 from .operations import Operations
+from .thumbnails import ThumbnailPool
+from .storage import StorageStats
+from .snapshots import TaskSnapshots
+from .metrics import REGISTRY, CONTENT_TYPE
+from .tracing import Tracer
+from . import events
 from .logger import init_logger
 from .commands import Commands
 from .utils import Handlers
@@ -34,10 +46,38 @@ class Backend:
 
         self.app.secret_key = os.getenv('SECRET_KEY')
         self.app.config['SESSION_TIMEOUT'] = 3600
+        self.images_root = os.getenv('MAIN_PATH') or self.main_path
+        self.image_max_age = int(os.getenv('IMAGE_MAX_AGE', 31536000))
+        self.sendfile_mode = os.getenv('SENDFILE_MODE', '').lower()
+        self.sendfile_prefix = os.getenv('SENDFILE_PREFIX', '/protected').rstrip('/')
+        self.app.config['USE_X_SENDFILE'] = self.sendfile_mode == 'x-sendfile'
+        self.artifact_gzip = os.getenv('ARTIFACT_GZIP', 'true').lower() == 'true'
         self.sio = SocketIO(self.app)
 
+        self.artifacts = ArtifactIndex(self.main_path, self.log_path,
+                                       db_path=os.getenv('ARTIFACT_INDEX_PATH'),
+                                       workers=os.getenv('ARTIFACT_SCAN_WORKERS', 8))
+        self.thumbnails = ThumbnailPool(self.log_path,
+                                        workers=os.getenv('THUMBNAIL_WORKERS', 2),
+                                        max_queue=os.getenv('THUMBNAIL_QUEUE', 256),
+                                        thumb_size=os.getenv('THUMBNAIL_SIZE', 320),
+                                        quality=os.getenv('THUMBNAIL_QUALITY', 70),
+                                        recompress=os.getenv('RECOMPRESS_FORMAT'))
+        self.storage = StorageStats(self.main_path, self.log_path,
+                                    max_age=os.getenv('STORAGE_RESCAN_INTERVAL', 300),
+                                    watch=os.getenv('STORAGE_WATCH', 'false').lower() == 'true')
+        self.artifacts.subscribe(self.thumbnails.on_artifact)
+        self.task_snapshots = TaskSnapshots(self.log_path, per_endpoint=os.getenv('TASK_SNAPSHOTS', 20))
+        self.artifacts.subscribe(self.storage.on_artifact)
+        self.artifacts.subscribe(self.task_snapshots.on_artifact)
+        self.artifacts.subscribe(self.server.events.on_artifact)
+        self.server.events.bind(self.sio)
+        self.tracer = Tracer(self.log_path, max_traces=os.getenv('TRACE_BUFFER', 1000),
+                             slow=os.getenv('TRACE_SLOW_SECONDS'))
         self.controller = Controller(self.main_path, self.log_path, self.server,
-                                     self.reload)
+                                     self.reload, artifacts=self.artifacts, storage=self.storage,
+                                     snapshots=self.task_snapshots, tracer=self.tracer,
+                                     clear_local=self.clear_local)
         self.handlers = Handlers(self.log_path, self.main_path)
         self.operations = Operations(self)
 
@@ -57,6 +97,7 @@ class Backend:
         self.logger.info(f"Defining app routes...")
 
         self.app.route('/')(self.index)
+        self.app.route('/heartbeats', methods=['GET'])(self.heartbeats)
 
         self.app.route('/control', methods=['POST'])(self.operations.control)
         self.app.route('/get_files', methods=['GET'])(self.operations.get_files)
@@ -65,21 +106,153 @@ class Backend:
         self.app.route('/discover', methods=['POST'])(self.operations.discover)
         self.app.route('/ex_ip', methods=['GET'])(self.operations.get_ex_ip)
         self.app.route('/wifi', methods=['POST'])(self.operations.get_wifi)
+        self.app.route('/history', methods=['GET'])(self.operations.history)
+        self.app.route('/traces', methods=['GET'])(self.operations.traces)
+        self.app.route('/traces/<int:trace_id>', methods=['GET'])(self.operations.trace)
+        self.app.route('/tasks/<ident>', methods=['GET'])(self.operations.task_delta)
 
         self.app.route('/images/<machine_name>/<path:filename>')(self.serve_images)
+        self.app.route('/artifacts/<machine_name>/<path:filename>')(self.download_artifact)
         self.app.errorhandler(404)(self.page_not_found)
 
+        self.app.route('/metrics', methods=['GET'])(self.serve_metrics)
         self.app.route('/reload')(self.reload)
         self.app.route('/shell_data', methods=['POST', 'GET'])(self.shell_data)
 
+        self.sio.on('subscribe')(self.subscribe_events)
+        self.sio.on('unsubscribe')(self.unsubscribe_events)
+
+    def subscribe_events(self, data=None):
+        """``{"fleet": true, "idents": [...]}``: join the fleet room and the rooms of the endpoints on screen."""
+        data = data or {}
+        if data.get('fleet'):
+            join_room(events.FLEET_ROOM)
+
+        for ident in data.get('idents', []):
+            join_room(events.endpoint_room(ident))
+
+        self.logger.debug("Socket %s subscribed to %s", request.sid, data)
+
+    def unsubscribe_events(self, data=None):
+        data = data or {}
+        if data.get('fleet'):
+            leave_room(events.FLEET_ROOM)
+
+        for ident in data.get('idents', []):
+            leave_room(events.endpoint_room(ident))
+
     def serve_images(self, machine_name, filename):
-        images_dir = os.path.join(os.getenv('MAIN_PATH'), machine_name, 'images')
-        return send_from_directory(images_dir, filename)
+        source = safe_join(self.images_root, machine_name, 'images', filename)
+        if source is None or not os.path.isfile(source):
+            return self.page_not_found(None)
+
+        path, size = source, request.args.get('size')
+        variant = self.thumbnails.variant_path(source, size) if size else None
+        if variant and os.path.isfile(variant):
+            path = variant
+
+        elif variant:
+            # Older screenshots get their variant on first request; serve the original meanwhile.
+            self.thumbnails.submit(source)
+            return self.send_artifact(source, source, None, pending=size)
+
+        return self.send_artifact(source, path, size)
+
+    def download_artifact(self, machine_name, filename):
+        """Stream a received sysinfo/tasks file: Range and conditional GET, or gzip on request."""
+        path = safe_join(self.images_root, machine_name, filename)
+        if path is None or not os.path.isfile(path):
+            return self.page_not_found(None)
+
+        etag = self.artifact_etag(path, path, None)
+        accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        if self.artifact_gzip and accepts_gzip and 'Range' not in request.headers:
+            if etag:
+                etag = f"{etag}-gzip"
+                if request.if_none_match.contains(etag):
+                    return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+            response = Response(stream_with_context(self.gzip_chunks(path)),
+                                mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+            if etag:
+                response.set_etag(etag)
+
+        else:
+            response = send_file(path, conditional=True, etag=etag or True, max_age=self.image_max_age)
+            response.headers['Vary'] = 'Accept-Encoding'
+
+        response.headers['Content-Disposition'] = f'inline; filename="{os.path.basename(path)}"'
+        return response
+
+    @staticmethod
+    def gzip_chunks(path, chunk_size=256 * 1024):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+
+        yield compressor.flush()
+
+    def artifact_etag(self, source, path, size):
+        """Strong ETag from the indexed content hash, or None if the file changed since indexing."""
+        artifact = self.artifacts.get(source)
+        if artifact is None:
+            return None
+
+        stat = os.stat(source)
+        if stat.st_size != artifact.size or stat.st_mtime != artifact.timestamp:
+            return None
+
+        return f"{artifact.hash}-{size}" if path != source else artifact.hash
+
+    def send_artifact(self, source, path, size, pending=None):
+        """Send ``path`` with immutable caching. ``pending`` names a variant that is not
+        generated yet: the original stands in for it under the variant's URL, so it gets
+        its own ETag and must be revalidated rather than cached as the variant."""
+        etag = self.artifact_etag(source, path, size)
+        if etag and pending:
+            etag = f"{etag}-{pending}-pending"
+
+        if self.sendfile_mode == 'x-accel':
+            # nginx serves the bytes (and Range) from an internal location mapped onto MAIN_PATH.
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = \
+                f"{self.sendfile_prefix}/{os.path.relpath(path, self.images_root).replace(os.sep, '/')}"
+            response.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            if etag:
+                response.set_etag(etag)
+
+            response.make_conditional(request)
+
+        else:
+            # With SENDFILE_MODE=x-sendfile Flask emits X-Sendfile (USE_X_SENDFILE) instead of the body.
+            response = send_file(path, conditional=True, etag=etag or True, max_age=self.image_max_age)
+
+        if pending:
+            response.cache_control.public = False
+            response.cache_control.max_age = None
+            response.cache_control.no_cache = True
+            return response
+
+        response.cache_control.public = True
+        response.cache_control.max_age = self.image_max_age
+        response.cache_control.immutable = True
+        return response
 
     def download_file(self, filename):
         self.logger.info(f"Serving file: {filename}...")
         return send_from_directory('static', filename, as_attachment=True)
 
+    def serve_metrics(self):
+        """Counters, gauges and latency histograms in the Prometheus text format."""
+        response = Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+        response.cache_control.no_store = True
+        return response
+
     def page_not_found(self, error) -> jsonify:
         self.logger.error(fr'Error 404: Directory not found.')
         return jsonify({'error': 'Directory not found'}), 404
@@ -87,14 +260,20 @@ class Backend:
     def find_matching_endpoint(self, data) -> str:
         self.logger.info("Finding matching endpoint...")
         try:
-            matching_endpoints = [endpoint for endpoint in self.server.endpoints if
-                                  endpoint.conn == self.commands.shell_target]
-            return next(iter(matching_endpoints), None)
+            return self.server.endpoints.get_by_conn(self.commands.shell_target)
 
         except AttributeError as e:
             self.logger.error(f"Error while matching endpoints: {e}")
             return data['checkedItems']
 
+    def clear_local(self, endpoint) -> bool:
+        """Delete an endpoint's local files and everything cached about them."""
+        cleared = self.handlers.clear_local(endpoint)
+        self.artifacts.forget(endpoint.ident)
+        self.storage.invalidate(endpoint.ident)
+        self.operations.invalidate_listing(endpoint.ident)
+        return cleared
+
     def reload(self):
         self.logger.info("Reloading...")
         self.temp.clear()
@@ -108,11 +287,11 @@ class Backend:
             self.station = True
 
         self.selected_row_data = request.get_json()
-        self.logger.debug(f"Selected Row Data: {self.selected_row_data}")
+        self.logger.debug("Selected Row Data: %s", self.selected_row_data)
         
         checked_value = self.selected_row_data.get('checked')
         row_value = self.selected_row_data.get('message')
-        self.logger.debug(f"Checkboxes Value: {checked_value} | Row: {row_value}")
+        self.logger.debug("Checkboxes Value: %s | Row: %s", checked_value, row_value)
         
         if row_value == 'clear_shell':
             self.station = False
@@ -126,7 +305,7 @@ class Backend:
             })
 
         if 'conn' in self.selected_row_data:
-            self.logger.debug(f"Conn matched: {self.selected_row_data['conn']}")
+            self.logger.debug("Conn matched: %s", self.selected_row_data['conn'])
 
             if self.server.endpoints:
                 ''' Future User Management '''
@@ -134,35 +313,31 @@ class Backend:
                 self.logger.info(f"Settting session login time...")
                 session['login_time'] = time_now
 
-                for endpoint in self.server.endpoints:
-                    try:
-                        if endpoint.client_mac == self.selected_row_data['client_mac']:
-                            self.logger.info(f"Match found: {endpoint.client_mac}")
+                try:
+                    endpoint = self.server.endpoints.get_by_mac(self.selected_row_data['client_mac'])
+                    if endpoint is not None:
+                        self.logger.info(f"Match found: {endpoint.client_mac}")
 
-                            dir_path = os.path.join(self.main_path, endpoint.ident)
-                            self.logger.debug(f"Dir Path: {dir_path}")
+                        dir_path = os.path.join(self.main_path, endpoint.ident)
+                        self.logger.debug("Dir Path: %s", dir_path)
 
-                            if not os.path.exists(dir_path):
-                                self.logger.info(f"Calling 'self.handlers.handle_local_dir(endpoint)'...")
-                                self.handlers.handle_local_dir(endpoint)
+                        if not os.path.exists(dir_path):
+                            self.logger.info(f"Calling 'self.handlers.handle_local_dir(endpoint)'...")
+                            self.handlers.handle_local_dir(endpoint)
 
-                            self.files_info = self.operations.count_files()
-                            self.subdirs = os.listdir(dir_path)
+                        self.files_info = self.operations.count_files()
+                        self.subdirs = os.listdir(dir_path)
 
-                    except KeyError as k:
-                        self.logger.error(f"Key error caught: {k}")
-                        pass
+                except KeyError as k:
+                    self.logger.error(f"Key error caught: {k}")
+                    pass
 
                 try:
-                    self.logger.info(
-                        f'row: {self.selected_row_data}\n'
-                        f'station: {self.station}\n'
-                        f'files_info: {self.files_info}\n'
-                        f'subdirs: {self.subdirs}'
-                    )
+                    self.logger.debug('row: %s\nstation: %s\nfiles_info: %s\nsubdirs: %s',
+                                      self.selected_row_data, self.station, self.files_info, self.subdirs)
                     
                 except AttributeError as a:
-                    self.logger.debug(f"Attribute error caught: {a}")
+                    self.logger.debug("Attribute error caught: %s", a)
                     pass
 
                 return jsonify({
@@ -198,32 +373,53 @@ class Backend:
     def index(self):
         matching_endpoint = None
         self.commands = Commands(self.main_path, self.log_path, matching_endpoint,
-                                 self.server.remove_lost_connection)
-        self.logger.debug(f'shell_target: {matching_endpoint}')
-
-        for endpoint in self.server.endpoints:
-            self.logger.info(f"Checking vital signs on {endpoint.client_mac}...")
-            self.server.check_vital_signs(endpoint)
-
-        endpoints_data = [endpoint.to_dict() for endpoint in self.server.endpoints]
-        self.logger.debug(f"Endpoints data: {endpoints_data}")
-
-        res = {
-            "data": {
-                "serving_on": f"{os.getenv('SERVER_URL')}:{os.getenv('WEB_PORT')}",
-                "server_ip": f"{os.getenv('SERVER_IP')}",
-                "server_port": f"{os.getenv('SERVER_PORT')}",
-                "boot_time": f"{self.operations.last_boot()}",
-                "connected_stations": f"{len(self.server.endpoints)}",
-                "endpoints": endpoints_data,
-                "history": f"{self.server.connHistory}",
-                "history_rows": f"{len(self.server.connHistory)}",
-                "server_version": f"{self.version}"
-            },
-            "Status": 200
+                                 self.server.remove_lost_connection, artifacts=self.artifacts,
+                                 storage=self.storage)
+        self.logger.debug('shell_target: %s', matching_endpoint)
+
+        # request.args.get(type=int) turns a malformed value into None, which would
+        # silently answer with the full fleet.
+        since = request.args.get('since')
+        try:
+            since = int(since) if since is not None else None
+
+        except ValueError:
+            return jsonify({'error': f"Invalid parameter 'since': {since!r} is not an integer"}), 400
+
+        version, changed, removed, full = self.server.endpoints.changes(since)
+        etag = f"fleet-{version}-{since if since is not None and not full else 'all'}"
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+        data = {
+            "serving_on": f"{os.getenv('SERVER_URL')}:{os.getenv('WEB_PORT')}",
+            "server_ip": f"{os.getenv('SERVER_IP')}",
+            "server_port": f"{os.getenv('SERVER_PORT')}",
+            "boot_time": f"{self.operations.last_boot()}",
+            "connected_stations": f"{len(self.server.endpoints)}",
+            "history_rows": f"{len(self.server.connHistory)}",
+            "server_version": f"{self.version}",
+            "fleet_version": version,
+            "full": full,
+            "removed": removed
         }
 
-        return jsonify(res)
+        # Endpoint fragments are cached JSON strings; splice them in rather than re-encoding.
+        endpoints_json = ", ".join(endpoint.to_json() for endpoint in changed)
+        body = f'{{"data": {json.dumps(data)[:-1]}, "endpoints": [{endpoints_json}]}}, "Status": 200}}'
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    def heartbeats(self):
+        """last_seen/rtt_ms per MAC. They change on every probe, so they are served
+        here, uncached, instead of bumping the fleet version behind index()."""
+        response = jsonify({endpoint.client_mac: endpoint.heartbeat_dict() for endpoint in self.server.endpoints})
+        response.cache_control.no_cache = True
+        return response
 
     def run(self):
+        self.artifacts.rebuild()
+        self.storage.start()
         self.sio.run(self.app, host=self.server_ip, port=self.port)
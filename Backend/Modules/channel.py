@@ -0,0 +1,208 @@
+from .logger import init_logger
+from . import protocol
+from . import transfer
+from .metrics import REGISTRY
+from . import tracing
+from concurrent.futures import Future
+from contextvars import copy_context
+from collections import deque
+from threading import Thread, Lock, get_ident
+import itertools
+import time
+
+
+TRANSFER_SECONDS = REGISTRY.histogram('handsoff_transfer_seconds', 'Duration of completed file receives.', ('mode',))
+RECEIVED_BYTES = REGISTRY.counter('handsoff_received_bytes_total', 'File bytes received per endpoint.', ('endpoint',))
+TRANSFER_FAILURES = REGISTRY.counter('handsoff_transfer_failures_total', 'File receives that failed per endpoint.',
+                                     ('endpoint',))
+
+
+class Exchange:
+    """One request on an endpoint's socket: every frame it sends carries its request id
+    and every frame it reads must carry the same id."""
+
+    def __init__(self, conn, request_id, endpoint=None):
+        self.conn = conn
+        self.request_id = request_id
+        self.endpoint = endpoint
+
+    def __repr__(self):
+        return f"Exchange(request_id={self.request_id}, conn={self.conn})"
+
+    def settimeout(self, timeout) -> None:
+        self.conn.settimeout(timeout)
+
+    def send_message(self, msg_type, payload=None) -> None:
+        protocol.send_message(self.conn, msg_type, payload, self.request_id)
+
+    def send_command(self, command) -> None:
+        protocol.send_command(self.conn, command, self.request_id)
+
+    def recv_header(self, expected=None):
+        return protocol.recv_header(self.conn, expected, self.request_id)
+
+    def recv_message(self, expected=None, max_size=protocol.MAX_CONTROL_SIZE):
+        return protocol.recv_message(self.conn, expected, max_size, self.request_id)
+
+    def recv_text(self, expected=protocol.MessageType.TEXT) -> str:
+        return protocol.recv_text(self.conn, expected, self.request_id)
+
+    def recv_json(self, expected=protocol.MessageType.JSON):
+        return protocol.recv_json(self.conn, expected, self.request_id)
+
+    def measure(self, mode, receive, *args) -> int:
+        started = time.perf_counter()
+        try:
+            received = receive(*args)
+
+        except Exception:
+            TRANSFER_FAILURES.labels(self.endpoint).inc()
+            raise
+
+        TRANSFER_SECONDS.labels(mode).observe(time.perf_counter() - started)
+        RECEIVED_BYTES.labels(self.endpoint).inc(received)
+        return received
+
+    def recv_offer(self):
+        return protocol.recv_offer(self.conn, self.request_id)
+
+    def receive_chunks(self, path, size, digest=None) -> int:
+        return self.measure('chunked', transfer.receive_chunks, self.conn, path, size, digest, self.request_id)
+
+
+class Job:
+    def __init__(self, fn, args, timeout):
+        self.fn = fn
+        self.args = args
+        self.timeout = timeout
+        self.future = Future()
+        # Carries the caller's trace into the worker thread.
+        self.context = copy_context()
+        self.queued = time.perf_counter()
+
+
+class Channel:
+    """Single owner of an endpoint's socket.
+
+    Operations are queued as jobs and run one at a time by the channel's worker, each
+    inside its own Exchange with a fresh request id. Callers get a Future back, so
+    several operations can be queued against one agent without blocking each other,
+    while different endpoints run in parallel. The worker thread only exists while
+    there is queued work.
+    """
+
+    def __init__(self, conn, log_path, name=None):
+        self.conn = conn
+        self.log_path = log_path
+        self.name = name or f"{conn}"
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.jobs = deque()
+        self.worker = None
+        self.worker_ident = None
+        self.closed = False
+        self.request_ids = itertools.count(1)
+
+    def __str__(self):
+        return f"Channel(name={self.name}, queued={len(self.jobs)})"
+
+    def __repr__(self):
+        return f"Channel(name={self.name}, queued={len(self.jobs)}, closed={self.closed}, conn={self.conn})"
+
+    @property
+    def busy(self) -> bool:
+        return self.worker is not None
+
+    def next_request_id(self) -> int:
+        request_id = next(self.request_ids)
+        if request_id > protocol.MAX_REQUEST_ID:
+            self.request_ids = itertools.count(1)
+            request_id = next(self.request_ids)
+
+        return request_id
+
+    def submit(self, fn, *args, timeout=None) -> Future:
+        """Queue ``fn(exchange, *args)`` to run on this channel's socket."""
+        job = Job(fn, args, timeout)
+        with self.lock:
+            if self.closed:
+                job.future.set_exception(ConnectionError(f"Channel {self.name} is closed"))
+                return job.future
+
+            self.jobs.append(job)
+            if self.worker is None:
+                self.worker = Thread(target=self.drain, daemon=True, name=f"Channel {self.name}")
+                self.worker.start()
+
+        return job.future
+
+    def call(self, fn, *args, timeout=None):
+        """Run ``fn(exchange, *args)`` on this channel and wait for its result."""
+        if self.worker_ident == get_ident():
+            # Already inside one of this channel's jobs: queueing would deadlock.
+            return self.execute(Job(fn, args, timeout))
+
+        return self.submit(fn, *args, timeout=timeout).result()
+
+    def drain(self) -> None:
+        self.worker_ident = get_ident()
+        while True:
+            with self.lock:
+                if not self.jobs:
+                    self.worker = None
+                    self.worker_ident = None
+                    return
+
+                job = self.jobs.popleft()
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                job.future.set_result(self.execute(job))
+
+            except BaseException as e:
+                job.future.set_exception(e)
+
+    def execute(self, job):
+        return job.context.run(self.run_job, job)
+
+    def run_job(self, job):
+        exchange = Exchange(self.conn, self.next_request_id(), self.name)
+        with tracing.span('exchange', request_id=exchange.request_id,
+                          queued_ms=round((time.perf_counter() - job.queued) * 1000, 3)):
+            return self.run_exchange(job, exchange)
+
+    def run_exchange(self, job, exchange):
+        if job.timeout is None:
+            return job.fn(exchange, *job.args)
+
+        previous = self.conn.gettimeout()
+        self.conn.settimeout(job.timeout)
+        try:
+            return job.fn(exchange, *job.args)
+
+        finally:
+            try:
+                self.conn.settimeout(previous)
+
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            pending = list(self.jobs)
+            self.jobs.clear()
+
+        for job in pending:
+            if job.future.set_running_or_notify_cancel():
+                job.future.set_exception(ConnectionError(f"Channel {self.name} closed"))
+
+        self.logger.debug("Channel %s closed, %s queued jobs cancelled.", self.name, len(pending))
+
+    def forget_metrics(self) -> None:
+        """Drop this endpoint's labelled series, so /metrics does not grow with agent churn."""
+        for metric in (RECEIVED_BYTES, TRANSFER_FAILURES):
+            metric.remove(self.name)
@@ -2,21 +2,21 @@ from .logger import init_logger
 from .screenshot import Screenshot
 from .sysinfo import Sysinfo
 from .tasks import Tasks
+from . import protocol
 from flask import request
 from datetime import datetime
 import socket
-import time
-import glob
-import json
 import os
 
 
 class Commands:
-    def __init__(self, main_path, log_path, endpoint, remove_connection):
+    def __init__(self, main_path, log_path, endpoint, remove_connection, artifacts=None, storage=None):
         self.main_path = main_path
         self.log_path = log_path
         self.endpoint = endpoint
         self.remove_connection = remove_connection
+        self.artifacts = artifacts
+        self.storage = storage
         self.shell_target = None
 
         self.logger = init_logger(self.log_path, __name__)
@@ -24,7 +24,8 @@ class Commands:
     def call_screenshot(self, matching_endpoint):
         self.logger.debug("Initializing Screenshot class...")
         sc = Screenshot(path=self.main_path, log_path=self.log_path, endpoint=matching_endpoint,
-                        remove_connection=self.remove_connection, shell_target=matching_endpoint.conn)
+                        remove_connection=self.remove_connection, shell_target=matching_endpoint.conn,
+                        artifacts=self.artifacts)
         if sc.run():
             return True
 
@@ -36,9 +37,7 @@ class Commands:
 
     def get_nearby_wifi(self, matching_endpoint):
         try:
-            matching_endpoint.conn.send('wifi'.encode())
-            received_data = matching_endpoint.conn.recv(1024)
-            decoded_data = received_data.decode()
+            decoded_data = matching_endpoint.channel.call(self.request_text, 'wifi')
 
             ssid_list = [line.split(":")[1].strip() for line in decoded_data.split('\n') if line.startswith("SSID")]
 
@@ -62,11 +61,9 @@ class Commands:
 
     def call_discover(self, matching_endpoint):
         if matching_endpoint:
-            self.logger.debug(f"Sending 'discover' to {matching_endpoint.ip}...")
-            matching_endpoint.conn.send('discover'.encode())
-            msg = matching_endpoint.conn.recv(2048)
-            self.logger.debug(f"{matching_endpoint.ip}: {msg}")
-            active_hosts = json.loads(msg)
+            self.logger.debug("Sending 'discover' to %s...", matching_endpoint.ip)
+            active_hosts = matching_endpoint.channel.call(self.request_json, 'discover')
+            self.logger.debug("%s: %s", matching_endpoint.ip, active_hosts)
 
         else:
             active_hosts = {}
@@ -92,77 +89,47 @@ class Commands:
     def call_anydesk(self, matching_endpoint) -> bool:
         self.logger.info(f'Running anydesk_command...')
         try:
-            self.logger.debug(f'Sending anydesk command to {matching_endpoint.conn}...')
-            matching_endpoint.conn.send('anydesk'.encode())
-
-            self.logger.debug(f'Waiting for response from {matching_endpoint.ip}......')
-            msg = matching_endpoint.conn.recv(1024).decode()
-            self.logger.debug(f'Client response: {msg}.')
-
-            if "OK" not in msg:
-                while "OK" not in msg:
-                    self.logger.debug(f'Waiting for response from {matching_endpoint.ip}...')
-                    msg = matching_endpoint.conn.recv(1024).decode()
-                    self.logger.debug(f'{matching_endpoint.ip}: {msg}...')
-
-                self.logger.debug(f'End of OK in msg loop.')
-                self.logger.info(f'anydesk_command completed.')
-                return True
-
-            else:
-                return True
+            self.logger.debug('Sending anydesk command to %s...', matching_endpoint.conn)
+            matching_endpoint.channel.call(self.wait_for_ok, 'anydesk', matching_endpoint)
+            self.logger.info(f'anydesk_command completed.')
+            return True
 
         except (WindowsError, ConnectionError, socket.error, RuntimeError) as e:
             self.logger.error(f'Connection Error: {e}.')
-            self.logger.debug(f'Calling server.remove_lost_connection({matching_endpoint})...')
-            self.server.remove_lost_connection(matching_endpoint)
+            self.logger.debug('Calling server.remove_lost_connection(%s)...', matching_endpoint)
+            self.remove_connection(matching_endpoint)
             return False
 
     def call_teamviewer(self, matching_endpoint) -> bool:
         self.logger.info(f'Running anydesk_command...')
         try:
-            self.logger.debug(f'Sending teamviewer command to {matching_endpoint.conn}...')
-            matching_endpoint.conn.send('teamviewer'.encode())
-
-            self.logger.debug(f'Waiting for response from {matching_endpoint.ip}......')
-            msg = matching_endpoint.conn.recv(1024).decode()
-            self.logger.debug(f'Client response: {msg}.')
-
-            if "OK" not in msg:
-                while "OK" not in msg:
-                    self.logger.debug(f'Waiting for response from {matching_endpoint.ip}...')
-                    msg = matching_endpoint.conn.recv(1024).decode()
-                    self.logger.debug(f'{matching_endpoint.ip}: {msg}...')
-
-                self.logger.debug(f'End of OK in msg loop.')
-                self.logger.info(f'teamviewer completed.')
-                return True
-
-            else:
-                return True
+            self.logger.debug('Sending teamviewer command to %s...', matching_endpoint.conn)
+            matching_endpoint.channel.call(self.wait_for_ok, 'teamviewer', matching_endpoint)
+            self.logger.info(f'teamviewer completed.')
+            return True
 
         except (WindowsError, ConnectionError, socket.error, RuntimeError) as e:
             self.logger.error(f'Connection Error: {e}.')
-            self.logger.debug(f'Calling server.remove_lost_connection({matching_endpoint})...')
-            self.server.remove_lost_connection(matching_endpoint)
+            self.logger.debug('Calling server.remove_lost_connection(%s)...', matching_endpoint)
+            self.remove_connection(matching_endpoint)
             return False
 
     def call_sysinfo(self, matching_endpoint):
         sysinfo = Sysinfo(self.main_path, self.log_path, matching_endpoint,
-                          self.remove_connection)
+                          self.remove_connection, artifacts=self.artifacts)
         if sysinfo.run():
-            latest_file = max(glob.glob(os.path.join(sysinfo.local_dir, 'systeminfo*.txt')), key=os.path.getmtime)
-            return str(latest_file)
+            latest = self.artifacts.latest(matching_endpoint.ident, 'sysinfo')
+            return latest.path if latest else False
 
         self.logger.info("No target")
         return False
 
     def call_tasks(self, matching_endpoint):
         tasks = Tasks(self.main_path, self.log_path,
-                      matching_endpoint, self.remove_connection)
+                      matching_endpoint, self.remove_connection, artifacts=self.artifacts)
         if tasks.run():
-            latest_file = max(glob.glob(os.path.join(tasks.local_dir, 'tasks*.txt')), key=os.path.getmtime)
-            return str(latest_file)
+            latest = self.artifacts.latest(matching_endpoint.ident, 'tasks')
+            return latest.path if latest else False
 
         return False
 
@@ -173,35 +140,38 @@ class Commands:
             if not str(task_name).endswith('.exe'):
                 task_name = f"{task_name}.exe"
 
-            matching_endpoint.conn.send('kill'.encode())
-            time.sleep(0.5)
-            matching_endpoint.conn.send(str(task_name).encode())
-            msg = matching_endpoint.conn.recv(1024).decode()
+            msg = matching_endpoint.channel.call(self.request_kill, str(task_name))
             self.logger.info(f'{msg}')
             return True, msg
             # return jsonify({'message': f'Killed task {task_name}'}), 200
 
         return False, f'Error killing {task_name}', 400
 
-    def call_restart(self, target):
+    def call_restart(self, target, timeout=None):
         try:
-            self.logger.debug(f'Sending restart to {target}...')
-            target.send('restart'.encode())
-            time.sleep(1.2)
+            self.logger.debug('Sending restart to %s...', target)
+            target.channel.submit(self.send_only, 'restart', timeout=timeout).result(timeout)
             return True
 
-        except (AttributeError, RuntimeError, WindowsError, socket.error) as e:
+        except TimeoutError:
+            self.logger.error(f'Restart of {target} timed out.')
+            raise
+
+        except (AttributeError, RuntimeError, socket.error) as e:
             self.logger.error(f'{e}')
             return False
 
-    def call_update(self, target) -> bool:
+    def call_update(self, target, timeout=None) -> bool:
         try:
-            self.logger.debug(f'Sending update to {target}...')
-            target.send('update'.encode())
-            time.sleep(1.2)
+            self.logger.debug('Sending update to %s...', target)
+            target.channel.submit(self.send_only, 'update', timeout=timeout).result(timeout)
             return True
 
-        except (RuntimeError, WindowsError, socket.error) as e:
+        except TimeoutError:
+            self.logger.error(f'Update of {target} timed out.')
+            raise
+
+        except (RuntimeError, socket.error) as e:
             self.logger.error(f'Update failed: {e}.')
             return False
 
@@ -212,6 +182,34 @@ class Commands:
 
     def count_files(self, endpoint):
         self.logger.info("Running count_files()...")
-        dir_path = os.path.join('static', 'images', endpoint.ident)
-        file_list = os.listdir(dir_path)
-        return len(file_list)
+        return self.storage.count(endpoint.ident)
+
+    def send_only(self, exchange, command) -> None:
+        exchange.send_command(command)
+
+    def request_text(self, exchange, command) -> str:
+        exchange.send_command(command)
+        return exchange.recv_text()
+
+    def request_json(self, exchange, command):
+        exchange.send_command(command)
+        return exchange.recv_json()
+
+    def request_kill(self, exchange, task_name) -> str:
+        exchange.send_command('kill')
+        exchange.send_message(protocol.MessageType.TEXT, task_name)
+        return exchange.recv_text()
+
+    def wait_for_ok(self, exchange, command, matching_endpoint) -> str:
+        exchange.send_command(command)
+
+        self.logger.debug('Waiting for response from %s......', matching_endpoint.ip)
+        msg = exchange.recv_text()
+        self.logger.debug('Client response: %s.', msg)
+
+        while "OK" not in msg:
+            self.logger.debug('Waiting for response from %s...', matching_endpoint.ip)
+            msg = exchange.recv_text()
+            self.logger.debug('%s: %s...', matching_endpoint.ip, msg)
+
+        return msg
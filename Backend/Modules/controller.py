@@ -1,8 +1,11 @@
 from .logger import init_logger
 from .commands import Commands
 from .utils import Handlers
+from .fanout import FanOut
+from .metrics import REGISTRY
+from . import events
+from flask import url_for
 import subprocess
-import threading
 import platform
 import json
 import time
@@ -10,20 +13,33 @@ import sys
 import os
 
 
+COMMAND_SECONDS = REGISTRY.histogram('handsoff_command_seconds', 'Duration of /control actions.', ('action', 'result'))
+
+
 class Controller:
-    def __init__(self, main_path, log_path, server, reload):
+    def __init__(self, main_path, log_path, server, reload, artifacts=None, storage=None, snapshots=None,
+                 tracer=None, clear_local=None):
         self.main_path = main_path
         self.log_path = log_path
         self.server = server
         self.reload = reload
+        self.artifacts = artifacts
+        self.storage = storage
+        self.snapshots = snapshots
+        self.tracer = tracer
+        self.clear_local = clear_local
 
         self.handlers = Handlers(self.log_path, self.main_path)
         self.logger = init_logger(self.log_path, __name__)
+        self.fanout = FanOut(self.log_path,
+                             workers=os.getenv('FANOUT_WORKERS', 64),
+                             timeout=os.getenv('FANOUT_TIMEOUT', 10),
+                             retries=os.getenv('FANOUT_RETRIES', 1))
 
     def browse_local_files(self, ident) -> subprocess:
         self.logger.info(f'Running browse_local_files_command...')
         directory = os.path.join('static', 'images', ident)
-        self.logger.debug(fr'Opening {directory}...')
+        self.logger.debug(r'Opening %s...', directory)
         if os.path.isdir(directory):
             if platform.system() == 'Windows':
                 return subprocess.Popen(rf"explorer {directory}")
@@ -43,118 +59,173 @@ class Controller:
     def count_files(self, matching_endpoint):
         self.logger.info("Running count_files()...")
         self.commands.shell_target = matching_endpoint.conn
-        dir_path = os.path.join('static', 'images', matching_endpoint.ident)
-        file_list = os.listdir(dir_path)
-        return len(file_list)
+        return self.storage.count(matching_endpoint.ident)
 
-    def multi_command(self, cmd, matching_endpoint, restarted, updated):
+    def multi_command(self, cmd, matching_endpoint, timeout=None) -> bool:
         if cmd == 'restart':
-            self.logger.debug(f"Restarting {matching_endpoint.ip} | {matching_endpoint.ident}...")
-            if self.commands.call_restart(matching_endpoint.conn):
-                restarted.append(matching_endpoint)
+            self.logger.debug("Restarting %s | %s...", matching_endpoint.ip, matching_endpoint.ident)
+            if self.commands.call_restart(matching_endpoint, timeout):
                 self.server.remove_lost_connection(matching_endpoint)
                 self.logger.info('Restart completed.')
+                return True
 
         if cmd == 'update':
-            self.logger.debug(f"Updating {matching_endpoint.ip} | {matching_endpoint.ident}...")
-            if self.commands.call_update(matching_endpoint.conn):
-                updated.append(matching_endpoint)
+            self.logger.debug("Updating %s | %s...", matching_endpoint.ip, matching_endpoint.ident)
+            if self.commands.call_update(matching_endpoint, timeout):
                 self.server.remove_lost_connection(matching_endpoint)
                 self.logger.info(f"Update completed.")
+                return True
+
+        return False
+
+    def handle_multi_command(self, cmd, data, collected):
+        self.logger.debug("Checked items: %s", data.get('checkedItems'))
+        targets = []
+        for item in data.get('checkedItems', []):
+            dicted = json.loads(item)
+            endpoint = self.server.endpoints.get_by_mac(dicted.get('id'))
+            if endpoint is not None:
+                targets.append(endpoint)
+
+        report = self.fanout.run(targets, lambda endpoint, timeout: self.multi_command(cmd, endpoint, timeout),
+                                 key=lambda endpoint: endpoint.ident,
+                                 on_result=lambda endpoint, outcome: self.server.events.endpoint_event(
+                                     events.COMMAND_PROGRESS, endpoint, action=cmd, phase=outcome['status'],
+                                     attempts=outcome['attempts'], error=outcome['error']))
+        succeeded = [outcome['target'] for outcome in report['succeeded']]
+        collected.extend(succeeded)
+
+        data = {
+            'type': cmd,
+            'message': f'Multi {cmd} sent to {succeeded}.',
+            'requested': len(targets),
+        }
+        data.update(report)
+        return True, data
 
     def handle_screenshot(self, matching_endpoint):
-        self.logger.debug(f"Calling self.commands.call_screenshot()...")
+        self.logger.debug("Calling self.commands.call_screenshot()...")
         if self.commands.call_screenshot(matching_endpoint):
             self.logger.info(f"Screenshot completed.")
             message = 'Screenshot complete!'
             return True, message
 
-        self.logger.debug(f"Screenshot failed.")
+        self.logger.debug("Screenshot failed.")
         message = 'Screenshot failed!'
         return False, message
 
     def handle_anydesk(self, matching_endpoint):
-        self.logger.debug(f"Calling self.commands.call_anydesk()...")
+        self.logger.debug("Calling self.commands.call_anydesk()...")
         if not self.commands.call_anydesk(matching_endpoint):
-            self.logger.debug(f"Anydesk missing.")
+            self.logger.debug("Anydesk missing.")
             return False, 'Anydesk missing'
 
-        self.logger.debug(f"Anydesk running.")
+        self.logger.debug("Anydesk running.")
         return True, 'Anydesk running.'
 
     def handle_teamviewer(self, matching_endpoint):
-        self.logger.debug(f"Calling self.commands.call_teamviewer()...")
+        self.logger.debug("Calling self.commands.call_teamviewer()...")
         if not self.commands.call_teamviewer(matching_endpoint):
-            self.logger.debug(f"teamviewer missing.")
+            self.logger.debug("teamviewer missing.")
             return False, 'Teamviewer is missing.'
 
         else:
-            self.logger.debug(f"TeamViewer running.")
+            self.logger.debug("TeamViewer running.")
             return True, 'TeamViewer running.'
 
+    def artifact_metadata(self, msg_type, latest_file, matching_endpoint) -> dict:
+        """Describe a received file for the UI; the content itself is fetched from ``url``."""
+        artifact = self.artifacts.get(latest_file)
+        return {
+            'type': msg_type,
+            'fileName': f'{latest_file}',
+            'size': artifact.size if artifact else os.path.getsize(latest_file),
+            'hash': artifact.hash if artifact else None,
+            'url': url_for('download_artifact', machine_name=matching_endpoint.ident,
+                           filename=os.path.basename(latest_file), _external=True),
+            'notificationCount': f'{self.count_files(matching_endpoint)}',
+        }
+
     def handle_sysinfo(self, matching_endpoint):
         latest_file = self.commands.call_sysinfo(matching_endpoint)
         if latest_file:
-            count = self.count_files(matching_endpoint)
             try:
-                with open(latest_file, 'r') as file:
-                    file_content = file.read()
-
-                data = {
-                    'type': 'system',
-                    'fileName': f'{latest_file}',
-                    'fileContent': f'{file_content}',
-                    'notificationCount': f'{count}',
-                }
-
-                return True, data
+                return True, self.artifact_metadata('system', latest_file, matching_endpoint)
 
             except Exception as e:
                 return False, e
 
         else:
-            return False, 'local dir not found'
+            return False, 'System information failed.'
 
     def handle_tasks(self, matching_endpoint):
         latest_file = self.commands.call_tasks(matching_endpoint)
-        count = self.count_files(matching_endpoint)
-        try:
-            with open(latest_file, 'r') as file:
-                file_content = file.read()
-
-            data = {
-                'type': 'tasks',
-                'fileName': f'{latest_file}',
-                'fileContent': f'{file_content}',
-                'notificationCount': f'{count}',
-            }
+        if not latest_file:
+            return False, 'Tasks failed.'
 
+        try:
+            data = self.artifact_metadata('tasks', latest_file, matching_endpoint)
+            snapshot = self.snapshots.latest(matching_endpoint.ident)
+            data['snapshotId'] = snapshot.id if snapshot else None
             return True, data
 
         except Exception as e:
-            return False, data
+            return False, e
 
     def handle_task_kill(self, matching_endpoint):
         self.commands = Commands(self.main_path, self.log_path,
-                                 matching_endpoint, self.server.remove_lost_connection)
+                                 matching_endpoint, self.server.remove_lost_connection,
+                                 artifacts=self.artifacts, storage=self.storage)
 
         result, message = self.commands.tasks_post_run(matching_endpoint)
         return message
 
     def handle_view(self, matching_endpoint):
-        self.logger.debug(f"<Handle View>")
-        self.logger.debug(f"{matching_endpoint}")
+        self.logger.debug("<Handle View>")
+        self.logger.debug("%s", matching_endpoint)
         self.browse_local_files(matching_endpoint.ident)
         return True, 'View message sent.'
 
+    def run_action(self, data, restarted, updated, matching_endpoint):
+        """Run a /control action, publishing its start and outcome as command_progress events."""
+        action = data.get('action')
+        self.server.events.endpoint_event(events.COMMAND_PROGRESS, matching_endpoint, action=action, phase='started')
+        started = time.perf_counter()
+        try:
+            result, message = self.traced_action(data, restarted, updated, matching_endpoint)
+
+        except Exception as e:
+            COMMAND_SECONDS.labels(action, 'error').observe(time.perf_counter() - started)
+            self.server.events.endpoint_event(events.COMMAND_PROGRESS, matching_endpoint, action=action,
+                                              phase='failed', error=f'{e}')
+            raise
+
+        COMMAND_SECONDS.labels(action, 'ok' if result else 'failed').observe(time.perf_counter() - started)
+        self.server.events.endpoint_event(events.COMMAND_PROGRESS, matching_endpoint, action=action,
+                                          phase='completed' if result else 'failed',
+                                          error=None if result else f'{message}')
+        return result, message
+
+    def traced_action(self, data, restarted, updated, matching_endpoint):
+        if self.tracer is None:
+            return self.handle_controller_action(data, restarted, updated, matching_endpoint)
+
+        with self.tracer.trace(data.get('action'), matching_endpoint.ident) as root:
+            result, message = self.handle_controller_action(data, restarted, updated, matching_endpoint)
+            if not result:
+                root.error = f'{message}'
+
+            return result, message
+
     def handle_controller_action(self, data, restarted, updated, matching_endpoint):
         self.commands = Commands(self.main_path, self.log_path,
-                                 matching_endpoint, self.server.remove_lost_connection)
+                                 matching_endpoint, self.server.remove_lost_connection,
+                                 artifacts=self.artifacts, storage=self.storage)
 
         if data['action'] == 'screenshot':
             self.logger.info(f"<Screenshot>")
             result, message = self.handle_screenshot(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return True, message
@@ -164,7 +235,7 @@ class Controller:
         if data['action'] == 'anydesk':
             self.logger.info(f"<Anydesk>")
             result, message = self.handle_anydesk(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return result, message
@@ -174,7 +245,7 @@ class Controller:
         if data['action'] == 'teamviewer':
             self.logger.info(f"<Teamviewer>")
             result, message = self.handle_teamviewer(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return True, message
@@ -184,7 +255,7 @@ class Controller:
         if data['action'] == 'sysinfo':
             self.logger.info(f"<System Information>")
             result, message = self.handle_sysinfo(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return True, message
@@ -194,7 +265,7 @@ class Controller:
         if data['action'] == 'tasks':
             self.logger.info(f"<Tasks>")
             result, message = self.handle_tasks(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return result, message
@@ -204,7 +275,7 @@ class Controller:
         if data['action'] == 'view':
             self.logger.info(f"<View Local Files>")
             result, message = self.handle_view(matching_endpoint)
-            self.logger.debug(f"{result} | {message}")
+            self.logger.debug("%s | %s", result, message)
 
             if result:
                 return True, message
@@ -213,7 +284,9 @@ class Controller:
 
         if data['action'] == 'clear_local':
             self.logger.info("<Clear Local Files>")
-            if self.handlers.clear_local(matching_endpoint):
+            # Backend.clear_local also drops the artifact index, storage stats and listing cache.
+            clear = self.clear_local or self.handlers.clear_local
+            if clear(matching_endpoint):
                 message = 'Files cleared.'
                 return True, message
 
@@ -223,53 +296,16 @@ class Controller:
 
         if data['action'] == 'restart':
             self.logger.info("<Restart>")
-            threads = []
-
-            self.logger.debug(f"Checked items: {data.get('checkedItems')}")
-            for item in data.get('checkedItems', []):
-                dicted = json.loads(item)
-                for endpoint in self.server.endpoints:
-                    if endpoint.client_mac == dicted.get('id'):
-                        thread = threading.Thread(target=self.multi_command,
-                                                  args=('restart', endpoint, restarted, updated),
-                                                  name=f'Restart {endpoint.conn}')
-                        threads.append(thread)
-
-            for thread in threads:
-                thread.start()
-
-            for thread in threads:
-                thread.join()
-
-            time.sleep(1)
-            self.logger.debug(f"Restarted {restarted}.")
+            result, message = self.handle_multi_command('restart', data, restarted)
+            self.logger.debug("Restarted %s.", restarted)
             self.logger.debug("Reloading app...")
             self.reload()
-            message = f'Multi restart sent to {restarted}.'
-            return True, message
+            return result, message
 
         if data['action'] == 'update':
             self.logger.info("<Update>")
-            threads = []
-
-            self.logger.debug(f"Checked items: {data.get('checkedItems')}")
-            for item in data.get('checkedItems', []):
-                dicted = json.loads(item)
-                for endpoint in self.server.endpoints:
-                    if endpoint.client_mac == dicted.get('id'):
-                        thread = threading.Thread(target=self.multi_command,
-                                                  args=('update', endpoint, restarted, updated),
-                                                  name=f'Update {endpoint.conn}')
-                        threads.append(thread)
-
-            for thread in threads:
-                thread.start()
-
-            for thread in threads:
-                thread.join()
-
+            result, message = self.handle_multi_command('update', data, updated)
             self.logger.info(f"Updated {updated}.")
-            self.logger.debug(f"Reloading app...")
+            self.logger.debug("Reloading app...")
             self.reload()
-            message = f'Multi Update sent to {updated}!'
-            return True, message
+            return result, message
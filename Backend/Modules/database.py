@@ -0,0 +1,221 @@
+from .logger import init_logger
+from .metrics import REGISTRY
+from threading import Thread
+from datetime import datetime
+import queue
+import time
+import json
+
+# PostgreSQL DB imports
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
+
+
+FLUSH_SECONDS = REGISTRY.histogram('handsoff_db_flush_seconds', 'Time to insert one batch of endpoint rows.')
+ROWS = REGISTRY.counter('handsoff_db_rows_total', 'Endpoint rows by insert outcome.', ('result',))
+
+class DatabaseWriter:
+    """Background ingest queue for endpoint rows.
+
+    ``enqueue`` never blocks: it snapshots the endpoint into a row and drops it
+    (with an error log) if the queue is full. A single writer thread batches
+    rows into multi-row INSERTs, flushing when ``batch_size`` rows are waiting
+    or the oldest row is ``flush_interval`` seconds old. Connections come from a
+    pool, and a lost or never-established database is retried with exponential
+    backoff while rows keep queueing.
+    """
+    insert_query = """
+    INSERT INTO endpoints (
+        client_mac, ip, ident, "user", client_version,
+        os_release, boot_time, connection_time, is_vm,
+        hardware, hdd, external_ip, wifi
+    ) VALUES %s
+    """
+    date_format = "%d/%b/%y %H:%M:%S"
+
+    def __init__(self, log_path, dbname, user, password, host, port,
+                 batch_size=500, flush_interval=1.0, max_queue=100000,
+                 min_connections=1, max_connections=4, max_backoff=60.0):
+        self.log_path = log_path
+        self.dsn = dict(dbname=dbname, user=user, password=password, host=host, port=port)
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.min_connections = int(min_connections)
+        self.max_connections = int(max_connections)
+        self.max_backoff = float(max_backoff)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.rows = queue.Queue(maxsize=int(max_queue))
+        self.pool = None
+        self.backoff = 1.0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    def __str__(self):
+        return f"DatabaseWriter(host={self.dsn['host']}, dbname={self.dsn['dbname']})"
+
+    def __repr__(self):
+        return (f"DatabaseWriter(host={self.dsn['host']}, dbname={self.dsn['dbname']}, "
+                f"batch_size={self.batch_size}, queued={self.rows.qsize()}, connected={self.pool is not None})")
+
+    @property
+    def connected(self) -> bool:
+        return self.pool is not None
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True, name="DB Writer Thread")
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def to_row(self, endpoint) -> tuple:
+        return (
+            endpoint.client_mac,
+            endpoint.ip,
+            endpoint.ident,
+            endpoint.user,
+            endpoint.client_version,
+            endpoint.os_release,
+            datetime.strptime(endpoint.boot_time, self.date_format),
+            datetime.strptime(endpoint.connection_time, self.date_format),
+            endpoint.is_vm,
+            json.dumps(endpoint.hardware),
+            json.dumps(endpoint.hdd),
+            endpoint.external_ip,
+            json.dumps(endpoint.wifi)
+        )
+
+    def enqueue(self, endpoint) -> bool:
+        try:
+            self.rows.put_nowait(self.to_row(endpoint))
+            return True
+
+        except (ValueError, TypeError) as e:
+            self.logger.error(f"Invalid endpoint data for {endpoint}: {e}")
+
+        except queue.Full:
+            self.dropped += 1
+            self.logger.error(f"DB queue full, dropped row for {endpoint} ({self.dropped} dropped so far).")
+
+        return False
+
+    def connect(self) -> bool:
+        self.logger.debug("Connecting to database...")
+        try:
+            self.pool = pg_pool.ThreadedConnectionPool(self.min_connections, self.max_connections, **self.dsn)
+            self.backoff = 1.0
+            self.logger.info("Connected to DB!")
+            return True
+
+        except psycopg2.OperationalError as e:
+            self.logger.error(f"Error connecting to DB: {e}. Retrying in {self.backoff:.0f}s.")
+            self.pool = None
+            return False
+
+    def wait_backoff(self) -> None:
+        time.sleep(self.backoff)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def collect(self, batch) -> None:
+        """Fill ``batch`` until it is full or its oldest row has waited ``flush_interval``."""
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+            if deadline is not None and timeout <= 0:
+                return
+
+            try:
+                row = self.rows.get(timeout=timeout)
+
+            except queue.Empty:
+                return
+
+            batch.append(row)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, batch) -> bool:
+        started = time.perf_counter()
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                execute_values(cursor, self.insert_query, batch, page_size=self.batch_size)
+
+            conn.commit()
+            self.pool.putconn(conn)
+            FLUSH_SECONDS.observe(time.perf_counter() - started)
+            ROWS.labels('inserted').inc(len(batch))
+            self.logger.info(f"{len(batch)} endpoint rows inserted into the database.")
+            return True
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self.drop_connection(conn, e)
+            return False
+
+        except Exception as e:
+            self.logger.error(f"Failed to insert {len(batch)} rows into the database: {e}. "
+                              f"Retrying them one at a time.")
+            conn.rollback()
+            return self.insert_each(conn, batch)
+
+    def insert_each(self, conn, batch) -> bool:
+        """Insert ``batch`` row by row, so a bad row is dropped on its own instead of
+        taking the rest of the batch with it.
+
+        On a lost connection the rows already committed are removed from ``batch``
+        and False is returned, so only the remainder is retried.
+        """
+        done = 0
+        try:
+            with conn.cursor() as cursor:
+                for row in batch:
+                    try:
+                        execute_values(cursor, self.insert_query, [row])
+                        conn.commit()
+                        ROWS.labels('inserted').inc()
+
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        raise
+
+                    except Exception as e:
+                        # Bad data: retrying this row would fail forever, so drop it.
+                        self.logger.error(f"Dropped endpoint row for {row[2]} ({row[0]}): {e}")
+                        ROWS.labels('rejected').inc()
+                        conn.rollback()
+
+                    done += 1
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            del batch[:done]
+            self.drop_connection(conn, e)
+            return False
+
+        self.pool.putconn(conn)
+        return True
+
+    def drop_connection(self, conn, error) -> None:
+        self.logger.error(f"Lost database connection: {error}")
+        self.pool.putconn(conn, close=True)
+        self.pool.closeall()
+        self.pool = None
+
+    def run(self) -> None:
+        batch = []
+        while self.running:
+            if self.pool is None and not self.connect():
+                self.wait_backoff()
+                continue
+
+            self.collect(batch)
+            if not batch:
+                continue
+
+            if self.flush(batch):
+                batch = []
+
+            else:
+                self.wait_backoff()
@@ -0,0 +1,81 @@
+from .logger import init_logger
+from threading import Thread
+import queue
+import time
+
+
+ENDPOINT_CONNECTED = 'endpoint_connected'
+ENDPOINT_LOST = 'endpoint_lost'
+LIVENESS_CHANGED = 'liveness_changed'
+COMMAND_PROGRESS = 'command_progress'
+ARTIFACT_READY = 'artifact_ready'
+
+# Events every dashboard needs for the endpoints table, whatever machine it has open.
+FLEET_EVENTS = {ENDPOINT_CONNECTED, ENDPOINT_LOST, LIVENESS_CHANGED}
+FLEET_ROOM = 'fleet'
+
+
+def endpoint_room(ident) -> str:
+    return f"endpoint:{ident}"
+
+
+class EventBus:
+    """Queue of typed fleet events, pushed to browsers over Socket.IO rooms.
+
+    ``publish`` never blocks the caller (accept, heartbeat and command threads);
+    a single thread drains the queue and emits each event to the room of the
+    endpoint it concerns, plus the fleet room for connection and liveness
+    changes. Nothing is emitted until ``bind`` attaches the Socket.IO server.
+    """
+
+    def __init__(self, log_path, max_queue=10000):
+        self.log_path = log_path
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.events = queue.Queue(maxsize=int(max_queue))
+        self.sio = None
+        self.dropped = 0
+        self.thread = None
+
+    def __str__(self):
+        return f"EventBus(bound={self.sio is not None})"
+
+    def __repr__(self):
+        return f"EventBus(bound={self.sio is not None}, queued={self.events.qsize()}, dropped={self.dropped})"
+
+    def bind(self, sio) -> None:
+        self.sio = sio
+        self.thread = Thread(target=self.run, daemon=True, name="Events Thread")
+        self.thread.start()
+
+    def publish(self, event, ident, **data) -> None:
+        if self.sio is None:
+            return
+
+        data.update(event=event, ident=ident, ts=time.time())
+        try:
+            self.events.put_nowait(data)
+
+        except queue.Full:
+            self.dropped += 1
+            self.logger.error(f"Event queue full, dropped {event} for {ident} ({self.dropped} dropped so far).")
+
+    def endpoint_event(self, event, endpoint, /, **data) -> None:
+        # Positional-only, so an event can still carry an ``endpoint`` field (endpoint_connected does).
+        self.publish(event, endpoint.ident, client_mac=endpoint.client_mac, ip=endpoint.ip, **data)
+
+    def on_artifact(self, artifact) -> None:
+        self.publish(ARTIFACT_READY, artifact.ident, artifact=artifact.to_dict())
+
+    def run(self) -> None:
+        while True:
+            data = self.events.get()
+            rooms = [endpoint_room(data['ident'])]
+            if data['event'] in FLEET_EVENTS:
+                rooms.append(FLEET_ROOM)
+
+            try:
+                self.sio.emit(data['event'], data, to=rooms)
+
+            except Exception as e:
+                self.logger.error(f"Failed emitting {data['event']}: {e}")
@@ -0,0 +1,86 @@
+from .logger import init_logger
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+import time
+
+
+class FanOut:
+    """Runs one action against many endpoints with bounded concurrency.
+
+    ``action(target, timeout)`` returns truthy on success and may raise. Each
+    target gets up to ``retries`` extra attempts after a failure; a timeout is
+    not retried, because the command may still reach the agent. The whole run
+    is bounded by a deadline, and the result reports every target as
+    succeeded, failed, timed out or still pending, so a partial failure is
+    visible instead of hiding behind a single True.
+    """
+
+    def __init__(self, log_path, workers=64, timeout=10.0, retries=1, retry_delay=0.5):
+        self.log_path = log_path
+        self.workers = int(workers)
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.retry_delay = float(retry_delay)
+        self.logger = init_logger(self.log_path, __name__)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="FanOut")
+
+    def __str__(self):
+        return f"FanOut(workers={self.workers}, timeout={self.timeout}, retries={self.retries})"
+
+    def __repr__(self):
+        return (f"FanOut(workers={self.workers}, timeout={self.timeout}, retries={self.retries}, "
+                f"retry_delay={self.retry_delay})")
+
+    def attempt(self, action, target) -> dict:
+        result = {'status': 'failed', 'attempts': 0, 'error': None}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * attempt)
+
+            result['attempts'] = attempt + 1
+            try:
+                if action(target, self.timeout):
+                    result['status'] = 'succeeded'
+                    result['error'] = None
+                    return result
+
+                result['error'] = 'action returned False'
+
+            except TimeoutError:
+                result['status'] = 'timed_out'
+                result['error'] = f'no completion within {self.timeout}s'
+                return result
+
+            except Exception as e:
+                result['error'] = f'{e}'
+
+        return result
+
+    def run(self, targets, action, key=str, on_result=None) -> dict:
+        """``on_result(target, outcome)``, if given, is called as each target finishes."""
+        targets = list(targets)
+        self.logger.info(f"Fanning out to {len(targets)} targets with {self}...")
+        started = time.monotonic()
+        futures = {self.executor.submit(self.attempt, action, target): target for target in targets}
+        if on_result is not None:
+            for future, target in futures.items():
+                future.add_done_callback(
+                    lambda done, target=target: None if done.cancelled() else on_result(target, done.result()))
+
+        # Worst case per target is every attempt timing out plus the retry delays.
+        per_target = (self.timeout + self.retry_delay * self.retries) * (self.retries + 1)
+        batches = -(-len(targets) // self.workers) if targets else 0
+        done, not_done = wait(futures, timeout=per_target * max(1, batches))
+
+        report = {'succeeded': [], 'failed': [], 'timed_out': [], 'pending': []}
+        for future in done:
+            outcome = future.result()
+            outcome['target'] = key(futures[future])
+            report[outcome['status']].append(outcome)
+
+        for future in not_done:
+            future.cancel()
+            report['pending'].append({'target': key(futures[future]), 'status': 'pending'})
+
+        self.logger.info(f"Fan-out finished in {time.monotonic() - started:.2f}s: "
+                         f"{ {status: len(items) for status, items in report.items()} }")
+        return report
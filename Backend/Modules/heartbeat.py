@@ -0,0 +1,139 @@
+from .logger import init_logger
+from .metrics import REGISTRY
+from threading import Thread, Condition, BoundedSemaphore
+import random
+import heapq
+import time
+
+
+PROBE_SECONDS = REGISTRY.histogram('handsoff_heartbeat_seconds', 'Round trip of answered heartbeat probes.')
+PROBES = REGISTRY.counter('handsoff_heartbeats_total', 'Heartbeat probes by result.', ('result',))
+
+
+class Heartbeat:
+    """Background liveness scheduler.
+
+    Every endpoint gets a probe roughly every ``interval`` seconds (spread by
+    ``jitter`` so a reconnect storm does not turn into probe storms). At most
+    ``workers`` probes are in flight at once and each one is bounded by
+    ``timeout``. Results are stored on the endpoint (alive, last_seen, rtt), so
+    readers never have to touch the network.
+    """
+
+    def __init__(self, server, log_path, interval=30.0, timeout=5.0, workers=64, jitter=0.2):
+        self.server = server
+        self.log_path = log_path
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self.workers = int(workers)
+        self.jitter = float(jitter)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.condition = Condition()
+        self.slots = BoundedSemaphore(self.workers)
+        self.queue = []
+        self.scheduled = set()
+        self.running = False
+        self.thread = None
+
+    def __str__(self):
+        return f"Heartbeat(interval={self.interval}, timeout={self.timeout}, workers={self.workers})"
+
+    def __repr__(self):
+        return (f"Heartbeat(interval={self.interval}, timeout={self.timeout}, workers={self.workers}, "
+                f"jitter={self.jitter}, scheduled={len(self.scheduled)})")
+
+    def start(self) -> None:
+        self.logger.info(f"Starting heartbeat scheduler: {self}")
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True, name="Heartbeat Thread")
+        self.thread.start()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def next_due(self, now) -> float:
+        spread = self.interval * self.jitter
+        return now + self.interval + random.uniform(-spread, spread)
+
+    def schedule(self, endpoint, delay=None) -> None:
+        """Start probing ``endpoint``; the first probe lands at a random point of one interval."""
+        with self.condition:
+            if endpoint.client_mac in self.scheduled:
+                return
+
+            if delay is None:
+                delay = random.uniform(0, self.interval)
+
+            self.scheduled.add(endpoint.client_mac)
+            heapq.heappush(self.queue, (time.monotonic() + delay, endpoint.client_mac))
+            self.condition.notify()
+
+    def probe_all(self) -> None:
+        """Make every registered endpoint due now."""
+        with self.condition:
+            now = time.monotonic()
+            self.queue = [(now, mac) for mac in self.scheduled]
+            heapq.heapify(self.queue)
+            self.condition.notify()
+
+        for endpoint in self.server.endpoints:
+            self.schedule(endpoint, delay=0)
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    wait = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.condition.wait(wait)
+
+                if not self.running:
+                    return
+
+                due, client_mac = heapq.heappop(self.queue)
+
+            endpoint = self.server.endpoints.get_by_mac(client_mac)
+            if endpoint is None:
+                with self.condition:
+                    self.scheduled.discard(client_mac)
+
+                continue
+
+            with self.condition:
+                heapq.heappush(self.queue, (self.next_due(time.monotonic()), client_mac))
+
+            if endpoint.channel.busy:
+                # A command is running on this socket; it will surface a dead agent on its own.
+                self.logger.debug("Skipping probe of busy %s.", endpoint.ident)
+                continue
+
+            self.slots.acquire()
+            self.probe(endpoint)
+
+    def probe(self, endpoint) -> None:
+        started = time.monotonic()
+        future = endpoint.channel.submit(self.server.probe, timeout=self.timeout)
+        future.add_done_callback(lambda done: self.record(endpoint, started, done))
+
+    def record(self, endpoint, started, future) -> None:
+        self.slots.release()
+        try:
+            answer = future.result()
+
+        except Exception as e:
+            self.logger.debug("Probe of %s failed: %s", endpoint.ident, e)
+            answer = None
+
+        if answer == self.server.callback:
+            rtt = time.monotonic() - started
+            PROBE_SECONDS.observe(rtt)
+            PROBES.labels('alive').inc()
+            self.server.mark_alive(endpoint, rtt)
+            return
+
+        PROBES.labels('dead').inc()
+        self.logger.debug('removing %s...', endpoint)
+        self.server.mark_dead(endpoint)
+        self.server.remove_lost_connection(endpoint)
@@ -0,0 +1,150 @@
+from collections import deque
+from datetime import datetime
+from threading import Lock
+import itertools
+import time
+
+
+class Session:
+    __slots__ = ('id', 'client_mac', 'ident', 'ip', 'user', 'connected_at', 'disconnected_at', 'reason')
+
+    def __init__(self, session_id, endpoint, connected_at):
+        self.id = session_id
+        self.client_mac = endpoint.client_mac
+        self.ident = endpoint.ident
+        self.ip = endpoint.ip
+        self.user = endpoint.user
+        self.connected_at = connected_at
+        self.disconnected_at = None
+        self.reason = None
+
+    def __repr__(self):
+        return f"Session(id={self.id}, ident={self.ident}, ip={self.ip}, connected_at={self.connected_at})"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "client_mac": self.client_mac,
+            "ident": self.ident,
+            "ip": self.ip,
+            "user": self.user,
+            "connected_at": self.format(self.connected_at),
+            "disconnected_at": self.format(self.disconnected_at),
+            "reason": self.reason,
+            "connected_ts": self.connected_at,
+            "disconnected_ts": self.disconnected_at
+        }
+
+    @staticmethod
+    def format(timestamp):
+        if timestamp is None:
+            return None
+
+        return datetime.fromtimestamp(timestamp).strftime("%d/%b/%y %H:%M:%S")
+
+
+class ConnectionHistory:
+    """Bounded store of connection sessions.
+
+    Sessions live in one global ring (oldest evicted first, by count or age) and
+    in a small per-endpoint ring. Session ids are increasing and contiguous in the
+    global ring, which gives keyset pagination without scanning: a page is
+    "``limit`` sessions with id below ``cursor``", newest first.
+    """
+
+    def __init__(self, max_records=10000, max_age=7 * 24 * 3600, per_endpoint=100):
+        self.max_records = int(max_records)
+        self.max_age = float(max_age)
+        self.per_endpoint = int(per_endpoint)
+
+        self.lock = Lock()
+        self.sessions = deque()
+        self.by_mac = {}
+        self.open_sessions = {}
+        self.ids = itertools.count(1)
+
+    def __str__(self):
+        return f"ConnectionHistory(sessions={len(self)})"
+
+    def __repr__(self):
+        return (f"ConnectionHistory(sessions={len(self)}, open={len(self.open_sessions)}, "
+                f"max_records={self.max_records}, max_age={self.max_age})")
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def open(self, endpoint, now=None) -> Session:
+        now = time.time() if now is None else now
+        with self.lock:
+            self._close(endpoint.client_mac, now, 'replaced')
+            session = Session(next(self.ids), endpoint, now)
+            self.sessions.append(session)
+            self.by_mac.setdefault(endpoint.client_mac, deque(maxlen=self.per_endpoint)).append(session)
+            self.open_sessions[endpoint.client_mac] = session
+            self._evict(now)
+            return session
+
+    def close(self, endpoint, reason='lost', now=None) -> None:
+        with self.lock:
+            self._close(endpoint.client_mac, time.time() if now is None else now, reason)
+
+    def _close(self, client_mac, now, reason) -> None:
+        session = self.open_sessions.pop(client_mac, None)
+        if session is not None:
+            session.disconnected_at = now
+            session.reason = reason
+
+    def _evict(self, now) -> None:
+        oldest = now - self.max_age
+        while self.sessions and (len(self.sessions) > self.max_records or
+                                 self.sessions[0].connected_at < oldest):
+            session = self.sessions.popleft()
+            per_mac = self.by_mac.get(session.client_mac)
+            if per_mac and per_mac[0] is session:
+                per_mac.popleft()
+                if not per_mac:
+                    del self.by_mac[session.client_mac]
+
+    def query(self, limit=50, cursor=None, since=None, until=None, client_mac=None):
+        """Return ``(sessions, next_cursor)``: up to ``limit`` sessions newest first,
+        with id below ``cursor`` and connected within ``[since, until]``."""
+        limit = max(1, limit)
+        with self.lock:
+            if client_mac is not None:
+                source = self.by_mac.get(client_mac, ())
+                candidates = reversed(source)
+
+            else:
+                candidates = self._reversed_from(cursor)
+
+            page = []
+            for session in candidates:
+                if cursor is not None and session.id >= cursor:
+                    continue
+
+                if until is not None and session.connected_at > until:
+                    continue
+
+                if since is not None and session.connected_at < since:
+                    break
+
+                page.append(session)
+                if len(page) > limit:
+                    break
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1].id
+
+        return [session.to_dict() for session in page], next_cursor
+
+    def _reversed_from(self, cursor):
+        # Ids in the global ring are contiguous, so the cursor maps to a position. Indexing a
+        # deque is O(n), so that position is reached by skipping along the reversed iterator.
+        if not self.sessions:
+            return iter(())
+
+        first_id = self.sessions[0].id
+        end = len(self.sessions) if cursor is None else max(0, min(len(self.sessions), cursor - first_id))
+        return itertools.islice(reversed(self.sessions), len(self.sessions) - end, None)
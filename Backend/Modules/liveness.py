@@ -0,0 +1,106 @@
+from .logger import init_logger
+from threading import Thread, Lock
+import select
+import socket
+
+
+class PassiveMonitor:
+    """Detects dead agents without sending them anything.
+
+    Accepted sockets get kernel TCP keepalive, and all of them sit in one epoll
+    set watching for hang-up, error and peer shutdown. When the kernel reports
+    one of those (including a keepalive that went unanswered), the endpoint is
+    marked dead and handed to ``remove_lost_connection``.
+    """
+    events = getattr(select, 'EPOLLRDHUP', 0x2000) | getattr(select, 'EPOLLHUP', 0x10) | \
+        getattr(select, 'EPOLLERR', 0x8)
+
+    def __init__(self, server, log_path, idle=60, interval=10, count=5):
+        self.server = server
+        self.log_path = log_path
+        self.idle = int(idle)
+        self.interval = int(interval)
+        self.count = int(count)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.watched = {}
+        self.fds = {}
+        self.running = False
+        self.thread = None
+        self.epoll = select.epoll() if self.supported() else None
+
+    def __str__(self):
+        return f"PassiveMonitor(idle={self.idle}, interval={self.interval}, count={self.count})"
+
+    def __repr__(self):
+        return (f"PassiveMonitor(idle={self.idle}, interval={self.interval}, count={self.count}, "
+                f"watched={len(self.watched)})")
+
+    @staticmethod
+    def supported() -> bool:
+        return hasattr(select, 'epoll')
+
+    def configure_keepalive(self, conn) -> None:
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.idle)
+
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.interval)
+
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.count)
+
+    def start(self) -> None:
+        self.logger.info(f"Starting passive liveness monitor: {self}")
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True, name="Liveness Thread")
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def watch(self, endpoint) -> None:
+        try:
+            self.configure_keepalive(endpoint.conn)
+            fd = endpoint.conn.fileno()
+            with self.lock:
+                if fd in self.watched:
+                    self.epoll.modify(fd, self.events)
+
+                else:
+                    self.epoll.register(fd, self.events)
+
+                self.watched[fd] = endpoint
+                self.fds[endpoint] = fd
+
+        except OSError as e:
+            self.logger.error(f"Failed watching {endpoint.ident}: {e}")
+
+    def unwatch(self, endpoint) -> None:
+        """Stop watching ``endpoint``; must run before its socket is closed."""
+        with self.lock:
+            fd = self.fds.pop(endpoint, None)
+            if fd is None or self.watched.get(fd) is not endpoint:
+                return
+
+            del self.watched[fd]
+            try:
+                self.epoll.unregister(fd)
+
+            except (OSError, ValueError):
+                pass
+
+    def run(self) -> None:
+        while self.running:
+            for fd, mask in self.epoll.poll(1.0):
+                with self.lock:
+                    endpoint = self.watched.get(fd)
+
+                if endpoint is None:
+                    continue
+
+                self.logger.info(f"{endpoint.ident} hung up (events={mask:#x}).")
+                self.server.mark_dead(endpoint)
+                self.server.remove_lost_connection(endpoint)
@@ -1,29 +1,53 @@
+from threading import Lock
 import logging
 import logging.handlers
+import atexit
 import queue
 import os
 
 
+_listeners = {}
+_listeners_lock = Lock()
+
+
+def file_handler(log_path) -> logging.Handler:
+    """Rotating file handler; LOG_ROTATE picks size (default) or time based rotation."""
+    backups = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    if os.getenv('LOG_ROTATE', 'size').lower() == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(log_path, when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+                                                            backupCount=backups, delay=True)
+
+    else:
+        handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=int(os.getenv('LOG_MAX_BYTES', 10485760)),
+                                                       backupCount=backups, delay=True)
+
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(funcName)s - %(levelname)s: %(message)s'))
+    return handler
+
+
+def log_queue(log_path) -> queue.Queue:
+    """One queue and one background writer thread per log file, shared by every logger."""
+    with _listeners_lock:
+        if log_path not in _listeners:
+            records = queue.Queue(-1)
+            listener = logging.handlers.QueueListener(records, file_handler(log_path), respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            _listeners[log_path] = (records, listener)
+
+        return _listeners[log_path][0]
+
+
 def init_logger(log_path, name):
     if log_path:
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
 
-        log_queue = queue.Queue()
-        queue_handler = logging.handlers.QueueHandler(log_queue)
-
         logger = logging.getLogger(name)
         if not logger.handlers:
-            logger.setLevel(logging.DEBUG)
+            # Callers only pay for enqueueing a record; file writes and rotation happen on the listener thread.
+            logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
             logger.propagate = False
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(funcName)s - %(levelname)s: %(message)s')
-
-            if not os.path.isfile(log_path):
-                open(log_path, 'w').close()  # Create an empty log file if it doesn't exist
-
-            info = logging.FileHandler(log_path)
-            info.setLevel(logging.DEBUG)
-            info.setFormatter(formatter)
-            logger.addHandler(info)
+            logger.addHandler(logging.handlers.QueueHandler(log_queue(log_path)))
 
         return logger
     else:
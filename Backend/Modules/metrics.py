@@ -0,0 +1,270 @@
+from threading import Lock
+import bisect
+import math
+import time
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; wide enough for a heartbeat round trip at one end and a large file transfer at the other.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def escape_help(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n')
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+
+    if isinstance(value, int):
+        return str(value)
+
+    return repr(float(value))
+
+
+def format_labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{escape(extra[1])}"')
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterValue:
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount=1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield '', None, self.value
+
+
+class GaugeValue:
+    __slots__ = ('lock', 'value', 'function')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+        self.function = None
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def inc(self, amount=1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1) -> None:
+        self.inc(-amount)
+
+    def set_function(self, function) -> None:
+        """Read the value from ``function()`` at scrape time instead of tracking it."""
+        self.function = function
+
+    def samples(self):
+        yield '', None, self.function() if self.function is not None else self.value
+
+
+class HistogramValue:
+    __slots__ = ('lock', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket
+            yield '_bucket', ('le', format_value(bound)), cumulative
+
+        yield '_sum', None, total
+        yield '_count', None, count
+
+
+class Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metric:
+    """A named metric with one value per combination of label values.
+
+    ``labels(...)`` returns the value object for a label combination; callers on
+    hot paths can keep it around. Each value has its own lock, held only for
+    the update itself, so threads touching different endpoints or commands
+    never wait on each other.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self.values = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(name={self.name})"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name}, labels={self.labelnames}, series={len(self.values)})"
+
+    def new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+
+        key = tuple(str(value) for value in values)
+        value = self.values.get(key)
+        if value is None:
+            with self.lock:
+                value = self.values.setdefault(key, self.new_value())
+
+        return value
+
+    def remove(self, *values) -> None:
+        with self.lock:
+            self.values.pop(tuple(str(value) for value in values), None)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {escape_help(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            series = list(self.values.items())
+
+        for key, value in series:
+            for suffix, extra, sample in value.samples():
+                lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, key, extra)} {format_value(sample)}")
+
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def new_value(self):
+        return GaugeValue()
+
+    def set(self, value) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function) -> None:
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value) -> None:
+        self.labels().observe(value)
+
+    def time(self, *values):
+        return Timer(self.labels(*values))
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics, rendered in the Prometheus text exposition format.
+
+    Registering a name twice returns the existing metric, so modules can declare
+    the metrics they update at import time without coordinating with each other.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = {}
+
+    def __str__(self):
+        return f"MetricsRegistry(metrics={len(self.metrics)})"
+
+    def __repr__(self):
+        return f"MetricsRegistry(metrics={sorted(self.metrics)})"
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.setdefault(metric.name, metric)
+
+        if type(existing) is not type(metric):
+            raise ValueError(f"{metric.name} is already registered as a {existing.kind}")
+
+        return existing
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
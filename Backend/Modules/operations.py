@@ -1,7 +1,12 @@
 from flask import request, jsonify, url_for
 from datetime import datetime
+from urllib.parse import quote
+from threading import Lock
+from collections import OrderedDict
+from .artifacts import ArtifactIndex
 from .logger import init_logger
 import psutil
+import bisect
 import os
 
 
@@ -12,6 +17,12 @@ class Operations:
         self.log_path = backend.log_path
         self.logger = init_logger(self.log_path, __name__)
 
+        # LRU of directory -> keys; only directories that exist on disk are cached.
+        self.listings = OrderedDict()
+        self.max_listings = int(os.getenv('LISTING_CACHE_SIZE', 1024))
+        self.listings_lock = Lock()
+        self.backend.artifacts.subscribe(self.on_artifact)
+
     def control(self):
         self.logger.info(f"<Control>")
 
@@ -19,14 +30,14 @@ class Operations:
         updated = []
 
         data = request.get_json()
-        self.logger.debug(f"Command: {data}")
+        self.logger.debug("Command: %s", data)
 
         matching_endpoint = self.backend.find_matching_endpoint(data)
-        self.logger.debug(f"Matching Endpoint: {matching_endpoint}.")
+        self.logger.debug("Matching Endpoint: %s.", matching_endpoint)
         if matching_endpoint:
-            handler, message = self.backend.controller.handle_controller_action(
+            handler, message = self.backend.controller.run_action(
                 data, restarted, updated, matching_endpoint)
-            self.logger.debug(f"Handler: {handler} | Message: {message}\n")
+            self.logger.debug("Handler: %s | Message: %s\n", handler, message)
 
             if handler:
                 try:
@@ -36,6 +47,10 @@ class Operations:
                 except TypeError:
                     return jsonify({'message': message})
 
+            if handler is False:
+                self.logger.error(f"{data.get('action')} failed: {message}")
+                return jsonify({'message': f'{message}'}), 500
+
             self.logger.error(f"Unknown command: {data}")
             return jsonify({'message': f'Unknown command: {data}'})
 
@@ -43,54 +58,107 @@ class Operations:
     
     def get_files(self):
         directory = request.args.get('directory')
-        self.logger.debug(f"Get Files: Directory: {directory}")
+        self.logger.debug("Get Files: Directory: %s", directory)
         if not directory:
             return jsonify({'error': 'Directory parameter is missing'}), 400
 
-        images_dir = os.path.join(self.main_path, directory, 'images')
-        self.logger.debug(f"Images Dir: {images_dir}")
+        # Without ?limit= the whole listing is returned, as before paging existed.
+        limit = request.args.get('limit')
+        try:
+            limit = max(1, min(int(limit), 1000)) if limit is not None else None
+
+        except ValueError:
+            return jsonify({'error': f"Invalid parameter 'limit': {limit!r} is not an integer"}), 400
 
         try:
-            # Get file names
-            image_files = os.listdir(images_dir) if os.path.exists(images_dir) else []
+            cursor = self.parse_cursor(request.args.get('cursor'))
 
-            self.logger.debug(f"Get Files: Compiling images urls...")
-            image_urls = [
-                url_for('serve_images', machine_name=directory, filename=f, _external=True) for f in image_files
-            ]
+        except ValueError:
+            return jsonify({'error': "Invalid parameter 'cursor': pass back a next_cursor value"}), 400
+
+        try:
+            keys = self.list_images(directory)
+            start = bisect.bisect_right(keys, cursor) if cursor else 0
+            limit = limit or len(keys)
+            page = keys[start:start + limit]
+
+            # One url_for per request; every file URL is this prefix plus its quoted name.
+            prefix = url_for('serve_images', machine_name=directory, filename='_', _external=True)[:-1]
+            next_cursor = None
+            if start + limit < len(keys):
+                neg_mtime, name = page[-1]
+                next_cursor = f"{-neg_mtime!r}:{name}"
 
             return jsonify({
-                'images': image_urls
+                'images': [prefix + quote(name) for neg_mtime, name in page],
+                'next_cursor': next_cursor,
+                'total': len(keys)
             })
 
         except Exception as e:
             self.logger.error(f"Error while retreiving files: {e}")
             return jsonify({'error': str(e)}), 500
 
+    @staticmethod
+    def parse_cursor(cursor):
+        if not cursor:
+            return None
+
+        mtime, name = cursor.split(':', 1)
+        return -float(mtime), name
+
+    def list_images(self, directory) -> list:
+        """Newest-first ``(-mtime, name)`` keys of a directory's screenshots, cached until it changes."""
+        with self.listings_lock:
+            keys = self.listings.get(directory)
+            if keys is not None:
+                self.listings.move_to_end(directory)
+                return keys
+
+        keys = []
+        images_dir = os.path.join(self.main_path, directory, 'images')
+        try:
+            with os.scandir(images_dir) as entries:
+                for entry in entries:
+                    if ArtifactIndex.classify(entry.name) == 'screenshot' and entry.is_file():
+                        keys.append((-entry.stat().st_mtime, entry.name))
+
+        except (FileNotFoundError, NotADirectoryError):
+            # Not an endpoint folder (or not yet): nothing worth a cache entry.
+            return keys
+
+        keys.sort()
+        with self.listings_lock:
+            self.listings[directory] = keys
+            self.listings.move_to_end(directory)
+            while len(self.listings) > self.max_listings:
+                self.listings.popitem(last=False)
+
+        return keys
+
+    def invalidate_listing(self, directory) -> None:
+        with self.listings_lock:
+            self.listings.pop(directory, None)
+
+    def on_artifact(self, artifact) -> None:
+        if artifact.type == 'screenshot':
+            self.invalidate_listing(artifact.ident)
+
     def count_files(self):
         self.logger.info("Running count_files()...")
         folder_details = {}
 
         try:
             selected_id = self.backend.selected_row_data['client_mac']
-            matching_endpoints = [ep for ep in self.backend.server.endpoints if ep.client_mac == selected_id]
+            endpoint = self.backend.server.endpoints.get_by_mac(selected_id)
 
-            if not matching_endpoints:
+            if endpoint is None:
                 return {'error': 'No matching endpoints found'}
 
-            endpoint = matching_endpoints[0]
             self.backend.commands.shell_target = endpoint.conn
-            dir_path = os.path.join(self.main_path, endpoint.ident)
-
-            for root, dirs, files in os.walk(dir_path):
-                normalized_path = os.path.normpath(root)
-                folder_details[normalized_path] = {
-                    'numOfFiles': len(files),
-                    'fileList': [os.path.join(root, file) for file in files],
-                    'subFolders': dirs
-                }
+            folder_details = self.backend.storage.summary(endpoint.ident)
 
-            self.logger.debug(f"Folder Details: {folder_details}")
+            self.logger.debug("Folder Details: %s", folder_details)
 
         except Exception as e:
             self.logger.error(f"Error: {e}")
@@ -98,6 +166,73 @@ class Operations:
 
         return folder_details
 
+    def task_delta(self, ident):
+        since = request.args.get('since')
+        try:
+            since = int(since) if since is not None else None
+
+        except ValueError:
+            return jsonify({'error': f"Invalid parameter 'since': {since!r} is not an integer"}), 400
+
+        delta = self.backend.task_snapshots.delta(ident, since)
+        if delta is None:
+            return jsonify({'error': f'No task snapshots for {ident}'}), 404
+
+        return jsonify(delta)
+
+    def history(self):
+        # Parsed by hand: request.args.get(type=...) turns a malformed value into None.
+        parsed = {}
+        for name, cast in (('limit', int), ('cursor', int), ('since', float), ('until', float)):
+            value = request.args.get(name)
+            try:
+                parsed[name] = cast(value) if value is not None else None
+
+            except ValueError:
+                return jsonify({'error': f"Invalid parameter '{name}': {value!r}"}), 400
+
+        limit = max(1, min(parsed['limit'] if parsed['limit'] is not None else 50, 500))
+        cursor, since, until = parsed['cursor'], parsed['since'], parsed['until']
+
+        client_mac = request.args.get('client_mac')
+        self.logger.debug("History: limit=%s cursor=%s since=%s until=%s mac=%s", limit, cursor, since, until, client_mac)
+        sessions, next_cursor = self.backend.server.connHistory.query(
+            limit=limit, cursor=cursor, since=since, until=until, client_mac=client_mac)
+
+        return jsonify({
+            'history': sessions,
+            'next_cursor': next_cursor,
+            'total': len(self.backend.server.connHistory)
+        })
+
+    def traces(self):
+        """Recent command traces, newest first; ``?sort=slowest`` orders them by duration."""
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), 500))
+
+        except ValueError as e:
+            return jsonify({'error': f'Invalid parameter: {e}'}), 400
+
+        ident = request.args.get('ident')
+        sort = request.args.get('sort', 'recent')
+        if sort == 'slowest':
+            traces = self.backend.tracer.slowest(ident=ident, limit=limit)
+
+        elif sort == 'recent':
+            traces = self.backend.tracer.recent(ident=ident, limit=limit)
+
+        else:
+            return jsonify({'error': f'Invalid sort: {sort}'}), 400
+
+        return jsonify({'traces': traces, 'total': len(self.backend.tracer.traces)})
+
+    def trace(self, trace_id):
+        trace = self.backend.tracer.get(trace_id)
+        if trace is None:
+            return jsonify({'error': f'Trace {trace_id} not found'}), 404
+
+        return jsonify(trace)
+
     def get_ex_ip(self):
         matching_endpoint = self.backend.find_matching_endpoint(data=None)
         self.logger.info(f"Calling commands.get_ex_ip({matching_endpoint})...")
@@ -115,7 +250,7 @@ class Operations:
 
     def clear_local(self):
         matching_endpoint = self.backend.find_matching_endpoint(data=None)
-        isLocalCleared = self.backend.handlers.clear_local(matching_endpoint)
+        isLocalCleared = self.backend.clear_local(matching_endpoint)
         if isLocalCleared:
             return jsonify({'message': f'Local dir cleared'})
 
@@ -128,7 +263,7 @@ class Operations:
 
     def discover(self):
         matching_endpoint = self.backend.find_matching_endpoint(data=None)
-        self.logger.debug(f"Calling self.commands.discover({matching_endpoint})...")
+        self.logger.debug("Calling self.commands.discover(%s)...", matching_endpoint)
         netMap = self.backend.commands.call_discover(matching_endpoint)
         files = self.count_files()
         self.logger.info(f"Netmap: {netMap}\nFiles: {files}\n")
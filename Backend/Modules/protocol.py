@@ -0,0 +1,216 @@
+"""
+Framed wire protocol shared by the server and every command module.
+
+Every message on the wire is a fixed 16 byte header followed by its payload:
+
+    magic (2s) | version (B) | type (B) | request id (I) | length (Q, 64-bit)
+
+All fields are in network byte order. The request id correlates a reply with
+the command that caused it; agents echo the id of the command they answer and
+frames outside a request (welcome, handshake) use id 0.
+
+Control messages (commands, text, JSON, filenames, acks) are read whole.
+Artifacts are never sent as one frame: they use OFFER / RESUME / CHUNK, so
+multi-megabyte files never have to fit in a single recv() or in memory, and
+an interrupted transfer can be resumed. The DATA type number is kept reserved.
+The agent offers the total size and the SHA-256 of the content, the server
+answers with the offset it already holds for that content, and the agent sends
+the rest as CHUNK frames, each prefixed with its file offset and CRC32 (see
+``transfer.receive_chunks``).
+"""
+from enum import IntEnum
+import struct
+import json
+
+
+PROTOCOL_VERSION = 2
+MAGIC = b'HO'
+HEADER = struct.Struct('!2sBBIQ')
+MAX_REQUEST_ID = 0xFFFFFFFF
+MAX_CONTROL_SIZE = 16 * 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+OFFSET = struct.Struct('!Q')
+OFFER = struct.Struct('!Q32s')
+CHUNK_HEADER = struct.Struct('!QI')
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class MessageType(IntEnum):
+    HELLO = 1
+    HANDSHAKE = 2
+    COMMAND = 3
+    TEXT = 4
+    JSON = 5
+    FILENAME = 6
+    DATA = 7
+    ACK = 8
+    ERROR = 9
+    OFFER = 10
+    RESUME = 11
+    CHUNK = 12
+
+
+class ProtocolError(ConnectionError):
+    """The peer sent something that is not a valid frame; the stream is unusable."""
+
+
+def encode_payload(payload) -> bytes:
+    if payload is None:
+        return b''
+
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return bytes(payload)
+
+    if isinstance(payload, str):
+        return payload.encode()
+
+    return json.dumps(payload).encode()
+
+
+def pack_header(msg_type, length, request_id=0) -> bytes:
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, int(msg_type), request_id, length)
+
+
+def unpack_header(header):
+    magic, version, msg_type, request_id, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame magic: {magic!r}")
+
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+
+    try:
+        return MessageType(msg_type), length, request_id
+
+    except ValueError:
+        raise ProtocolError(f"Unknown message type: {msg_type}")
+
+
+def encode_frame(msg_type, payload=None, request_id=0) -> bytes:
+    body = encode_payload(payload)
+    return pack_header(msg_type, len(body), request_id) + body
+
+
+def recv_exact(conn, size) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if not count:
+            raise ConnectionError(f"Connection closed after {received}/{size} bytes")
+
+        received += count
+
+    return buffer
+
+
+def recv_exact_into(conn, view) -> None:
+    received = 0
+    size = len(view)
+    while received < size:
+        count = conn.recv_into(view[received:], size - received)
+        if not count:
+            raise ConnectionError(f"Connection closed after {received}/{size} bytes")
+
+        received += count
+
+
+def send_message(conn, msg_type, payload=None, request_id=0) -> None:
+    conn.sendall(encode_frame(msg_type, payload, request_id))
+
+
+def send_command(conn, command, request_id=0) -> None:
+    send_message(conn, MessageType.COMMAND, command, request_id)
+
+
+def discard(conn, length) -> None:
+    for _ in iter_payload(conn, length):
+        pass
+
+
+def recv_header(conn, expected=None, request_id=None):
+    """Read the next frame header, skipping frames that belong to another request."""
+    while True:
+        msg_type, length, frame_id = unpack_header(recv_exact(conn, HEADER.size))
+        if request_id is None or frame_id == request_id:
+            break
+
+        # A late reply to a request that already gave up; drop it.
+        discard(conn, length)
+
+    if expected is not None and msg_type != expected:
+        raise ProtocolError(f"Expected {MessageType(expected).name}, got {msg_type.name}")
+
+    return msg_type, length
+
+
+def recv_message(conn, expected=None, max_size=MAX_CONTROL_SIZE, request_id=None):
+    msg_type, length = recv_header(conn, expected, request_id)
+    if length > max_size:
+        raise ProtocolError(f"{msg_type.name} frame of {length} bytes exceeds {max_size}")
+
+    return msg_type, bytes(recv_exact(conn, length))
+
+
+def recv_text(conn, expected=MessageType.TEXT, request_id=None) -> str:
+    msg_type, payload = recv_message(conn, expected, request_id=request_id)
+    return payload.decode()
+
+
+def recv_json(conn, expected=MessageType.JSON, request_id=None):
+    msg_type, payload = recv_message(conn, expected, request_id=request_id)
+    return json.loads(payload)
+
+
+def recv_offer(conn, request_id=None):
+    """``(size, digest)`` from an OFFER frame. ``digest`` is the SHA-256 of the whole
+    artifact, or None from agents that only offer the size."""
+    msg_type, payload = recv_message(conn, MessageType.OFFER, OFFER.size, request_id)
+    if len(payload) == OFFSET.size:
+        return OFFSET.unpack(payload)[0], None
+
+    if len(payload) != OFFER.size:
+        raise ProtocolError(f"OFFER frame must carry a size and a {OFFER.size - OFFSET.size} byte digest")
+
+    return OFFER.unpack(payload)
+
+
+def iter_payload(conn, length, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the payload of a streamed frame in chunks of up to ``chunk_size`` bytes."""
+    remaining = length
+    while remaining:
+        data = conn.recv(min(chunk_size, remaining))
+        if not data:
+            raise ConnectionError(f"Connection closed with {remaining}/{length} bytes left")
+
+        remaining -= len(data)
+        yield data
+
+
+class FrameDecoder:
+    """Incremental decoder for non-blocking sockets: feed bytes, get whole frames."""
+
+    def __init__(self, max_size=MAX_CONTROL_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            msg_type, length, request_id = unpack_header(self.buffer[:HEADER.size])
+            if length > self.max_size:
+                raise ProtocolError(f"{msg_type.name} frame of {length} bytes exceeds {self.max_size}")
+
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+
+            frames.append((msg_type, bytes(self.buffer[HEADER.size:end])))
+            del self.buffer[:end]
+
+        return frames
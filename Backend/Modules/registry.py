@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+class EndpointRegistry:
+    """Thread-safe store of connected endpoints, indexed by MAC, socket and ident.
+
+    MAC is the identity of an agent: registering an endpoint whose MAC is already
+    known replaces the stale entry in place (keeping its position) instead of
+    adding a duplicate. Iteration works on a snapshot, so callers may remove
+    endpoints while looping.
+
+    Every change (register, remove, ``touch``) bumps a fleet ``version`` and
+    stamps the endpoint with it; removals leave a bounded tombstone. Together
+    they let ``changes`` answer "what changed since version N".
+    """
+
+    def __init__(self, max_tombstones=10000):
+        self.lock = RLock()
+        self.by_mac = {}
+        self.by_conn = {}
+        self.by_ident = {}
+
+        self.version = 0
+        self.max_tombstones = int(max_tombstones)
+        self.tombstones = OrderedDict()
+        self.tombstone_floor = 0
+
+    def __str__(self):
+        return f"EndpointRegistry(endpoints={len(self)})"
+
+    def __repr__(self):
+        return f"EndpointRegistry(endpoints={len(self)}, idents={len(self.by_ident)})"
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def __bool__(self):
+        return bool(self.by_mac)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __contains__(self, endpoint):
+        return self.by_mac.get(getattr(endpoint, 'client_mac', None)) is endpoint
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return list(self.by_mac.values())
+
+    def upsert(self, endpoint):
+        """Add ``endpoint`` or replace the entry with the same MAC. Returns the replaced endpoint."""
+        with self.lock:
+            stale = self.by_mac.get(endpoint.client_mac)
+            if stale is not None:
+                self._unindex(stale)
+
+            self.by_mac[endpoint.client_mac] = endpoint
+            self.by_conn[endpoint.conn] = endpoint
+            self.by_ident.setdefault(endpoint.ident, {})[endpoint.client_mac] = endpoint
+            self.tombstones.pop(endpoint.client_mac, None)
+            self._stamp(endpoint)
+            return stale
+
+    def remove(self, endpoint) -> bool:
+        """Remove ``endpoint`` if it is still the registered entry for its MAC."""
+        with self.lock:
+            if self.by_mac.get(endpoint.client_mac) is not endpoint:
+                return False
+
+            del self.by_mac[endpoint.client_mac]
+            self._unindex(endpoint)
+            self._stamp(endpoint)
+            self.tombstones[endpoint.client_mac] = self.version
+            while len(self.tombstones) > self.max_tombstones:
+                mac, self.tombstone_floor = self.tombstones.popitem(last=False)
+
+            return True
+
+    def touch(self, endpoint) -> None:
+        """Record that a registered endpoint's state (e.g. liveness) changed."""
+        with self.lock:
+            if self.by_mac.get(endpoint.client_mac) is endpoint:
+                self._stamp(endpoint)
+
+    def changes(self, since):
+        """Return ``(version, changed, removed_macs, full)`` relative to fleet version ``since``.
+
+        ``full`` is True when ``since`` is older than the retained tombstones; the
+        caller then gets every endpoint and must drop anything it had before.
+        """
+        with self.lock:
+            if since is None or since < self.tombstone_floor or since > self.version:
+                return self.version, list(self.by_mac.values()), [], True
+
+            changed = [endpoint for endpoint in self.by_mac.values() if endpoint.version > since]
+            removed = [mac for mac, version in self.tombstones.items() if version > since]
+            return self.version, changed, removed, False
+
+    def _stamp(self, endpoint) -> None:
+        self.version += 1
+        endpoint.version = self.version
+
+    def get_by_mac(self, client_mac):
+        return self.by_mac.get(client_mac)
+
+    def get_by_conn(self, conn):
+        try:
+            return self.by_conn.get(conn)
+
+        except TypeError:
+            return None
+
+    def get_by_ident(self, ident) -> list:
+        with self.lock:
+            return list(self.by_ident.get(ident, {}).values())
+
+    def _unindex(self, endpoint) -> None:
+        if self.by_conn.get(endpoint.conn) is endpoint:
+            del self.by_conn[endpoint.conn]
+
+        same_ident = self.by_ident.get(endpoint.ident)
+        if same_ident is not None and same_ident.get(endpoint.client_mac) is endpoint:
+            del same_ident[endpoint.client_mac]
+            if not same_ident:
+                del self.by_ident[endpoint.ident]
@@ -1,172 +1,161 @@
 import socket
-import shutil
-import glob
 import os
 
 from .logger import init_logger
 from .utils import Handlers
+from .tracing import traced
+from . import protocol
 
 class Screenshot:
-    def __init__(self, path, log_path, endpoint, remove_connection, shell_target):
+    def __init__(self, path, log_path, endpoint, remove_connection, shell_target, artifacts=None):
         self.images = []
+        self.artifacts = artifacts
         self.endpoint = endpoint
         self.path = path
         self.log_path = log_path
         self.remove_connection = remove_connection
         self.shell_target = shell_target
-        
+        # Longest the agent may go silent mid-exchange before the transfer is abandoned.
+        self.timeout = float(os.getenv('TRANSFER_TIMEOUT', 60))
+
         self.logger = init_logger(self.log_path, __name__)
 
         self.basepath = os.path.join(self.path, self.endpoint.ident)
-        self.logger.debug(f"Basepath: {self.basepath}")
+        self.logger.debug("Basepath: %s", self.basepath)
 
         # Ensure the screenshot path is inside the 'images' directory
         self.screenshot_path = os.path.join(self.basepath, 'images')
-        self.logger.debug(f"Screenshot Path: {self.screenshot_path}")
+        self.logger.debug("Screenshot Path: %s", self.screenshot_path)
 
         if not os.path.exists(self.screenshot_path):
-            self.logger.debug(f"Creating directory '{self.screenshot_path}'...")
+            self.logger.debug("Creating directory '%s'...", self.screenshot_path)
             os.makedirs(self.screenshot_path, exist_ok=True)
-            self.logger.debug(f"Directory '{self.screenshot_path}' Created")
+            self.logger.debug("Directory '%s' Created", self.screenshot_path)
 
         self.handlers = Handlers(self.log_path, self.path)
         self.basepath = self.handlers.handle_local_dir(self.endpoint)
-        self.logger.debug(f"Local Dir: {self.basepath}")
-
-    def bytes_to_number(self, b: int) -> int:
-        res = 0
-        for i in range(4):
-            res += b[i] << (i * 8)
-        return res
+        self.logger.debug("Local Dir: %s", self.basepath)
 
     def handle_errors(self, e):
-        self.logger.debug(f"Error: {e}")
-        self.logger.debug(f"Calling remove_lost_connection({self.endpoint})...")
-        self.server.remove_lost_connection(self.endpoint)
+        self.logger.debug("Error: %s", e)
+        self.logger.debug("Calling remove_lost_connection(%s)...", self.endpoint)
+        self.remove_connection(self.endpoint)
 
+    @traced
     def get_file_name(self):
         try:
             # Receiving the filename from the remote station
-            self.filename = self.endpoint.conn.recv(1024)
-            self.filename = str(self.filename).strip("b'")  # Convert bytes to string and clean up
+            self.filename = self.exchange.recv_text(protocol.MessageType.FILENAME)
 
             # Normalize the filename to avoid any path traversal or similar issues
             self.filename = os.path.basename(self.filename.strip())
-            self.endpoint.conn.send("Filename OK".encode())
+            self.exchange.send_message(protocol.MessageType.ACK, "Filename OK")
             
             # Ensuring the file is saved inside the 'images' directory
             self.screenshot_file_path = os.path.join(self.screenshot_path, self.filename)
-            self.logger.debug(f"GET FILE NAME: screenshot_file_path: {self.screenshot_file_path}")
+            self.logger.debug("GET FILE NAME: screenshot_file_path: %s", self.screenshot_file_path)
             
             # Normalize the path fully
             self.screenshot_file_path = os.path.normpath(self.screenshot_file_path)
-            self.logger.debug(f"Normalized Screenshot File Path: {self.screenshot_file_path}")
+            self.logger.debug("Normalized Screenshot File Path: %s", self.screenshot_file_path)
 
         except (ConnectionError, socket.error) as e:
             self.handle_errors(e)
             return False
 
+    @traced
     def get_file_size(self):
         try:
-            self.size = self.endpoint.conn.recv(4)
-            self.size = self.bytes_to_number(self.size)
+            self.size, self.digest = self.exchange.recv_offer()
 
         except (ConnectionError, socket.error) as e:
             self.handle_errors(e)
             return False
 
+    @traced
     def get_file_content(self):
-        current_size = 0
-        buffer = b""
         try:
             # Enforce the file to be saved directly in the 'images' directory
             final_file_path = os.path.join(self.screenshot_path, self.filename)
-            self.logger.debug(f"Final enforced Screenshot File Path: {final_file_path}")
-
-            self.logger.debug(f"Opening {self.filename} for writing at {final_file_path}...")
-            with open(final_file_path, 'wb') as file:
-                self.logger.debug(f"Fetching file content...")
-                while current_size < self.size:
-                    try:
-                        data = self.endpoint.conn.recv(1024)
-                        if not data:
-                            break
+            self.logger.debug("Final enforced Screenshot File Path: %s", final_file_path)
 
-                        if len(data) + current_size > self.size:
-                            data = data[:self.size - current_size]
+            self.logger.debug("Fetching file content into %s...", final_file_path)
+            try:
+                self.exchange.receive_chunks(final_file_path, self.size, self.digest)
 
-                        buffer += data
-                        current_size += len(data)
-                        file.write(data)
+            except ConnectionError as e:
+                self.handle_errors(e)
+                return False
 
-                    except IOError as e:
-                        self.logger.info(f"Error Writing to {final_file_path}, {e}")
-                        return False
-
-                    except (ConnectionError, socket.error) as e:
-                        self.handle_errors(e)
-                        return False
+            except IOError as e:
+                self.logger.info(f"Error Writing to {final_file_path}, {e}")
+                return False
 
             self.logger.info(f"get_file_content completed.")
 
         except FileExistsError:
-            self.logger.debug(f"Passing file exists error...")
+            self.logger.debug("Passing file exists error...")
             pass
 
 
+    @traced
     def confirm(self):
         try:
-            self.logger.debug(f"Waiting for answer from client...")
-            self.ans = self.endpoint.conn.recv(1024).decode()
-            self.logger.debug(f"{self.endpoint.ip}: {self.ans}")
+            self.logger.debug("Waiting for answer from client...")
+            self.ans = self.exchange.recv_text()
+            self.logger.debug("%s: %s", self.endpoint.ip, self.ans)
 
         except (ConnectionError, socket.error) as e:
             self.handle_errors(e)
             return False
 
+    @traced
     def finish(self):
-        try:
-            self.logger.debug(f"Finding the latest jpg file...")
-            latest_file = max(glob.glob(os.path.join(self.screenshot_path, '*.jpg')), key=os.path.getmtime)
-            self.last_screenshot = os.path.basename(latest_file)
+        final_file_path = os.path.join(self.screenshot_path, self.filename)
+        if self.artifacts is not None:
+            self.logger.debug("Indexing %s...", final_file_path)
+            self.artifacts.record(self.endpoint.ident, final_file_path, 'screenshot')
 
-            destination_path = os.path.join(self.screenshot_path, self.last_screenshot)
-
-            # Check if the file already exists in the destination
-            if os.path.exists(destination_path):
-                self.logger.debug(f"File {destination_path} already exists. Skipping move operation.")
-            else:
-                if self.endpoint.conn == self.shell_target:
-                    src = os.path.join(self.screenshot_path, self.last_screenshot)
-                    shutil.move(src, destination_path)
-                    self.logger.info(f"Moved {src} to {destination_path}")
-
-            self.logger.info(f"Screenshot completed.")
-
-        except ValueError:
-            self.logger.debug("No jpg files found to move.")
+        self.last_screenshot = self.filename
+        self.logger.info(f"Screenshot completed.")
 
 
     def run(self):
         self.logger.info(f"Running screenshot...")
+        try:
+            return self.endpoint.channel.call(self.run_job, timeout=self.timeout)
+
+        except ConnectionError as e:
+            self.handle_errors(e)
+            return False
+
+    def run_job(self, exchange):
+        self.exchange = exchange
 
         try:
-            self.logger.debug(f"Sending screen command to client...")
-            self.endpoint.conn.send('screen'.encode())
+            self.logger.debug("Sending screen command to client...")
+            self.exchange.send_command('screen')
 
         except (ConnectionError, socket.error) as e:
-            self.logger.debug(f"Error: {e}.")
-            self.logger.debug(f"Calling remove_lost_connection({self.endpoint}...")
+            self.logger.debug("Error: %s.", e)
+            self.logger.debug("Calling remove_lost_connection(%s...", self.endpoint)
             self.remove_connection(self.endpoint)
             return False
 
-        self.logger.debug(f"Calling get_file_name...")
-        self.get_file_name()
-        self.logger.debug(f"Calling get_file_size...")
-        self.get_file_size()
-        self.logger.debug(f"Calling get_file_content...")
-        self.get_file_content()
-        self.logger.debug(f"Calling finish...")
+        # Each step returns False once the transfer is lost; nothing complete exists to record then.
+        self.logger.debug("Calling get_file_name...")
+        if self.get_file_name() is False:
+            return False
+
+        self.logger.debug("Calling get_file_size...")
+        if self.get_file_size() is False:
+            return False
+
+        self.logger.debug("Calling get_file_content...")
+        if self.get_file_content() is False:
+            return False
+
+        self.logger.debug("Calling finish...")
         self.finish()
 
         return True
@@ -1,21 +1,44 @@
 from .logger import init_logger
+from .acceptor import Acceptor
+from .registry import EndpointRegistry
+from .channel import Channel
+from .heartbeat import Heartbeat, PROBES, PROBE_SECONDS
+from .metrics import REGISTRY
+from .liveness import PassiveMonitor
+from .database import DatabaseWriter
+from .history import ConnectionHistory
+from .events import EventBus
+from . import events
 from dotenv import load_dotenv
 from datetime import datetime
 from threading import Thread
 import socket
 import json
+import time
 import os
 
-# PostgreSQL DB imports
-import psycopg2
-from psycopg2 import OperationalError
+
+CONNECTIONS = REGISTRY.counter('handsoff_connections_total', 'Agent connections registered as endpoints.')
+CONNECTION_SECONDS = REGISTRY.histogram('handsoff_connection_setup_seconds',
+                                        'Time to register a handshaken agent as an endpoint.')
+DB_ENQUEUED = REGISTRY.counter('handsoff_db_enqueued_total', 'Endpoint rows handed to the database writer.',
+                               ('result',))
+ENDPOINTS = REGISTRY.gauge('handsoff_endpoints', 'Endpoints currently registered.')
+QUEUE_DEPTH = REGISTRY.gauge('handsoff_queue_depth', 'Items waiting in background queues.', ('queue',))
 
 
 # Presentation Class
 class Endpoints:
     def __init__(self, conn, client_mac, ip, ident, user,
                  client_version, os_release, boot_time, connection_time,
-                 is_vm, hardware, hdd, external_ip, wifi):
+                 is_vm, hardware, hdd, external_ip, wifi, channel=None):
+        self.channel = channel
+        self.version = 0
+        self._static_json = None
+        self._json = None
+        self.alive = True
+        self.last_seen = time.time()
+        self.rtt = None
         self.wifi = wifi
         self.external_ip = external_ip
         self.hardware = hardware
@@ -74,8 +97,41 @@ class Endpoints:
                 } for hdd in self.hdd
             ],
             "external_ip": self.external_ip,
-            "wifi": self.wifi
+            "wifi": self.wifi,
+            **self.dynamic_dict(),
+            **self.heartbeat_dict()
+        }
+
+    def dynamic_dict(self):
+        return {
+            "alive": self.alive,
+            "version": self.version
+        }
+
+    def heartbeat_dict(self):
+        # Changes on every probe, so it is kept out of the versioned fragment.
+        return {
+            "last_seen": datetime.fromtimestamp(self.last_seen).strftime("%d/%b/%y %H:%M:%S"),
+            "rtt_ms": round(self.rtt * 1000, 2) if self.rtt is not None else None
         }
+
+    def to_json(self) -> str:
+        """Serialized ``to_dict()`` without the heartbeat fields, rebuilt only when the
+        registry stamps a change.
+
+        Handshake data never changes for a connection, so its part is encoded once.
+        """
+        if self._json is None or self._json[0] != self.version:
+            if self._static_json is None:
+                static = self.to_dict()
+                for field in (*self.dynamic_dict(), *self.heartbeat_dict()):
+                    static.pop(field)
+
+                self._static_json = json.dumps(static)[:-1]
+
+            self._json = (self.version, f"{self._static_json}, {json.dumps(self.dynamic_dict())[1:]}")
+
+        return self._json[1]
     
 
 class Server:
@@ -94,10 +150,32 @@ class Server:
         self.ip = None
         self.handshake = None
         self.fresh_endpoint = None
-        self.endpoints = []
-        self.connHistory = {}
+        self.endpoints = EndpointRegistry()
+        self.connHistory = ConnectionHistory(max_records=os.getenv('HISTORY_MAX_RECORDS', 10000),
+                                             max_age=os.getenv('HISTORY_MAX_AGE', 7 * 24 * 3600),
+                                             per_endpoint=os.getenv('HISTORY_PER_ENDPOINT', 100))
+        self.callback = 'yes'
+        self.events = EventBus(self.log_path, max_queue=os.getenv('EVENT_QUEUE', 10000))
+        self.heartbeat = Heartbeat(self, self.log_path,
+                                   interval=os.getenv('HEARTBEAT_INTERVAL', 30),
+                                   timeout=os.getenv('HEARTBEAT_TIMEOUT', 5),
+                                   workers=os.getenv('HEARTBEAT_WORKERS', 64),
+                                   jitter=os.getenv('HEARTBEAT_JITTER', 0.2))
+        self.monitor = None
+        if os.getenv('LIVENESS_MODE', 'active').lower() == 'passive':
+            if PassiveMonitor.supported():
+                self.monitor = PassiveMonitor(self, self.log_path,
+                                              idle=os.getenv('KEEPALIVE_IDLE', 60),
+                                              interval=os.getenv('KEEPALIVE_INTERVAL', 10),
+                                              count=os.getenv('KEEPALIVE_COUNT', 5))
+
+            else:
+                self.logger.error("Passive liveness needs epoll; falling back to heartbeats.")
 
         self.connect_to_db()
+        ENDPOINTS.set_function(lambda: len(self.endpoints))
+        QUEUE_DEPTH.labels('events').set_function(self.events.events.qsize)
+        QUEUE_DEPTH.labels('database').set_function(lambda: self.db.rows.qsize())
 
     def __str__(self):
         return f"Server(ip={self.serverIP}, port={self.port}, hostname={self.hostname})"
@@ -107,91 +185,50 @@ class Server:
                 f"user={self.user}, endpoints={len(self.endpoints)})")
     
     def connect_to_db(self):
-        self.logger.debug("Connecting to database...")
-        try:
-            self.db_conn = psycopg2.connect(
-                dbname="hands_off",
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT")
-            )
-            self.db_cursor = self.db_conn.cursor()
-            self.logger.info("Connected to DB!")
-
-        except OperationalError as e:
-            self.logger.error(f"Error connecting to DB: {e}")
-            self.db_conn = None
+        self.db = DatabaseWriter(self.log_path, dbname="hands_off",
+                                 user=os.getenv("DB_USER"),
+                                 password=os.getenv("DB_PASSWORD"),
+                                 host=os.getenv("DB_HOST"),
+                                 port=os.getenv("DB_PORT"),
+                                 batch_size=os.getenv("DB_BATCH_SIZE", 500),
+                                 flush_interval=os.getenv("DB_FLUSH_INTERVAL", 1.0),
+                                 max_connections=os.getenv("DB_POOL_SIZE", 4))
+        self.db.start()
 
     def listener(self) -> None:
         self.server = socket.socket()
         self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.logger.debug(f'Binding {self.serverIP}, {self.port}...')
+        self.logger.debug('Binding %s, %s...', self.serverIP, self.port)
         self.server.bind((self.serverIP, int(self.port)))
-        self.server.listen()
+        self.server.listen(socket.SOMAXCONN)
+
+        self.acceptor = Acceptor(self.server, self.update_data, self.log_path,
+                                 handshake_timeout=os.getenv('HANDSHAKE_TIMEOUT', 10),
+                                 max_pending=os.getenv('MAX_PENDING_HANDSHAKES', 10000))
 
         self.logger.info(f'Running run...')
-        self.logger.debug(f'Starting connection thread...')
-        self.connectThread = Thread(target=self.connect, daemon=True, name=f"Connect Thread")
+        self.logger.debug('Starting connection thread...')
+        self.connectThread = Thread(target=self.acceptor.run, daemon=True, name=f"Connect Thread")
         self.connectThread.start()
+        if self.monitor is not None:
+            self.monitor.start()
 
-    def connect(self) -> None:
-        self.logger.info(f'Running connect...')
-        while True:
-            if self.process_connection():
-                self.logger.info(f'connect completed.')
-
-            else:
-                self.logger.error(f'Connection failed.')
-
-    def process_connection(self) -> bool:
-        try:
-            self.dt = self.get_date()
-            self.logger.debug(f'Accepting connection...')
-            self.conn, (self.ip, self.port) = self.server.accept()
-            self.logger.debug(f'Connection from {self.ip} accepted.')
-            self.send_welcome_message()
-            self.logger.debug(f'Waiting for handshake data...')
-
-            self.gate_keeper = self.conn.recv(1024).decode()
-            if self.gate_keeper.lower()[:6] != 'client':
-                self.logger.error(f'GATE-KEEPER: {self.conn} failed.')
-                self.conn.close()
-                return False
-
-            self.logger.info("Handshake completed.")
-            self.logger.debug("Waiting for client data...")
-            received_data = self.conn.recv(4096).decode()
-            self.logger.debug(f"Client data: {received_data}")
-            try:
-                self.logger.debug("Loading data to JSON...")
-                self.handshake = json.loads(received_data)
-
-            except Exception as e:
-                self.logger.error(e)
-                return False
-
-            self.update_data()
-            return True
-
-        except ConnectionResetError as e:
-            self.logger.error(e)
-            self.conn.close()
-            return False
-
-    def send_welcome_message(self) -> None:
-        welcome = "Connection Established!"
-        self.logger.debug(f'Sending welcome message...')
-        self.conn.send(f"@Server: {welcome}".encode())
-        self.logger.debug(f'"{welcome}" sent to {self.ip}.')
+        else:
+            self.heartbeat.start()
 
-    def update_data(self) -> None:
-        self.logger.debug(f'Defining fresh endpoint data...')
-        self.logger.debug(f'Getting VM value...')
+    def update_data(self, conn, ip, handshake) -> None:
+        started = time.perf_counter()
+        self.conn = conn
+        self.ip = ip
+        self.handshake = handshake
+        self.dt = self.get_date()
+        self.logger.debug("Client data: %s", self.handshake)
+        self.logger.debug('Defining fresh endpoint data...')
+        self.logger.debug('Getting VM value...')
         is_vm = self.handshake.get('is_vm', False)
         try:
             is_vm_value = is_vm.get('true', 'false')
-            self.logger.debug(f"VM Value: {is_vm_value}")
+            self.logger.debug("VM Value: %s", is_vm_value)
 
         except (AttributeError, TypeError) as e:
             self.logger.error(e)
@@ -204,56 +241,45 @@ class Server:
             self.handshake['boot_time'], self.get_date(),
             is_vm_value, self.handshake.get('hardware'),
             self.handshake.get('hdd'), self.handshake.get('ex_ip'),
-            self.handshake.get('wifi')
+            self.handshake.get('wifi'),
+            channel=Channel(self.conn, self.log_path, name=self.handshake['hostname'])
         )
 
         self.logger.info(f"Fresh Endpoint: {self.fresh_endpoint}")
-        if self.fresh_endpoint not in self.endpoints:
-            self.logger.debug(f'{self.fresh_endpoint} not in endpoints list.')
-            self.endpoints.append(self.fresh_endpoint)
+        # Built before anything records the endpoint: a handshake that cannot be
+        # serialized (e.g. no hardware) must fail here, while the connection can still
+        # be dropped without leaving a half-registered endpoint behind.
+        connected = self.fresh_endpoint.to_dict()
+        stale = self.endpoints.upsert(self.fresh_endpoint)
+        if stale is not None:
+            self.logger.debug('Replaced stale entry %s.', stale)
+            if stale.conn is not self.fresh_endpoint.conn:
+                if self.monitor is not None:
+                    self.monitor.unwatch(stale)
+
+                stale.channel.close()
+                self.close_connection(stale.conn)
+
+        if self.monitor is not None:
+            self.monitor.watch(self.fresh_endpoint)
+
+        else:
+            self.heartbeat.schedule(self.fresh_endpoint)
 
-        self.logger.debug(f"Total Endpoints: {len(self.endpoints)}")
-        self.logger.debug(f'Updating connection history dict...')
-        self.connHistory.update({self.fresh_endpoint: self.dt})
+        self.logger.debug("Total Endpoints: %s", len(self.endpoints))
+        self.logger.debug('Updating connection history dict...')
+        self.connHistory.open(self.fresh_endpoint)
         self.logger.info(f'Connection history updated with: {self.fresh_endpoint}:{self.dt}')
 
-        self.insert_into_db()
+        self.insert_into_db(self.fresh_endpoint)
+        connected.update(self.fresh_endpoint.dynamic_dict())
+        self.events.endpoint_event(events.ENDPOINT_CONNECTED, self.fresh_endpoint, endpoint=connected)
+        CONNECTIONS.inc()
+        CONNECTION_SECONDS.observe(time.perf_counter() - started)
 
-    def insert_into_db(self) -> None:
-        self.logger.debug(f'Updating database...')
-        try:
-            insert_query = """
-            INSERT INTO endpoints (
-                client_mac, ip, ident, user, client_version,
-                os_release, boot_time, connection_time, is_vm,
-                hardware, hdd, external_ip, wifi
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-
-            if self.db_conn is not None:
-                self.db_cursor.execute(insert_query, (
-                    self.fresh_endpoint.client_mac,
-                    self.fresh_endpoint.ip,
-                    self.fresh_endpoint.ident,
-                    self.fresh_endpoint.user,
-                    self.fresh_endpoint.client_version,
-                    self.fresh_endpoint.os_release,
-                    datetime.strptime(self.fresh_endpoint.boot_time, "%d/%b/%y %H:%M:%S"),
-                    datetime.strptime(self.fresh_endpoint.connection_time, "%d/%b/%y %H:%M:%S"),
-                    self.fresh_endpoint.is_vm,
-                    json(self.fresh_endpoint.hardware),
-                    json(self.fresh_endpoint.hdd),
-                    self.fresh_endpoint.external_ip,
-                    json(self.fresh_endpoint.wifi)
-                ))
-
-                self.db_conn.commit()
-                self.logger.info("Endpoint data inserted into the database successfully.")
-
-        except Exception as e:
-            self.logger.error(f"Failed to insert data into the database: {e}")
-            if self.db_conn is not None:
-                self.db_conn.rollback()
+    def insert_into_db(self, endpoint) -> None:
+        self.logger.debug('Queueing database update...')
+        DB_ENQUEUED.labels('queued' if self.db.enqueue(endpoint) else 'dropped').inc()
 
     def get_date(self) -> str:
         d = datetime.now().replace(microsecond=0)
@@ -261,57 +287,97 @@ class Server:
         return dt
 
     def check_vital_signs(self, endpoint):
-        self.callback = 'yes'
-        self.logger.debug(f'Checking {endpoint.ip}...')
+        self.logger.debug('Checking %s...', endpoint.ip)
 
+        started = time.monotonic()
         try:
-            endpoint.conn.send('alive'.encode())
-            ans = endpoint.conn.recv(1024).decode()
+            ans = endpoint.channel.call(self.probe, timeout=self.heartbeat.timeout)
 
         except (Exception, socket.error, UnicodeDecodeError) as e:
-            self.logger.debug(f'removing {endpoint}...')
+            PROBES.labels('dead').inc()
+            self.logger.debug('removing %s...', endpoint)
+            self.mark_dead(endpoint)
             self.remove_lost_connection(endpoint)
             return
 
         if str(ans) == str(self.callback):
-            try:
-                self.logger.debug(f'Station IP: {endpoint.ip} | Station Name: {endpoint.ident} - ALIVE!')
-            except (IndexError, RuntimeError):
-                return
+            rtt = time.monotonic() - started
+            PROBE_SECONDS.observe(rtt)
+            PROBES.labels('alive').inc()
+            self.mark_alive(endpoint, rtt)
 
         else:
+            PROBES.labels('dead').inc()
             try:
-                self.logger.debug(f'removing {endpoint}...')
+                self.logger.debug('removing %s...', endpoint)
+                self.mark_dead(endpoint)
                 self.remove_lost_connection(endpoint)
 
             except (IndexError, RuntimeError):
                 return
 
+    def probe(self, exchange) -> str:
+        exchange.send_command('alive')
+        return exchange.recv_text()
+
+    def mark_alive(self, endpoint, rtt) -> None:
+        changed = not endpoint.alive
+        endpoint.alive = True
+        endpoint.rtt = rtt
+        endpoint.last_seen = time.time()
+        self.logger.debug('Station IP: %s | Station Name: %s - ALIVE! (%.3fs)', endpoint.ip, endpoint.ident, rtt)
+        if changed:
+            self.endpoints.touch(endpoint)
+            self.events.endpoint_event(events.LIVENESS_CHANGED, endpoint, alive=True, rtt_ms=rtt * 1000)
+
+    def mark_dead(self, endpoint) -> None:
+        changed = endpoint.alive
+        endpoint.alive = False
+        if changed:
+            self.endpoints.touch(endpoint)
+            self.events.endpoint_event(events.LIVENESS_CHANGED, endpoint, alive=False,
+                                       last_seen=endpoint.last_seen)
+
     def vital_signs(self) -> bool:
         self.logger.info(f'Running vital_signs...')
         if not self.endpoints:
-            self.logger.debug(f'No endpoints.')
+            self.logger.debug('No endpoints.')
             return False
 
-        self.callback = 'yes'
-        threads = []
-        for endpoint in self.endpoints:
-            thread = Thread(target=self.check_vital_signs, args=(endpoint,))
-            thread.start()
-            threads.append(thread)
-
-        for thread in threads:
-            thread.join()
-
+        self.heartbeat.probe_all()
         self.logger.info(f'=== End of vital_signs() ===')
         return True
 
+    @staticmethod
+    def close_connection(conn) -> None:
+        # close() does not wake a channel worker blocked in recv() on this socket; shutdown() does.
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            pass
+
+        conn.close()
+
     def remove_lost_connection(self, endpoint) -> bool:
         self.logger.info(f'Running remove_lost_connection({endpoint})...')
         try:
-            self.logger.debug(f'Removing {endpoint.ip}...')
-            endpoint.conn.close()
-            self.endpoints.remove(endpoint)
+            self.logger.debug('Removing %s...', endpoint.ip)
+            if self.monitor is not None:
+                self.monitor.unwatch(endpoint)
+
+            endpoint.channel.close()
+            self.close_connection(endpoint.conn)
+            if not self.endpoints.remove(endpoint):
+                self.logger.debug('%s was already removed or replaced.', endpoint)
+                return False
+
+            self.connHistory.close(endpoint)
+            if not self.endpoints.get_by_ident(endpoint.ident):
+                # Series are labelled by hostname; keep them while another agent uses it.
+                endpoint.channel.forget_metrics()
+
+            self.events.endpoint_event(events.ENDPOINT_LOST, endpoint)
 
             self.logger.info(f'=== Connection to {endpoint.ip} removed. ===')
             return True
@@ -0,0 +1,139 @@
+from .logger import init_logger
+from collections import deque
+from threading import Lock
+import itertools
+import time
+import csv
+import re
+
+
+class TaskSnapshot:
+    __slots__ = ('id', 'ident', 'timestamp', 'processes')
+
+    def __init__(self, snapshot_id, ident, timestamp, processes):
+        self.id = snapshot_id
+        self.ident = ident
+        self.timestamp = timestamp
+        self.processes = processes
+
+    def __repr__(self):
+        return f"TaskSnapshot(id={self.id}, ident={self.ident}, processes={len(self.processes)})"
+
+
+def parse_memory(value) -> int:
+    digits = re.sub(r'[^0-9]', '', value)
+    return int(digits) if digits else 0
+
+
+def parse_tasklist(text) -> list:
+    """Parse ``tasklist`` output, table or ``/fo csv``, into process rows."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    if lines[0].startswith('"'):
+        rows = csv.reader(lines[1:])
+        fields = ((row[0], row[1], row[2], row[3], row[4]) for row in rows if len(row) >= 5)
+
+    else:
+        # Table output: the ===== line under the header gives the column widths.
+        ruler = next((i for i, line in enumerate(lines) if set(line.strip()) <= {'=', ' '}), None)
+        if ruler is None:
+            return []
+
+        spans = [match.span() for match in re.finditer(r'=+', lines[ruler])]
+        if len(spans) < 5:
+            return []
+
+        # The last column runs to the end of the line.
+        spans[-1] = (spans[-1][0], None)
+        fields = (tuple(line[start:end].strip() for start, end in spans[:5]) for line in lines[ruler + 1:])
+
+    processes = []
+    for name, pid, session, session_number, memory in fields:
+        if not pid.isdigit():
+            continue
+
+        processes.append({
+            'name': name,
+            'pid': int(pid),
+            'session': session,
+            'session_number': session_number,
+            'memory_kb': parse_memory(memory)
+        })
+
+    return processes
+
+
+class TaskSnapshots:
+    """Recent parsed task lists per endpoint, with deltas between them.
+
+    Every received tasks file becomes a snapshot with a global, increasing id.
+    Processes are keyed by ``(pid, name)`` so a reused PID shows up as one stop
+    and one start. ``delta`` compares the newest snapshot with any retained
+    older one; when the requested snapshot has already been evicted, the full
+    list is returned instead, flagged with ``full``.
+    """
+
+    def __init__(self, log_path, per_endpoint=20):
+        self.log_path = log_path
+        self.per_endpoint = int(per_endpoint)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.snapshots = {}
+        self.ids = itertools.count(1)
+
+    def __str__(self):
+        return f"TaskSnapshots(endpoints={len(self.snapshots)})"
+
+    def __repr__(self):
+        return f"TaskSnapshots(endpoints={len(self.snapshots)}, per_endpoint={self.per_endpoint})"
+
+    def record(self, ident, path):
+        try:
+            with open(path, 'r', errors='replace') as file:
+                processes = parse_tasklist(file.read())
+
+        except OSError as e:
+            self.logger.error(f"Failed reading task list {path}: {e}")
+            return None
+
+        with self.lock:
+            snapshot = TaskSnapshot(next(self.ids), ident, time.time(),
+                                    {(row['pid'], row['name']): row for row in processes})
+            self.snapshots.setdefault(ident, deque(maxlen=self.per_endpoint)).append(snapshot)
+
+        self.logger.debug("Recorded %s", snapshot)
+        return snapshot
+
+    def on_artifact(self, artifact) -> None:
+        if artifact.type == 'tasks':
+            self.record(artifact.ident, artifact.path)
+
+    def latest(self, ident):
+        with self.lock:
+            history = self.snapshots.get(ident)
+            return history[-1] if history else None
+
+    def delta(self, ident, since=None):
+        """``started``/``stopped`` processes between snapshot ``since`` and the newest one."""
+        with self.lock:
+            history = self.snapshots.get(ident)
+            if not history:
+                return None
+
+            latest = history[-1]
+            previous = next((snapshot for snapshot in history if snapshot.id == since), None)
+
+        result = {'snapshot_id': latest.id, 'since': since, 'timestamp': latest.timestamp}
+        if previous is None:
+            result.update(full=True, processes=list(latest.processes.values()))
+            return result
+
+        result.update(
+            full=False,
+            started=[row for key, row in latest.processes.items() if key not in previous.processes],
+            stopped=[row for key, row in previous.processes.items() if key not in latest.processes]
+        )
+        return result
@@ -40,7 +40,8 @@ class Startup:
             sys.exit(1)
 
         try:
-            with open(kwargs.get('log_path'), 'w'):
+            # Append: earlier runs' logs are kept and rotated by the logger, not wiped on boot.
+            with open(kwargs.get('log_path'), 'a'):
                 pass
 
         except IOError as e:
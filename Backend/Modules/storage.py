@@ -0,0 +1,251 @@
+from .logger import init_logger
+from threading import Thread, Lock
+import ctypes.util
+import ctypes
+import struct
+import time
+import os
+
+
+# In-progress and abandoned transfers (see transfer.partial_path) are not stored artifacts.
+PARTIAL_SUFFIX = '.part'
+
+
+class FolderStats:
+    __slots__ = ('files', 'bytes', 'sizes', 'subfolders')
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.sizes = {}
+        self.subfolders = set()
+
+    def put(self, name, size) -> None:
+        previous = self.sizes.get(name)
+        if previous is None:
+            self.files += 1
+
+        else:
+            self.bytes -= previous
+
+        self.sizes[name] = size
+        self.bytes += size
+
+    def to_dict(self) -> dict:
+        return {
+            'numOfFiles': self.files,
+            'bytes': self.bytes,
+            'subFolders': sorted(self.subfolders)
+        }
+
+
+class StorageStats:
+    """File and byte counters per endpoint directory and subfolder.
+
+    An endpoint's tree is walked once, the first time it is asked for, and from
+    then on kept current by ``on_artifact`` (every received artifact) and
+    ``invalidate`` (clear_local), so a lookup costs a dict read rather than a
+    walk. Counters older than ``max_age`` seconds are rebuilt as a safety net
+    for files written outside the app; with ``watch`` enabled on Linux an
+    inotify watcher invalidates an endpoint as soon as its tree changes.
+    """
+
+    def __init__(self, main_path, log_path, max_age=300.0, watch=False):
+        self.main_path = os.path.abspath(main_path)
+        self.log_path = log_path
+        self.max_age = float(max_age)
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.endpoints = {}
+        self.scanned_at = {}
+        self.watcher = InotifyWatcher(self, self.log_path) if watch and InotifyWatcher.supported() else None
+        if watch and self.watcher is None:
+            self.logger.warning("inotify is not available; storage stats rely on rescans.")
+
+    def __str__(self):
+        return f"StorageStats(endpoints={len(self.endpoints)})"
+
+    def __repr__(self):
+        return (f"StorageStats(endpoints={len(self.endpoints)}, main_path={self.main_path}, "
+                f"max_age={self.max_age}, watching={self.watcher is not None})")
+
+    def start(self) -> None:
+        if self.watcher is not None:
+            self.watcher.start()
+
+    def scan(self, ident) -> dict:
+        folders = {}
+        base = os.path.join(self.main_path, ident)
+        pending = [base]
+        while pending:
+            folder = pending.pop()
+            stats = folders.setdefault(folder, FolderStats())
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stats.subfolders.add(entry.name)
+                            pending.append(entry.path)
+
+                        elif entry.name.endswith(PARTIAL_SUFFIX):
+                            continue
+
+                        elif entry.is_file(follow_symlinks=False):
+                            stats.put(entry.name, entry.stat(follow_symlinks=False).st_size)
+
+            except FileNotFoundError:
+                if folder == base:
+                    return {}
+
+            except OSError as e:
+                self.logger.error(f"Failed scanning {folder}: {e}")
+
+        return folders
+
+    def folders(self, ident) -> dict:
+        with self.lock:
+            folders = self.endpoints.get(ident)
+            fresh = time.monotonic() - self.scanned_at.get(ident, 0) < self.max_age
+
+        if folders is not None and fresh:
+            return folders
+
+        folders = self.scan(ident)
+        with self.lock:
+            self.endpoints[ident] = folders
+            self.scanned_at[ident] = time.monotonic()
+
+        if self.watcher is not None:
+            self.watcher.watch_tree(ident, list(folders))
+
+        return folders
+
+    def summary(self, ident) -> dict:
+        """Per-folder ``numOfFiles``/``bytes``/``subFolders``, keyed by normalized path."""
+        folders = self.folders(ident)
+        with self.lock:
+            return {os.path.normpath(folder): stats.to_dict() for folder, stats in folders.items()}
+
+    def totals(self, ident) -> dict:
+        folders = self.folders(ident)
+        with self.lock:
+            return {
+                'files': sum(stats.files for stats in folders.values()),
+                'bytes': sum(stats.bytes for stats in folders.values())
+            }
+
+    def count(self, ident) -> int:
+        return self.totals(ident)['files']
+
+    def add(self, ident, path) -> None:
+        if path.endswith(PARTIAL_SUFFIX):
+            return
+
+        with self.lock:
+            folders = self.endpoints.get(ident)
+            if folders is None:
+                # Not scanned yet; the first lookup will see this file anyway.
+                return
+
+            try:
+                size = os.path.getsize(path)
+
+            except OSError:
+                return
+
+            folder, name = os.path.split(os.path.abspath(path))
+            if folder not in folders:
+                folders[folder] = FolderStats()
+                parent, child = os.path.split(folder)
+                if parent in folders:
+                    folders[parent].subfolders.add(child)
+
+            folders[folder].put(name, size)
+
+    def on_artifact(self, artifact) -> None:
+        self.add(artifact.ident, artifact.path)
+
+    def invalidate(self, ident) -> None:
+        with self.lock:
+            self.endpoints.pop(ident, None)
+            self.scanned_at.pop(ident, None)
+
+
+class InotifyWatcher:
+    """Invalidates an endpoint's storage stats when anything in its tree changes (Linux only)."""
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_CLOSE_WRITE = 0x008
+    IN_IGNORED = 0x8000
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    event = struct.Struct('iIII')
+
+    def __init__(self, stats, log_path):
+        self.stats = stats
+        self.log_path = log_path
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        self.lock = Lock()
+        self.watches = {}
+        self.paths = set()
+        self.thread = None
+
+    @staticmethod
+    def supported() -> bool:
+        try:
+            return hasattr(ctypes.CDLL(ctypes.util.find_library('c')), 'inotify_init')
+
+        except (OSError, TypeError):
+            return False
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.run, daemon=True, name="Storage Watch Thread")
+        self.thread.start()
+
+    def watch_tree(self, ident, folders) -> None:
+        with self.lock:
+            for folder in folders:
+                if folder in self.paths:
+                    continue
+
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), self.mask)
+                if wd < 0:
+                    self.logger.error(f"Failed watching {folder}: errno {ctypes.get_errno()}")
+                    continue
+
+                self.watches[wd] = (ident, folder)
+                self.paths.add(folder)
+
+    def run(self) -> None:
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+
+            except OSError as e:
+                self.logger.error(f"inotify read failed: {e}")
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.event.unpack_from(data, offset)
+                name = data[offset + self.event.size:offset + self.event.size + length].rstrip(b'\0')
+                offset += self.event.size + length
+                if name.endswith(PARTIAL_SUFFIX.encode()):
+                    # Chunk writes to a partial file; its rename to the artifact raises IN_MOVED_TO.
+                    continue
+
+                with self.lock:
+                    watched = self.watches.get(wd)
+                    if watched is not None and mask & self.IN_IGNORED:
+                        # The folder is gone; allow watching it again if it comes back.
+                        del self.watches[wd]
+                        self.paths.discard(watched[1])
+
+                if watched is not None:
+                    # New subfolders get watched when the invalidated stats are rebuilt.
+                    self.stats.invalidate(watched[0])
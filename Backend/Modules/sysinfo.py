@@ -1,16 +1,20 @@
 from Modules.logger import init_logger
 from Modules.utils import Handlers
-import shutil
+from Modules.tracing import traced, span
+from Modules import protocol
 import socket
 import os
 
 
 class Sysinfo:
-    def __init__(self, path, log_path, endpoint, remove_connection):
+    def __init__(self, path, log_path, endpoint, remove_connection, artifacts=None):
         self.remove_connection = remove_connection
+        self.artifacts = artifacts
         self.endpoint = endpoint
         self.app_path = path
         self.log_path = log_path
+        # Socket timeout for the exchange, so a stalled agent cannot pin the channel worker.
+        self.timeout = float(os.getenv('TRANSFER_TIMEOUT', 60))
         self.ident_path = os.path.join(self.app_path, self.endpoint.ident)
         if not os.path.exists(self.ident_path):
             os.makedirs(self.ident_path, exist_ok=True)
@@ -19,106 +23,115 @@ class Sysinfo:
         self.handlers = Handlers(self.log_path, self.app_path)
         self.local_dir = self.handlers.handle_local_dir(self.endpoint)
 
-    def bytes_to_number(self, b: int) -> int:
-        res = 0
-        for i in range(4):
-            res += b[i] << (i * 8)
-        return res
-
+    @traced
     def get_file_name(self):
         try:
-            self.logger.debug(f"Sending si command to {self.endpoint.conn}...")
-            self.endpoint.conn.send('si'.encode())
-            self.logger.debug(f"Waiting for filename from {self.endpoint.conn}...")
-            self.filename = self.endpoint.conn.recv(1024).decode()
-            self.logger.debug(f"Sending confirmation to {self.endpoint.conn}...")
-            self.endpoint.conn.send("OK".encode())
-            self.logger.debug(f"{self.endpoint.ip}: {self.filename}")
+            self.logger.debug("Sending si command to %s...", self.endpoint.conn)
+            self.exchange.send_command('si')
+            self.logger.debug("Waiting for filename from %s...", self.endpoint.conn)
+            self.filename = os.path.basename(
+                self.exchange.recv_text(protocol.MessageType.FILENAME).strip())
+            self.logger.debug("Sending confirmation to %s...", self.endpoint.conn)
+            self.exchange.send_message(protocol.MessageType.ACK, "OK")
+            self.logger.debug("%s: %s", self.endpoint.ip, self.filename)
             self.file_path = os.path.join(self.ident_path, self.filename)
-            self.logger.debug(f"File path: {self.ident_path}")
+            self.logger.debug("File path: %s", self.ident_path)
 
-        except (WindowsError, socket.error) as e:
-            self.logger.debug(f"Connection error: {e}")
-            self.logger.debug(f"server.remove_lost_connection({self.endpoint})...")
+        except (OSError, socket.error) as e:
+            self.logger.debug("Connection error: %s", e)
+            self.logger.debug("server.remove_lost_connection(%s)...", self.endpoint)
             self.remove_connection(self.endpoint)
             return False
 
+    @traced
     def get_file_size(self):
         try:
-            self.logger.debug(f"Waiting for filesize from {self.endpoint.ip}...")
-            self.size = self.endpoint.conn.recv(4)
-            self.logger.debug(f"Sending confirmation to {self.endpoint.ip}...")
-            self.endpoint.conn.send("OK".encode())
-            self.size = self.bytes_to_number(self.size)
-            self.logger.debug(f"File size: {self.size}")
-
-        except (WindowsError, socket.error) as e:
-            self.logger.debug(f"Connection error: {e}")
-            self.logger.debug(f"server.remove_lost_connection({self.endpoint})...")
+            self.logger.debug("Waiting for filesize from %s...", self.endpoint.ip)
+            self.size, self.digest = self.exchange.recv_offer()
+            self.logger.debug("File size: %s", self.size)
+
+        except (OSError, socket.error) as e:
+            self.logger.debug("Connection error: %s", e)
+            self.logger.debug("server.remove_lost_connection(%s)...", self.endpoint)
             self.remove_connection(self.endpoint)
             return False
 
+    @traced
     def get_file_content(self):
-        current_size = 0
-        buffer = b""
         try:
-            self.logger.debug(f"Receiving file content from {self.endpoint.ip}...")
-            with open(self.file_path, 'wb') as tsk_file:
-                while current_size < self.size:
-                    data = self.endpoint.conn.recv(1024)
-                    if not data:
-                        break
-
-                    if len(data) + current_size > self.size:
-                        data = data[:self.size - current_size]
-
-                    buffer += data
-                    current_size += len(data)
-                    tsk_file.write(data)
-
-        except (WindowsError, socket.error) as e:
-            self.logger.debug(f"Connection error: {e}")
-            self.logger.debug(f"server.remove_lost_connection({self.endpoint})...")
+            self.logger.debug("Receiving file content from %s...", self.endpoint.ip)
+            self.exchange.receive_chunks(self.file_path, self.size, self.digest)
+
+        except (OSError, socket.error) as e:
+            self.logger.debug("Connection error: %s", e)
+            self.logger.debug("server.remove_lost_connection(%s)...", self.endpoint)
             self.remove_connection(self.endpoint)
             return False
 
+    @traced
     def confirm(self):
         try:
-            self.logger.debug(f"Sending confirmation to {self.endpoint.ip}...")
-            self.endpoint.conn.send(f"Received file: {self.filename}\n".encode())
+            self.logger.debug("Sending confirmation to %s...", self.endpoint.ip)
+            self.exchange.send_message(protocol.MessageType.ACK,
+                                       f"Received file: {self.filename}\n")
 
-        except (WindowsError, socket.error) as e:
-            self.logger.debug(f"Connection error: {e}")
-            self.logger.debug(f"server.remove_lost_connection({self.endpoint})...")
+        except (OSError, socket.error) as e:
+            self.logger.debug("Connection error: %s", e)
+            self.logger.debug("server.remove_lost_connection(%s)...", self.endpoint)
             self.remove_connection(self.endpoint)
             return False
 
+    @traced
     def file_validation(self):
         try:
-            self.logger.debug(f"Running validation on {self.file_path}...")
+            self.logger.debug("Running validation on %s...", self.file_path)
             with open(self.file_path, 'r') as file:
                 data = file.read()
 
             return True
 
         except Exception as e:
-            self.logger.debug(f"File validation Error: {e}")
+            self.logger.debug("File validation Error: %s", e)
             return False
 
     def run(self):
         self.logger.info(f"Running Sysinfo...")
-        self.logger.debug(f"Calling get_file_name...")
-        self.get_file_name()
-        self.logger.debug(f"Calling get_file_size...")
-        self.get_file_size()
-        self.logger.debug(f"Calling get_file_content...")
-        self.get_file_content()
-        self.logger.debug(f"Calling confirm...")
-        self.confirm()
-        self.logger.debug(f"Calling file_validation...")
-        self.file_validation()
-
-        shutil.move(self.file_path, self.local_dir)
+        try:
+            return self.endpoint.channel.call(self.run_job, timeout=self.timeout)
+
+        except ConnectionError as e:
+            self.logger.debug("Connection error: %s", e)
+            self.remove_connection(self.endpoint)
+            return False
+
+    def run_job(self, exchange):
+        self.exchange = exchange
+        # Each step returns False once the transfer is lost; stop there, so the previous
+        # sysinfo file is never recorded or returned as this run's result.
+        self.logger.debug("Calling get_file_name...")
+        if self.get_file_name() is False:
+            return False
+
+        self.logger.debug("Calling get_file_size...")
+        if self.get_file_size() is False:
+            return False
+
+        self.logger.debug("Calling get_file_content...")
+        if self.get_file_content() is False:
+            return False
+
+        self.logger.debug("Calling confirm...")
+        if self.confirm() is False:
+            return False
+
+        self.logger.debug("Calling file_validation...")
+        if not self.file_validation():
+            return False
+
+        if self.artifacts is not None:
+            self.logger.debug("Indexing %s...", self.file_path)
+            with span('index'):
+                self.artifacts.record(self.endpoint.ident, self.file_path, 'sysinfo')
 
         self.logger.info(f"Sysinfo completed.")
         return True
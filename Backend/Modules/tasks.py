@@ -13,15 +13,17 @@
 
 from Modules.logger import init_logger
 from Modules.utils import Handlers
+from Modules.tracing import traced, span
+from Modules import protocol
 import socket
-import shutil
 import sys
 import os
 
 
 class Tasks:
-    def __init__(self, path, log_path, endpoint, remove_connection):
+    def __init__(self, path, log_path, endpoint, remove_connection, artifacts=None):
         self.endpoint = endpoint
+        self.artifacts = artifacts
         self.path = path
         self.log_path = log_path
         self.remove_connection = remove_connection
@@ -33,97 +35,92 @@ class Tasks:
         self.handlers = Handlers(self.log_path, self.path)
         self.local_dir = self.handlers.handle_local_dir(self.endpoint)
 
-    def bytes_to_number(self, b: int) -> int:
-        res = 0
-        for i in range(4):
-            res += b[i] << (i * 8)
-        return res
-
     def kill_task(self, taskname):
-        self.logger.debug(f"Running kill_task...")
+        self.logger.debug("Running kill_task...")
         try:
-            self.logger.debug(f"Sending kill command to {self.endpoint.ip}...")
-            self.endpoint.conn.send('kill'.encode())
+            return self.endpoint.channel.call(self.kill_task_job, taskname)
+
+        except ConnectionError as e:
+            return self.handle_error(e)
+
+    def kill_task_job(self, exchange, taskname):
+        self.exchange = exchange
+        try:
+            self.logger.debug("Sending kill command to %s...", self.endpoint.ip)
+            self.exchange.send_command('kill')
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
         try:
-            self.logger.debug(f"Sending {str(taskname)} to {self.endpoint.ip}...")
-            self.endpoint.conn.send(str(taskname).encode())
+            self.logger.debug("Sending %s to %s...", str(taskname), self.endpoint.ip)
+            self.exchange.send_message(protocol.MessageType.TEXT, str(taskname))
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
         try:
-            self.logger.debug(f"Waiting for confirmation from {self.endpoint.ip}...")
-            msg = self.endpoint.conn.recv(1024).decode()
-            self.logger.debug(f"{self.endpoint.ip}: {msg}")
+            self.logger.debug("Waiting for confirmation from %s...", self.endpoint.ip)
+            msg = self.exchange.recv_text()
+            self.logger.debug("%s: %s", self.endpoint.ip, msg)
             return True
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
+    @traced
     def get_file_name(self):
         self.logger.info(f"Running get_file_name...")
-        self.logger.debug(f"Waiting for filename from {self.endpoint.ip}...")
+        self.logger.debug("Waiting for filename from %s...", self.endpoint.ip)
         try:
-            self.endpoint.conn.settimeout(10)
-            self.filenameRecv = self.endpoint.conn.recv(1024).decode()
+            self.exchange.settimeout(10)
+            self.filenameRecv = os.path.basename(
+                self.exchange.recv_text(protocol.MessageType.FILENAME).strip())
             self.full_file_path = os.path.join(self.tasks_file_path, self.filenameRecv)
-            self.endpoint.conn.settimeout(None)
-            self.logger.debug(f"Filename: {self.filenameRecv}")
+            self.exchange.settimeout(None)
+            self.logger.debug("Filename: %s", self.filenameRecv)
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
+    @traced
     def get_file_size(self):
         self.logger.info(f"Running get_file_size...")
-        self.logger.debug(f"Waiting for file size from {self.endpoint.ip}...")
+        self.logger.debug("Waiting for file size from %s...", self.endpoint.ip)
         try:
-            self.endpoint.conn.settimeout(10)
-            self.size = self.endpoint.conn.recv(4)
-            self.endpoint.conn.settimeout(None)
-            self.size = self.bytes_to_number(self.size)
-            self.logger.debug(f"Size: {self.size}")
+            self.exchange.settimeout(10)
+            self.size, self.digest = self.exchange.recv_offer()
+            self.exchange.settimeout(None)
+            self.logger.debug("Size: %s", self.size)
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
+    @traced
     def get_file_content(self):
         self.logger.info(f"Running get_file_content...")
-        current_size = 0
-        buffer = b""
-        self.logger.debug(f"Writing content to {self.full_file_path}...")
-        with open(self.full_file_path, 'wb') as tsk_file:
-            try:
-                self.endpoint.conn.settimeout(60)
-                while current_size < self.size:
-                    data = self.endpoint.conn.recv(1024)
-                    if not data:
-                        break
-                    if len(data) + current_size > self.size:
-                        data = data[:self.size - current_size]
-                    buffer += data
-                    current_size += len(data)
-                    tsk_file.write(data)
-
-                self.endpoint.conn.settimeout(None)
-
-            except (Exception, socket.error) as e:
-                self.handle_error(e)
-                return False
+        self.logger.debug("Writing content to %s...", self.full_file_path)
+        try:
+            self.exchange.settimeout(60)
+            self.exchange.receive_chunks(self.full_file_path, self.size, self.digest)
+            self.exchange.settimeout(None)
 
+        except (Exception, socket.error) as e:
+            self.handle_error(e)
+            return False
+
+    @traced
     def confirm(self):
         self.logger.info(f"Running confirm...")
-        self.logger.debug(f"Sending confirmation to {self.endpoint.ip}...")
+        self.logger.debug("Sending confirmation to %s...", self.endpoint.ip)
         try:
-            self.endpoint.conn.send(f"Received file: {self.filenameRecv}\n".encode())
+            self.exchange.send_message(protocol.MessageType.ACK,
+                                       f"Received file: {self.filenameRecv}\n")
             return True
 
         except (Exception, socket.error) as e:
@@ -131,37 +128,51 @@ class Tasks:
             return False
 
     def handle_error(self, error):
-        self.logger.debug(f"Error: {error}")
-        self.logger.debug(f"Calling self.remove_connection({self.endpoint})...")
+        self.logger.debug("Error: %s", error)
+        self.logger.debug("Calling self.remove_connection(%s)...", self.endpoint)
         self.remove_connection(self.endpoint)
         return False
 
     def run(self):
         self.logger.info(f"Running tasks.run()...")
         try:
-            self.logger.debug(f"Sending tasks command to {self.endpoint.ip}...")
-            self.endpoint.conn.send('tasks'.encode())
+            return self.endpoint.channel.call(self.run_job)
+
+        except ConnectionError as e:
+            return self.handle_error(e)
+
+    def run_job(self, exchange):
+        self.exchange = exchange
+        try:
+            self.logger.debug("Sending tasks command to %s...", self.endpoint.ip)
+            self.exchange.send_command('tasks')
 
         except (Exception, socket.error) as e:
             self.handle_error(e)
             return False
 
-        self.logger.debug(f"Calling get_file_name...")
-        self.get_file_name()
-        self.logger.debug(f"Calling get_file_size...")
-        self.get_file_size()
-        self.logger.debug(f"Calling get_file_content...")
-        self.get_file_content()
-        self.logger.debug(f"Calling confirm...")
-        self.confirm()
+        # Each step returns False once the transfer is lost; stop there, so the previous
+        # task list is never recorded or returned as this run's result.
+        self.logger.debug("Calling get_file_name...")
+        if self.get_file_name() is False:
+            return False
 
-        src = os.path.join(self.tasks_file_path, self.filenameRecv)
-        try:
-            shutil.move(src, self.local_dir)
+        self.logger.debug("Calling get_file_size...")
+        if self.get_file_size() is False:
+            return False
+
+        self.logger.debug("Calling get_file_content...")
+        if self.get_file_content() is False:
+            return False
+
+        self.logger.debug("Calling confirm...")
+        if not self.confirm():
+            return False
 
-        except shutil.Error as file_error:
-            self.logger.error(file_error)
-            return False, file_error
+        if self.artifacts is not None:
+            self.logger.debug("Indexing %s...", self.full_file_path)
+            with span('index'):
+                self.artifacts.record(self.endpoint.ident, self.full_file_path, 'tasks')
 
         self.logger.info(f"Tasks run completed.")
         return True, 'Tasks run completed.'
@@ -0,0 +1,150 @@
+from .logger import init_logger
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import os
+
+try:
+    from PIL import Image
+
+except ImportError:
+    Image = None
+
+
+FORMAT_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+
+
+def render(source, thumb_path, thumb_size, quality, optimized_path=None, optimized_format=None):
+    """Runs in a worker process: write the thumbnail and, optionally, a recompressed copy."""
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        if optimized_path:
+            save_atomic(image, optimized_path, optimized_format, quality)
+
+        image.thumbnail((thumb_size, thumb_size))
+        save_atomic(image, thumb_path, 'jpeg', quality)
+
+    return source
+
+
+def save_atomic(image, path, image_format, quality):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    if image_format == 'webp':
+        image.save(temp_path, 'WEBP', quality=quality, method=4)
+
+    else:
+        image.save(temp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+    os.replace(temp_path, path)
+
+
+class ThumbnailPool:
+    """Makes screenshot thumbnails (and optional recompressed copies) off the request path.
+
+    Work runs in a process pool so image decoding never competes with the accept,
+    command or web threads for the GIL. ``submit`` never blocks: once
+    ``max_queue`` images are in flight further requests are dropped and the
+    original keeps being served. Derived files live next to the endpoint's
+    images, in ``<ident>/thumbs`` and ``<ident>/optimized``. Without Pillow
+    installed the pool is disabled and only originals are served.
+    """
+
+    def __init__(self, log_path, workers=2, max_queue=256, thumb_size=320, quality=70, recompress=None):
+        self.log_path = log_path
+        self.workers = int(workers)
+        self.max_queue = int(max_queue)
+        self.thumb_size = int(thumb_size)
+        self.quality = int(quality)
+        self.recompress = recompress if recompress in FORMAT_EXTENSIONS else None
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.in_flight = set()
+        self.executor = None
+        if Image is None:
+            self.logger.warning("Pillow is not installed; thumbnails are disabled.")
+
+    def __str__(self):
+        return f"ThumbnailPool(workers={self.workers}, thumb_size={self.thumb_size})"
+
+    def __repr__(self):
+        return (f"ThumbnailPool(workers={self.workers}, max_queue={self.max_queue}, "
+                f"thumb_size={self.thumb_size}, recompress={self.recompress}, in_flight={len(self.in_flight)})")
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    @staticmethod
+    def thumb_path(source) -> str:
+        images_dir, filename = os.path.split(source)
+        return os.path.join(os.path.dirname(images_dir), 'thumbs', filename)
+
+    def optimized_path(self, source):
+        if self.recompress is None:
+            return None
+
+        images_dir, filename = os.path.split(source)
+        stem = os.path.splitext(filename)[0]
+        return os.path.join(os.path.dirname(images_dir), 'optimized', stem + FORMAT_EXTENSIONS[self.recompress])
+
+    def variant_path(self, source, size):
+        if size == 'thumb':
+            return self.thumb_path(source)
+
+        if size == 'optimized':
+            return self.optimized_path(source)
+
+        return None
+
+    def on_artifact(self, artifact) -> None:
+        if artifact.type == 'screenshot':
+            self.submit(artifact.path)
+
+    def submit(self, source) -> bool:
+        if not self.enabled:
+            return False
+
+        with self.lock:
+            if source in self.in_flight:
+                return True
+
+            if len(self.in_flight) >= self.max_queue:
+                self.logger.warning(f"Thumbnail queue full ({self.max_queue}), skipping {source}.")
+                return False
+
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+            self.in_flight.add(source)
+
+        try:
+            future = self.executor.submit(render, source, self.thumb_path(source), self.thumb_size, self.quality,
+                                          self.optimized_path(source), self.recompress)
+
+        except RuntimeError as e:
+            # A worker died and took the pool with it; start a fresh one next time.
+            self.logger.error(f"Thumbnail pool unavailable: {e}")
+            with self.lock:
+                self.in_flight.discard(source)
+                self.executor = None
+
+            return False
+
+        future.add_done_callback(lambda done: self.finished(source, done))
+        return True
+
+    def finished(self, source, future) -> None:
+        with self.lock:
+            self.in_flight.discard(source)
+
+        error = future.exception()
+        if error is not None:
+            self.logger.error(f"Failed processing {source}: {error}")
+
+        else:
+            self.logger.debug(f"Thumbnail ready for {source}")
+
+    def stop(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,183 @@
+from .logger import init_logger
+from contextvars import ContextVar
+from collections import deque
+from threading import Lock
+import contextlib
+import functools
+import itertools
+import time
+
+
+# The span new child spans attach to. Channel jobs run with a copy of the submitting
+# thread's context, so spans opened inside an agent exchange land in the command's trace.
+current_span = ContextVar('current_span', default=None)
+NO_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    __slots__ = ('name', 'attributes', 'started', 'duration', 'error', 'children', 'token')
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.started = None
+        self.duration = None
+        self.error = None
+        self.children = []
+        self.token = None
+
+    def __repr__(self):
+        return f"Span(name={self.name}, duration={self.duration}, children={len(self.children)})"
+
+    def __enter__(self):
+        parent = current_span.get()
+        if parent is not None:
+            parent.children.append(self)
+
+        self.token = current_span.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+
+        current_span.reset(self.token)
+        self.token = None
+        return False
+
+    def walk(self):
+        for child in self.children:
+            yield child
+            yield from child.walk()
+
+    def to_dict(self, origin=None) -> dict:
+        origin = self.started if origin is None else origin
+        return {
+            'name': self.name,
+            'start_ms': round((self.started - origin) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'error': self.error,
+            'attributes': self.attributes,
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+
+class Trace:
+    __slots__ = ('id', 'command', 'ident', 'timestamp', 'root')
+
+    def __init__(self, trace_id, command, ident, attributes=None):
+        self.id = trace_id
+        self.command = command
+        self.ident = ident
+        self.timestamp = time.time()
+        self.root = Span(command, attributes)
+
+    def __repr__(self):
+        return f"Trace(id={self.id}, command={self.command}, ident={self.ident}, duration={self.duration})"
+
+    @property
+    def duration(self):
+        return self.root.duration
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'command': self.command,
+            'ident': self.ident,
+            'timestamp': self.timestamp,
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'error': self.root.error,
+            'span': self.root.to_dict()
+        }
+
+
+def span(name, **attributes):
+    """Child span of the current trace, or a no-op when nothing is being traced."""
+    if current_span.get() is None:
+        return NO_SPAN
+
+    return Span(name, attributes)
+
+
+def traced(fn):
+    """Run ``fn`` in a span named after it; a ``False`` return marks the span failed."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if current_span.get() is None:
+            return fn(*args, **kwargs)
+
+        with Span(fn.__name__) as phase:
+            result = fn(*args, **kwargs)
+            if result is False:
+                phase.error = 'failed'
+
+            return result
+
+    return wrapper
+
+
+class Tracer:
+    """Bounded buffer of recent command traces.
+
+    ``trace`` opens the root span of one command on one endpoint; every
+    ``span``/``traced`` phase that runs inside it, on this thread or on the
+    endpoint's channel worker, becomes a child span. Finished traces are kept
+    in a ring of ``max_traces``; traces slower than ``slow`` seconds are also
+    logged with their phase breakdown.
+    """
+
+    def __init__(self, log_path, max_traces=1000, slow=None):
+        self.log_path = log_path
+        self.max_traces = int(max_traces)
+        self.slow = float(slow) if slow else None
+        self.logger = init_logger(self.log_path, __name__)
+
+        self.lock = Lock()
+        self.traces = deque(maxlen=self.max_traces)
+        self.ids = itertools.count(1)
+
+    def __str__(self):
+        return f"Tracer(traces={len(self.traces)})"
+
+    def __repr__(self):
+        return f"Tracer(traces={len(self.traces)}, max_traces={self.max_traces}, slow={self.slow})"
+
+    @contextlib.contextmanager
+    def trace(self, command, ident, **attributes):
+        trace = Trace(next(self.ids), command, ident, attributes)
+        try:
+            with trace.root as root:
+                yield root
+
+        finally:
+            with self.lock:
+                self.traces.append(trace)
+
+            if self.slow is not None and trace.duration >= self.slow:
+                phases = ', '.join(f"{child.name}={child.duration * 1000:.1f}ms"
+                                   for child in trace.root.walk() if child.duration is not None)
+                self.logger.warning(f"Slow {command} on {ident}: {trace.duration * 1000:.1f}ms ({phases})")
+
+    def snapshot(self, ident=None) -> list:
+        with self.lock:
+            traces = list(self.traces)
+
+        if ident is not None:
+            traces = [trace for trace in traces if trace.ident == ident]
+
+        return traces
+
+    def recent(self, ident=None, limit=50) -> list:
+        # A slice with limit <= 0 would return the whole buffer.
+        limit = max(1, limit)
+        return [trace.to_dict() for trace in reversed(self.snapshot(ident)[-limit:])]
+
+    def slowest(self, ident=None, limit=20) -> list:
+        limit = max(1, limit)
+        traces = sorted(self.snapshot(ident), key=lambda trace: trace.duration, reverse=True)
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def get(self, trace_id):
+        return next((trace.to_dict() for trace in self.snapshot() if trace.id == trace_id), None)
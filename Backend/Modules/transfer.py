@@ -0,0 +1,159 @@
+from . import protocol
+from threading import local
+import hashlib
+import glob
+import zlib
+import os
+
+
+RECV_CHUNK_SIZE = 1024 * 1024
+
+_buffers = local()
+
+
+def receive_buffer(size=RECV_CHUNK_SIZE) -> memoryview:
+    """Per-thread reusable receive buffer, so transfers never allocate per chunk."""
+    view = getattr(_buffers, 'view', None)
+    if view is None or len(view) < size:
+        view = memoryview(bytearray(size))
+        _buffers.view = view
+
+    return view
+
+
+def preallocate(fd, size) -> None:
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+
+        except OSError:
+            # Not supported by this filesystem; writing still works, just without the reservation.
+            pass
+
+
+def write_all(fd, view) -> None:
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+class ChecksumError(protocol.ProtocolError):
+    """Received content does not match its chunk CRC32 or the digest it was offered with."""
+
+
+def partial_path(path, digest) -> str:
+    # Keyed on the agent's content digest: a different artifact offered under the same
+    # name (sysinfo and tasks reuse theirs) gets its own partial file.
+    if digest is None:
+        return f"{path}.part"
+
+    return f"{path}.{digest.hex()[:16]}.part"
+
+
+def discard_stale_parts(path, keep) -> None:
+    """Remove partial files left for earlier content of ``path``."""
+    for part in glob.glob(f"{glob.escape(path)}.*part"):
+        if part != keep:
+            try:
+                os.remove(part)
+
+            except OSError:
+                pass
+
+
+def resume_offset(part, size, digest) -> int:
+    if digest is None:
+        # Without a digest a partial file cannot be told apart from older content.
+        return 0
+
+    try:
+        offset = os.path.getsize(part)
+
+    except OSError:
+        return 0
+
+    return offset if offset <= size else 0
+
+
+def hash_prefix(fd, length):
+    """SHA-256 state of the first ``length`` bytes already on disk."""
+    digest = hashlib.sha256()
+    os.lseek(fd, 0, os.SEEK_SET)
+    remaining = length
+    while remaining:
+        data = os.read(fd, min(RECV_CHUNK_SIZE, remaining))
+        if not data:
+            break
+
+        digest.update(data)
+        remaining -= len(data)
+
+    return digest
+
+
+def receive_chunks(conn, path, size, digest=None, request_id=0) -> int:
+    """Receive ``size`` bytes for ``path`` as checksummed CHUNK frames, resuming if possible.
+
+    Progress lives next to the artifact in a ``.part`` file named after the
+    content digest from the agent's OFFER, which only ever holds bytes whose
+    chunk checksum matched. The server answers the OFFER with a RESUME frame
+    carrying that file's length, so after a dropped connection the agent
+    re-offers the artifact and only the missing range goes over the wire. When
+    the last byte arrives the whole file is checked against the digest and
+    renamed to ``path``; a mismatch discards it and raises ChecksumError.
+    Agents that offer no digest always start from zero. The partial file is
+    preallocated to ``size``; after a crash its preallocated tail fails the
+    digest check instead of being taken for received data. Returns the number
+    of bytes received in this call.
+    """
+    part = partial_path(path, digest)
+    discard_stale_parts(path, part)
+    offset = resume_offset(part, size, digest)
+    start = offset
+    protocol.send_message(conn, protocol.MessageType.RESUME, protocol.OFFSET.pack(offset), request_id)
+
+    view = receive_buffer(protocol.MAX_CHUNK_SIZE)
+    header = memoryview(bytearray(protocol.CHUNK_HEADER.size))
+    fd = os.open(part, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        os.ftruncate(fd, offset)
+        content = hash_prefix(fd, offset) if digest is not None else None
+        preallocate(fd, size)
+        os.lseek(fd, offset, os.SEEK_SET)
+        while offset < size:
+            msg_type, length = protocol.recv_header(conn, protocol.MessageType.CHUNK, request_id)
+            count = length - protocol.CHUNK_HEADER.size
+            if count <= 0 or count > protocol.MAX_CHUNK_SIZE or offset + count > size:
+                raise protocol.ProtocolError(f"Invalid CHUNK frame of {length} bytes at offset {offset}/{size}")
+
+            protocol.recv_exact_into(conn, header)
+            chunk_offset, checksum = protocol.CHUNK_HEADER.unpack(header)
+            if chunk_offset != offset:
+                raise protocol.ProtocolError(f"Expected chunk at offset {offset}, got {chunk_offset}")
+
+            data = view[:count]
+            protocol.recv_exact_into(conn, data)
+            if zlib.crc32(data) != checksum:
+                raise ChecksumError(f"Checksum mismatch for {count} bytes at offset {offset} of {path}")
+
+            write_all(fd, data)
+            if content is not None:
+                content.update(data)
+
+            offset += count
+
+    except BaseException:
+        # Keep only verified bytes (not the preallocated tail) so the next attempt
+        # resumes from a good offset.
+        os.ftruncate(fd, offset)
+        raise
+
+    finally:
+        os.close(fd)
+
+    if content is not None and content.digest() != digest:
+        os.remove(part)
+        raise ChecksumError(f"{path} does not match the digest it was offered with")
+
+    os.replace(part, path)
+    return offset - start
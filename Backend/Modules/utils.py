@@ -12,31 +12,31 @@ class Handlers:
 
     def handle_local_dir(self, matching_endpoint):
         self.ident_path = os.path.join(self.main_path, matching_endpoint.ident)
-        self.logger.debug(f"Ident Path: {self.ident_path}")
+        self.logger.debug("Ident Path: %s", self.ident_path)
 
         paths = ["images"]
         if not os.path.isdir(self.ident_path):
             self.logger.info(f"Directory '{self.ident_path}' does not exist.")
 
             try:
-                self.logger.debug(f"Creating Directory '{self.ident_path}'...")
+                self.logger.debug("Creating Directory '%s'...", self.ident_path)
                 os.makedirs(self.ident_path, exist_ok=True)
-                self.logger.debug(f"Directory '{self.ident_path}' created successfully.")
+                self.logger.debug("Directory '%s' created successfully.", self.ident_path)
 
             except Exception as e:
                 self.logger.error(f"Error creating {self.ident_path}. {e}")
 
             for path in paths:
                 sub_dir_path = os.path.join(self.ident_path, path)
-                self.logger.debug(f"Subdir path: {sub_dir_path}")
+                self.logger.debug("Subdir path: %s", sub_dir_path)
 
                 if not os.path.isdir(sub_dir_path):
-                    self.logger.debug(f"Subdir path '{sub_dir_path}' does not exist.")
+                    self.logger.debug("Subdir path '%s' does not exist.", sub_dir_path)
 
                     try:
-                        self.logger.debug(f"Creating Subdir '{sub_dir_path}'...")
+                        self.logger.debug("Creating Subdir '%s'...", sub_dir_path)
                         os.makedirs(sub_dir_path, exist_ok=True)
-                        self.logger.debug(f"Successfully created subdir '{sub_dir_path}'.")
+                        self.logger.debug("Successfully created subdir '%s'.", sub_dir_path)
 
                     except Exception as e:
                         self.logger.error(f"Failed to create subdir '{sub_dir_path}': {e}")
@@ -53,9 +53,9 @@ class Handlers:
                     file_path = os.path.join(path, file_name)
                     if os.path.islink(file_path):
                         # Remove symbolic link
-                        self.logger.debug(f"Removing symbolic link '{file_path}'...")
+                        self.logger.debug("Removing symbolic link '%s'...", file_path)
                         os.unlink(file_path)
-                        self.logger.debug(f"'{file_path}' removed successfully.")
+                        self.logger.debug("'%s' removed successfully.", file_path)
 
                     elif os.path.isdir(file_path):
                         # Recursively handle the subdirectory but do not remove it
@@ -63,16 +63,16 @@ class Handlers:
 
                     else:
                         # Remove the file
-                        self.logger.debug(f"Removing file '{file_path}'...")
-                        self.remove_file(file_path)
-                        self.logger.debug(f"File '{file_path}' removed successfully.")
+                        self.logger.debug("Removing file '%s'...", file_path)
+                        os.remove(file_path)
+                        self.logger.debug("File '%s' removed successfully.", file_path)
 
                 return True
             
             return False
 
         path = os.path.join(self.main_path, matching_endpoint.ident)
-        self.logger.debug(f"Clear path: {path}")
+        self.logger.debug("Clear path: %s", path)
         
         if remove_files_from_path(path):
             return True
@@ -0,0 +1 @@
+# Tools/__init__.py
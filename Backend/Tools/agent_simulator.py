@@ -0,0 +1,558 @@
+"""
+Simulated agent fleet for load testing the socket server.
+
+Every fake agent opens a real TCP connection, passes the "client" gatekeeper,
+sends a handshake JSON like the Windows client (hardware, hdd, wifi...) and
+then answers commands over framed protocol v2: 'alive', 'screen', 'si',
+'tasks', 'kill', 'discover', 'wifi', 'anydesk', 'teamviewer', 'restart' and
+'update'. Artifacts go through OFFER / RESUME / CHUNK, so an interrupted
+transfer is resumed by the server on the agent's next attempt.
+
+Agents are asyncio tasks, so one process holds thousands of them. Replies
+can be delayed (--latency, --jitter) and faults injected (--drop-rate closes
+the connection in the middle of a reply, --corrupt-rate sends a chunk with a
+bad checksum, --silent-rate ignores heartbeats). With --web the simulator
+also drives /control, /kill_task, /discover and /wifi like the dashboard does,
+one request at a time, so commands flow without a browser.
+
+At the end it reports the connect rate, connect and command latency
+percentiles and the server's memory and thread count (psutil, by --server-pid
+or by whoever listens on --port).
+
+Run from the Backend directory:
+
+    python -m Tools.agent_simulator --host 127.0.0.1 --port 4444 --agents 2000 --ramp 20 \\
+        --duration 120 --web http://127.0.0.1:8000 --output sim.json
+"""
+from Modules import protocol
+from Modules.protocol import MessageType
+from urllib import request as urllib_request
+import argparse
+import asyncio
+import hashlib
+import random
+import json
+import time
+import zlib
+import sys
+import io
+import os
+
+import psutil
+
+try:
+    from PIL import Image
+
+except ImportError:
+    Image = None
+
+try:
+    import resource
+
+except ImportError:
+    resource = None
+
+
+PROCESS_NAMES = ('svchost.exe', 'chrome.exe', 'explorer.exe', 'RuntimeBroker.exe', 'OneDrive.exe',
+                 'Teams.exe', 'notepad.exe', 'conhost.exe', 'dllhost.exe', 'SearchHost.exe')
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(values) -> dict:
+    """Millisecond percentiles of a list of durations in seconds."""
+    if not values:
+        return {'count': 0}
+
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3)
+    }
+
+
+def screenshot_payload(size) -> bytes:
+    """A decodable JPEG of about ``size`` bytes, so thumbnailing does real work; random bytes without Pillow."""
+    if Image is None:
+        return os.urandom(size)
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 36), (40, 90, 160)).save(buffer, 'JPEG', quality=60)
+    image = buffer.getvalue()
+
+    # Pad with comment segments right after SOI; decoders skip them.
+    padding = bytearray()
+    remaining = size - len(image)
+    while remaining > 4:
+        length = min(remaining - 2, 0xFFFF)
+        padding += b'\xff\xfe' + length.to_bytes(2, 'big') + os.urandom(length - 2)
+        remaining -= length + 2
+
+    return image[:2] + bytes(padding) + image[2:]
+
+
+def text_payload(size, ident) -> bytes:
+    line = f"Host Name: {ident} | OS Name: Microsoft Windows 11 Pro | System Type: x64-based PC\n".encode()
+    return (line * (size // len(line) + 1))[:size]
+
+
+def tasklist_payload(processes) -> bytes:
+    """``tasklist`` table output, the format TaskSnapshots parses."""
+    lines = ["", f"{'Image Name':<25} {'PID':>8} {'Session Name':<16} {'Session#':>11} {'Mem Usage':>12}",
+             f"{'=' * 25} {'=' * 8} {'=' * 16} {'=' * 11} {'=' * 12}"]
+    for name, pid, memory in processes:
+        lines.append(f"{name:<25} {pid:>8} {'Console':<16} {1:>11} {f'{memory:,} K':>12}")
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.latencies = {}
+        self.connect_times = []
+        self.first_connect = None
+        self.last_connect = None
+        self.connected = 0
+        self.server_samples = []
+
+    def count(self, name, amount=1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds) -> None:
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def connect(self, seconds) -> None:
+        now = time.monotonic()
+        self.first_connect = self.first_connect or now
+        self.last_connect = now
+        self.connected += 1
+        self.connect_times.append(seconds)
+
+    def report(self, agents) -> dict:
+        span = (self.last_connect - self.started) if self.last_connect else None
+        rss = [sample['rss'] for sample in self.server_samples]
+        threads = [sample['threads'] for sample in self.server_samples]
+        return {
+            'agents': agents,
+            'elapsed_s': round(time.monotonic() - self.started, 3),
+            'handshakes': len(self.connect_times),
+            'connected_now': self.connected,
+            'connect_rate_per_s': round(len(self.connect_times) / span, 1) if span else None,
+            'connect': summarize(self.connect_times),
+            'commands': {name: summarize(values) for name, values in sorted(self.latencies.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'server': {
+                'rss_start_mb': round(rss[0] / 2 ** 20, 1) if rss else None,
+                'rss_peak_mb': round(max(rss) / 2 ** 20, 1) if rss else None,
+                'rss_end_mb': round(rss[-1] / 2 ** 20, 1) if rss else None,
+                'threads_peak': max(threads) if threads else None,
+                'samples': len(rss)
+            }
+        }
+
+
+class InjectedFault(Exception):
+    """Raised inside a reply to simulate an agent that dies mid-command."""
+
+
+class FakeAgent:
+    def __init__(self, index, options, stats, content):
+        self.index = index
+        self.options = options
+        self.stats = stats
+        self.content = content
+        self.ident = f"{options.prefix}-{index:05d}"
+        self.mac = "02:00:" + ":".join(f"{(index >> shift) & 0xFF:02x}" for shift in (24, 16, 8, 0))
+        self.processes = [(random.choice(PROCESS_NAMES), 1000 + pid * 4, random.randint(2000, 400000))
+                          for pid in range(options.processes)]
+        self.unfinished = {}
+        self.reader = None
+        self.writer = None
+        self.registered = False
+
+    def __repr__(self):
+        return f"FakeAgent(ident={self.ident}, mac={self.mac})"
+
+    def handshake(self) -> dict:
+        return {
+            'mac_address': self.mac,
+            'hostname': self.ident,
+            'current_user': f"user{self.index}",
+            'client_version': '1.0.0',
+            'os_platform': 'Windows 11 Pro',
+            'boot_time': time.strftime('%d/%b/%y %H:%M:%S', time.localtime(time.time() - 3600)),
+            'is_vm': {'true': 'false'},
+            'hardware': {
+                'memory': {'total': 16 * 2 ** 30, 'available': 9 * 2 ** 30},
+                'hard_drives': [{
+                    'device': 'C:\\', 'mountpoint': 'C:\\', 'filesystem_type': 'NTFS',
+                    'total_size': 512 * 2 ** 30, 'used_space': 200 * 2 ** 30,
+                    'free_space': 312 * 2 ** 30, 'errors': []
+                }]
+            },
+            'hdd': [{'Drive Type': 'Fixed', 'Model': 'Simulated NVMe', 'Media Type': 'SSD'}],
+            'ex_ip': '203.0.113.10',
+            'wifi': [f"sim-net-{self.index % 7}"]
+        }
+
+    async def run(self, stop) -> None:
+        await asyncio.sleep(self.options.ramp * self.index / max(self.options.agents, 1))
+        while not stop.is_set():
+            try:
+                await self.connect()
+                await self.serve()
+
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, InjectedFault) as e:
+                self.stats.count(f"disconnect:{type(e).__name__}")
+
+            finally:
+                self.close()
+
+            if not self.options.reconnect:
+                return
+
+            await asyncio.sleep(self.options.reconnect_delay * random.uniform(0.5, 1.5))
+
+    async def connect(self) -> None:
+        started = time.monotonic()
+        self.reader, self.writer = await asyncio.open_connection(self.options.host, self.options.port)
+        msg_type, request_id, welcome = await self.read_frame()
+        self.send(MessageType.HELLO, 'client')
+        self.send(MessageType.HANDSHAKE, self.handshake())
+        await self.writer.drain()
+        self.stats.connect(time.monotonic() - started)
+        self.registered = True
+
+    def close(self) -> None:
+        if self.registered:
+            self.stats.connected -= 1
+            self.registered = False
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+    async def read_frame(self):
+        header = await self.reader.readexactly(protocol.HEADER.size)
+        msg_type, length, request_id = protocol.unpack_header(header)
+        if length > protocol.MAX_CONTROL_SIZE:
+            raise protocol.ProtocolError(f"{msg_type.name} frame of {length} bytes from the server")
+
+        return msg_type, request_id, await self.reader.readexactly(length)
+
+    async def expect(self, expected, request_id) -> bytes:
+        while True:
+            msg_type, frame_id, payload = await self.read_frame()
+            if frame_id != request_id:
+                continue
+
+            if msg_type != expected:
+                raise protocol.ProtocolError(f"Expected {expected.name}, got {msg_type.name}")
+
+            return payload
+
+    def send(self, msg_type, payload=None, request_id=0) -> None:
+        self.writer.write(protocol.encode_frame(msg_type, payload, request_id))
+
+    async def reply_delay(self) -> None:
+        if self.options.latency:
+            jitter = self.options.jitter
+            await asyncio.sleep(self.options.latency / 1000 * random.uniform(1 - jitter, 1 + jitter))
+
+    def maybe_fail(self, rate, name) -> None:
+        if rate and random.random() < rate:
+            self.stats.count(f"injected:{name}")
+            raise InjectedFault(name)
+
+    async def serve(self) -> None:
+        handlers = {
+            'alive': self.on_alive, 'screen': self.on_screen, 'si': self.on_sysinfo, 'tasks': self.on_tasks,
+            'kill': self.on_kill, 'discover': self.on_discover, 'wifi': self.on_wifi,
+            'anydesk': self.on_remote_tool, 'teamviewer': self.on_remote_tool,
+            'restart': self.on_restart, 'update': self.on_restart
+        }
+        while True:
+            msg_type, request_id, payload = await self.read_frame()
+            if msg_type != MessageType.COMMAND:
+                # Leftovers of a request the server already gave up on.
+                continue
+
+            command = payload.decode(errors='replace')
+            handler = handlers.get(command)
+            if handler is None:
+                self.stats.count(f"unknown:{command}")
+                continue
+
+            started = time.monotonic()
+            await self.reply_delay()
+            await handler(request_id)
+            await self.writer.drain()
+            self.stats.observe(command, time.monotonic() - started)
+
+    async def on_alive(self, request_id) -> None:
+        if self.options.silent_rate and random.random() < self.options.silent_rate:
+            self.stats.count('injected:silent')
+            return
+
+        self.send(MessageType.TEXT, 'yes', request_id)
+
+    async def send_artifact(self, request_id, kind, filename, data, ack_filename, ack_done) -> None:
+        # Re-offer an interrupted artifact under its old name so the server resumes it.
+        filename, data = self.unfinished.pop(kind, (filename, data))
+        self.send(MessageType.FILENAME, filename, request_id)
+        if ack_filename:
+            await self.writer.drain()
+            await self.expect(MessageType.ACK, request_id)
+
+        self.send(MessageType.OFFER, protocol.OFFER.pack(len(data), hashlib.sha256(data).digest()), request_id)
+        await self.writer.drain()
+        offset = protocol.OFFSET.unpack(await self.expect(MessageType.RESUME, request_id))[0]
+        if offset:
+            self.stats.count('resumed')
+            self.stats.count('resumed_bytes', offset)
+
+        sent_from = offset
+
+        view = memoryview(data)
+        chunk_size = self.options.chunk_size
+        try:
+            while offset < len(data):
+                chunk = view[offset:offset + chunk_size]
+                checksum = zlib.crc32(chunk)
+                if self.options.corrupt_rate and random.random() < self.options.corrupt_rate:
+                    self.stats.count('injected:corrupt')
+                    checksum ^= 0xFFFFFFFF
+
+                self.send(MessageType.CHUNK, protocol.CHUNK_HEADER.pack(offset, checksum) + chunk, request_id)
+                await self.writer.drain()
+                offset += len(chunk)
+                if offset < len(data):
+                    self.maybe_fail(self.options.drop_rate, 'drop')
+
+        except InjectedFault:
+            self.unfinished[kind] = (filename, data)
+            raise
+
+        self.stats.count('artifact_bytes', len(data) - sent_from)
+        if ack_done:
+            await self.expect(MessageType.ACK, request_id)
+
+    async def on_screen(self, request_id) -> None:
+        filename = f"screenshot {self.ident} {time.strftime('%d-%b-%y %I.%M.%S %p')} {random.randrange(10 ** 6)}.jpg"
+        await self.send_artifact(request_id, 'screen', filename, self.content['screenshot'],
+                                 ack_filename=True, ack_done=False)
+
+    async def on_sysinfo(self, request_id) -> None:
+        await self.send_artifact(request_id, 'si', f"systeminfo {self.ident}.txt",
+                                 text_payload(self.options.sysinfo_size, self.ident),
+                                 ack_filename=True, ack_done=True)
+
+    async def on_tasks(self, request_id) -> None:
+        # A few processes come and go between snapshots, so deltas are not empty.
+        for _ in range(2):
+            self.processes[random.randrange(len(self.processes))] = (
+                random.choice(PROCESS_NAMES), random.randint(20000, 60000), random.randint(2000, 400000))
+
+        await self.send_artifact(request_id, 'tasks', f"tasks {self.ident}.txt", tasklist_payload(self.processes),
+                                 ack_filename=False, ack_done=True)
+
+    async def on_kill(self, request_id) -> None:
+        task_name = (await self.expect(MessageType.TEXT, request_id)).decode(errors='replace')
+        self.send(MessageType.TEXT, f"Task {task_name} killed.", request_id)
+
+    async def on_discover(self, request_id) -> None:
+        hosts = {f"10.0.{self.index % 250}.{host}": random.choice(['SMB', 'RDP', 'HTTP', 'SSH'])
+                 for host in range(1, self.options.discover_hosts + 1)}
+        self.send(MessageType.JSON, hosts, request_id)
+
+    async def on_wifi(self, request_id) -> None:
+        networks = '\n'.join(f"SSID {number} : sim-net-{number}" for number in range(1, 6))
+        self.send(MessageType.TEXT, networks, request_id)
+
+    async def on_remote_tool(self, request_id) -> None:
+        self.send(MessageType.TEXT, 'OK', request_id)
+
+    async def on_restart(self, request_id) -> None:
+        self.stats.count('restarts')
+        raise ConnectionResetError("Agent restarting")
+
+
+def server_process(options):
+    if options.server_pid:
+        return psutil.Process(options.server_pid)
+
+    try:
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status == psutil.CONN_LISTEN and conn.laddr.port == options.port and conn.pid:
+                return psutil.Process(conn.pid)
+
+    except psutil.AccessDenied:
+        pass
+
+    return None
+
+
+async def sample_server(process, stats, interval, stop) -> None:
+    while not stop.is_set():
+        try:
+            with process.oneshot():
+                stats.server_samples.append({'rss': process.memory_info().rss, 'threads': process.num_threads()})
+
+        except psutil.Error:
+            return
+
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+
+        except asyncio.TimeoutError:
+            pass
+
+
+def post_json(url, payload, timeout):
+    req = urllib_request.Request(url, data=json.dumps(payload).encode(), method='POST',
+                                 headers={'Content-Type': 'application/json'})
+    with urllib_request.urlopen(req, timeout=timeout) as response:
+        return response.read()
+
+
+def drive_once(options, agent, action) -> None:
+    """One dashboard round: select the agent's row via /shell_data, then run ``action`` on it."""
+    web = options.web.rstrip('/')
+    row = {'conn': agent.ident, 'client_mac': agent.mac, 'ident': agent.ident}
+    post_json(f"{web}/shell_data", row, options.http_timeout)
+    if action == 'kill':
+        post_json(f"{web}/kill_task", {'data': {'taskName': random.choice(PROCESS_NAMES)}}, options.http_timeout)
+
+    elif action in ('discover', 'wifi'):
+        post_json(f"{web}/{action}", {}, options.http_timeout)
+
+    else:
+        post_json(f"{web}/control", {'action': action, 'endpoint': row}, options.http_timeout)
+
+
+async def drive(options, agents, stats, stop) -> None:
+    # The dashboard selects one endpoint at a time server side, so requests are never overlapped.
+    actions = options.actions.split(',')
+    await asyncio.sleep(options.ramp)
+    while not stop.is_set():
+        agent = random.choice(agents)
+        action = random.choice(actions)
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(drive_once, options, agent, action)
+            stats.observe(f"http:{action}", time.monotonic() - started)
+
+        except OSError:
+            stats.count(f"http_error:{action}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), options.drive_interval)
+
+        except asyncio.TimeoutError:
+            pass
+
+
+def raise_file_limit(agents) -> None:
+    if resource is None:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, agents + 256)) if hard != resource.RLIM_INFINITY else max(soft, agents + 256)
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+async def simulate(options) -> dict:
+    stats = Stats()
+    stop = asyncio.Event()
+    content = {'screenshot': screenshot_payload(options.screenshot_size)}
+    agents = [FakeAgent(index, options, stats, content) for index in range(options.agents)]
+    tasks = [asyncio.create_task(agent.run(stop)) for agent in agents]
+
+    process = server_process(options)
+    if process is not None:
+        tasks.append(asyncio.create_task(sample_server(process, stats, options.sample_interval, stop)))
+
+    else:
+        print("Server process not found; pass --server-pid to record its memory.", file=sys.stderr)
+
+    if options.web:
+        tasks.append(asyncio.create_task(drive(options, agents, stats, stop)))
+
+    try:
+        await asyncio.wait_for(stop.wait(), options.duration)
+
+    except asyncio.TimeoutError:
+        pass
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats.report(options.agents)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated HandsOff agent fleet for load testing the server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVER_PORT', 4444)))
+    parser.add_argument('--agents', type=int, default=100, help="Number of concurrent fake endpoints.")
+    parser.add_argument('--ramp', type=float, default=10.0, help="Seconds over which agents connect.")
+    parser.add_argument('--duration', type=float, default=60.0, help="Total run time in seconds.")
+    parser.add_argument('--prefix', default='SIM', help="Hostname prefix of the fake endpoints.")
+    parser.add_argument('--reconnect', action=argparse.BooleanOptionalAction, default=True,
+                        help="Reconnect after a drop, restart or update.")
+    parser.add_argument('--reconnect-delay', type=float, default=2.0)
+    parser.add_argument('--latency', type=float, default=0.0, help="Mean reply delay in milliseconds.")
+    parser.add_argument('--jitter', type=float, default=0.5, help="Relative spread of the reply delay.")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="Chance per chunk that the agent disconnects mid-transfer.")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help="Chance per chunk of a bad checksum.")
+    parser.add_argument('--silent-rate', type=float, default=0.0, help="Chance that a heartbeat goes unanswered.")
+    parser.add_argument('--screenshot-size', type=int, default=512 * 1024, help="Screenshot size in bytes.")
+    parser.add_argument('--sysinfo-size', type=int, default=16 * 1024, help="System information size in bytes.")
+    parser.add_argument('--processes', type=int, default=150, help="Processes per task list.")
+    parser.add_argument('--discover-hosts', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=256 * 1024)
+    parser.add_argument('--web', help="Dashboard base URL; when set, commands are driven through the HTTP API.")
+    parser.add_argument('--actions', default='screenshot,sysinfo,tasks,kill,discover,wifi')
+    parser.add_argument('--drive-interval', type=float, default=0.5, help="Pause between driven commands.")
+    parser.add_argument('--http-timeout', type=float, default=60.0)
+    parser.add_argument('--server-pid', type=int, help="Server process to sample; found by --port if omitted.")
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--output', help="Also write the report as JSON to this file.")
+    options = parser.parse_args(argv)
+
+    if options.chunk_size > protocol.MAX_CHUNK_SIZE:
+        parser.error(f"--chunk-size cannot exceed {protocol.MAX_CHUNK_SIZE}")
+
+    return options
+
+
+def main(argv=None) -> dict:
+    options = parse_args(argv)
+    raise_file_limit(options.agents)
+    report = asyncio.run(simulate(options))
+    print(json.dumps(report, indent=2))
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
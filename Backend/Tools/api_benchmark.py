@@ -0,0 +1,437 @@
+"""
+HTTP API benchmark parameterized by fleet size.
+
+For every fleet size the benchmark builds a fresh Server and Backend in a
+temporary directory. It registers N synthetic endpoints straight into
+``Server.endpoints`` and writes M screenshot artifacts per endpoint, then
+measures throughput and p50/p99 latency of:
+
+    GET  /                      full fleet listing and the ``?since=`` delta
+    POST /shell_data            selecting an endpoint row
+    GET  /get_files             first page of an endpoint's images
+    GET  /images/<ident>/<file> original and ``?size=thumb``
+    POST /control               sysinfo/tasks/screenshot on a live simulated agent
+
+Requests go through Flask's test client, through a real HTTP socket server
+(werkzeug, keep-alive), or both. /control needs an agent on the other end,
+so the socket server is started too and --live-agents agents from
+``agent_simulator`` connect to it. Database writes are pointed at an
+unreachable host so a benchmark never touches the real database.
+
+Results are keyed by scenario, transport and fleet size. ``--save`` stores
+them with the commit they were measured on, and ``--compare`` prints the
+change against a stored baseline. With --fail-on-regression the exit code
+is 1 when throughput drops or p99 grows by more than --tolerance.
+
+Run from the Backend directory:
+
+    python -m Tools.api_benchmark --endpoints 100,1000,5000 --artifacts 20 --save Tools/baseline.json
+    python -m Tools.api_benchmark --endpoints 100,1000,5000 --artifacts 20 --compare Tools/baseline.json
+"""
+from Modules import Server, Backend
+from Modules.server import Endpoints
+from Modules.channel import Channel
+from Tools import agent_simulator
+from werkzeug.serving import make_server, WSGIRequestHandler
+from http.client import HTTPConnection
+from threading import Thread, local
+import subprocess
+import argparse
+import platform
+import tempfile
+import asyncio
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+
+class SyntheticConn:
+    """Stands in for an agent socket; synthetic endpoints are never sent commands."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f"<synthetic socket {self.index}>"
+
+    def close(self) -> None:
+        pass
+
+
+def synthetic_endpoint(index, log_path) -> Endpoints:
+    ident = f"BENCH-{index:06d}"
+    conn = SyntheticConn(index)
+    hardware = {
+        'memory': {'total': 16 * 2 ** 30, 'available': 8 * 2 ** 30},
+        'hard_drives': [{'device': 'C:\\', 'mountpoint': 'C:\\', 'filesystem_type': 'NTFS',
+                         'total_size': 512 * 2 ** 30, 'used_space': 100 * 2 ** 30,
+                         'free_space': 412 * 2 ** 30, 'errors': []}]
+    }
+    return Endpoints(conn, "02:01:" + ":".join(f"{(index >> shift) & 0xFF:02x}" for shift in (24, 16, 8, 0)),
+                     f"10.{(index >> 16) & 0xFF}.{(index >> 8) & 0xFF}.{index & 0xFF}", ident, f"user{index}",
+                     '1.0.0', 'Windows 11 Pro', '01/Jan/25 08:00:00', '01/Jan/25 08:00:05', 'false',
+                     hardware, [{'Drive Type': 'Fixed', 'Model': 'Bench SSD', 'Media Type': 'SSD'}],
+                     '203.0.113.20', [f"bench-net-{index % 5}"],
+                     channel=Channel(conn, log_path, name=ident))
+
+
+def write_artifacts(main_path, endpoints, per_endpoint, size) -> dict:
+    """``per_endpoint`` screenshots for every endpoint; returns ident -> file names."""
+    payload = agent_simulator.screenshot_payload(size)
+    files = {}
+    for endpoint in endpoints:
+        images = os.path.join(main_path, endpoint.ident, 'images')
+        os.makedirs(images, exist_ok=True)
+        names = files[endpoint.ident] = []
+        for number in range(per_endpoint):
+            name = f"screenshot {endpoint.ident} {number:05d}.jpg"
+            with open(os.path.join(images, name), 'wb') as file:
+                file.write(payload)
+
+            names.append(name)
+
+    return files
+
+
+class ClientTransport:
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self.clients = local()
+
+    def request(self, method, path, body=None) -> int:
+        client = getattr(self.clients, 'client', None)
+        if client is None:
+            client = self.clients.client = self.app.test_client()
+
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def close(self) -> None:
+        pass
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class HttpTransport:
+    name = 'http'
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+        self.port = self.server.server_port
+        self.thread = Thread(target=self.server.serve_forever, daemon=True, name="Benchmark HTTP")
+        self.thread.start()
+        self.connections = local()
+
+    def request(self, method, path, body=None) -> int:
+        conn = getattr(self.connections, 'conn', None)
+        if conn is None:
+            conn = self.connections.conn = HTTPConnection('127.0.0.1', self.port, timeout=120)
+
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+
+        except OSError:
+            conn.close()
+            self.connections.conn = None
+            raise
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+class LiveAgents:
+    """Simulated agents connected to the real socket server, for routes that talk to an agent."""
+
+    def __init__(self, port, count):
+        self.options = agent_simulator.parse_args(['--port', str(port), '--agents', str(count), '--ramp', '0',
+                                                   '--prefix', 'LIVE', '--screenshot-size', str(256 * 1024)])
+        self.stats = agent_simulator.Stats()
+        self.agents = [agent_simulator.FakeAgent(index, self.options, self.stats,
+                                                 {'screenshot': agent_simulator.screenshot_payload(256 * 1024)})
+                       for index in range(count)]
+        self.loop = asyncio.new_event_loop()
+        self.stop = None
+        self.thread = Thread(target=self.loop.run_until_complete, args=(self.run(),), daemon=True,
+                             name="Benchmark agents")
+        self.thread.start()
+
+    async def run(self) -> None:
+        self.stop = asyncio.Event()
+        await asyncio.gather(*(agent.run(self.stop) for agent in self.agents))
+
+    def close(self) -> None:
+        if self.stop is not None:
+            self.loop.call_soon_threadsafe(self.stop.set)
+
+        for agent in self.agents:
+            if agent.writer is not None:
+                self.loop.call_soon_threadsafe(agent.close)
+
+
+def wait_for(condition, timeout, interval=0.05) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(interval)
+
+    return condition()
+
+
+class Fleet:
+    """Server, Backend, synthetic endpoints, artifacts and live agents for one fleet size."""
+
+    def __init__(self, options, endpoints, artifacts):
+        self.workdir = tempfile.mkdtemp(prefix='handsoff-bench-')
+        self.main_path = os.path.join(self.workdir, 'images')
+        self.log_path = os.path.join(self.workdir, 'bench.log')
+        os.makedirs(self.main_path)
+
+        # Environment wins over .env (load_dotenv does not override), so nothing real is touched.
+        os.environ.update(MAIN_PATH=self.main_path, DB_HOST='127.0.0.1', DB_PORT='1',
+                          ARTIFACT_INDEX_PATH=os.path.join(self.workdir, 'artifacts.db'))
+        # /shell_data stores the login time in the Flask session.
+        os.environ.setdefault('SECRET_KEY', 'handsoff-benchmark')
+
+        self.server = Server('127.0.0.1', 0, self.log_path)
+        self.backend = Backend(self.main_path, self.log_path, self.server, 'benchmark', '127.0.0.1', 0)
+        self.endpoints = [synthetic_endpoint(index, self.log_path) for index in range(endpoints)]
+        for endpoint in self.endpoints:
+            self.server.endpoints.upsert(endpoint)
+
+        started = time.perf_counter()
+        self.files = write_artifacts(self.main_path, self.endpoints, artifacts, options.artifact_size)
+        self.backend.artifacts.rebuild()
+        self.setup_seconds = time.perf_counter() - started
+
+        self.agents = None
+        self.live = []
+        if options.live_agents:
+            self.server.listener()
+            port = self.server.server.getsockname()[1]
+            self.agents = LiveAgents(port, options.live_agents)
+            wait_for(lambda: len(self.server.endpoints) >= endpoints + options.live_agents, 30)
+            self.live = [endpoint for endpoint in self.server.endpoints.snapshot()
+                         if endpoint.ident.startswith('LIVE-')]
+
+    def row(self, endpoint) -> dict:
+        return {'conn': f"{endpoint.conn}", 'client_mac': endpoint.client_mac, 'ident': endpoint.ident}
+
+    def close(self) -> None:
+        if self.agents is not None:
+            self.agents.close()
+            self.server.acceptor.stop()
+            self.server.heartbeat.stop()
+            self.server.server.close()
+
+        self.server.db.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def scenarios(fleet, options) -> list:
+    """``(name, method, make_request, sequential)``; ``make_request()`` returns ``(path, body)``."""
+    endpoints = fleet.endpoints
+    version = fleet.server.endpoints.version
+
+    def image_path(query=''):
+        endpoint = random.choice(endpoints)
+        name = random.choice(fleet.files[endpoint.ident])
+        return f"/images/{endpoint.ident}/{name.replace(' ', '%20')}{query}", None
+
+    result = [
+        ('index', 'GET', lambda: ('/', None), False),
+        ('index_since', 'GET', lambda: (f"/?since={max(version - 10, 0)}", None), False),
+        ('shell_data', 'POST', lambda: ('/shell_data', fleet.row(random.choice(endpoints))), True),
+        ('get_files', 'GET', lambda: (f"/get_files?directory={random.choice(endpoints).ident}&limit=100", None),
+         False),
+        ('images', 'GET', lambda: image_path(), False),
+        ('images_thumb', 'GET', lambda: image_path('?size=thumb'), False),
+    ]
+    if fleet.live:
+        for action in options.control_actions.split(','):
+            result.append((f"control_{action}", 'POST',
+                           lambda action=action: ('/control', {'action': action, 'endpoint': fleet.row(fleet.live[0])}),
+                           True))
+
+    return result
+
+
+def measure(transport, method, make_request, requests, concurrency, warmup) -> dict:
+    for _ in range(warmup):
+        path, body = make_request()
+        transport.request(method, path, body)
+
+    latencies = []
+    statuses = []
+
+    def worker(count):
+        for _ in range(count):
+            path, body = make_request()
+            started = time.perf_counter()
+            try:
+                status = transport.request(method, path, body)
+
+            except OSError:
+                status = None
+
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    shares = [requests // concurrency + (1 if index < requests % concurrency else 0) for index in range(concurrency)]
+    threads = [Thread(target=worker, args=(share,)) for share in shares if share]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - started
+    summary = agent_simulator.summarize(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status is None or status >= 400),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': summary.get('p50_ms'),
+        'p99_ms': summary.get('p99_ms')
+    }
+
+
+def run_fleet(options, endpoints, artifacts) -> dict:
+    fleet = Fleet(options, endpoints, artifacts)
+    results = {}
+    try:
+        transports = [ClientTransport(fleet.backend.app)] if options.transport in ('client', 'both') else []
+        if options.transport in ('http', 'both'):
+            transports.append(HttpTransport(fleet.backend.app))
+
+        print(f"Fleet n={endpoints} m={artifacts}: {len(fleet.live)} live agents, "
+              f"artifacts written and indexed in {fleet.setup_seconds:.1f}s", file=sys.stderr)
+        for transport in transports:
+            transport.request('GET', '/')
+            for name, method, make_request, sequential in scenarios(fleet, options):
+                if name.startswith('control_'):
+                    # /control acts on the endpoint last selected through /shell_data, like the dashboard.
+                    transport.request('POST', '/shell_data', fleet.row(fleet.live[0]))
+
+                requests = options.control_requests if name.startswith('control_') else options.requests
+                result = measure(transport, method, make_request, requests,
+                                 1 if sequential else options.concurrency, options.warmup)
+                key = f"{name} [{transport.name}] n={endpoints} m={artifacts}"
+                results[key] = result
+                print(f"  {key}: {result}", file=sys.stderr)
+
+            transport.close()
+
+    finally:
+        fleet.close()
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance) -> list:
+    """Print the change of every shared key; returns the keys that regressed beyond ``tolerance``."""
+    regressions = []
+    print(f"{'scenario':<58} {'rps':>16} {'p99 ms':>18}")
+    for key, result in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if previous is None or not previous.get('rps') or not previous.get('p99_ms'):
+            continue
+
+        rps_change = result['rps'] / previous['rps'] - 1
+        p99_change = result['p99_ms'] / previous['p99_ms'] - 1
+        regressed = rps_change < -tolerance or p99_change > tolerance
+        if regressed:
+            regressions.append(key)
+
+        print(f"{key:<58} {result['rps']:>8} ({rps_change:+6.1%}) {result['p99_ms']:>9} ({p99_change:+6.1%})"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the HandsOff HTTP API at several fleet sizes.")
+    parser.add_argument('--endpoints', default='100,1000', help="Comma separated fleet sizes (N).")
+    parser.add_argument('--artifacts', type=int, default=20, help="Screenshots per endpoint (M).")
+    parser.add_argument('--artifact-size', type=int, default=64 * 1024)
+    parser.add_argument('--transport', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=500, help="Measured requests per scenario.")
+    parser.add_argument('--control-requests', type=int, default=50)
+    parser.add_argument('--control-actions', default='sysinfo,tasks,screenshot')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads for read-only scenarios.")
+    parser.add_argument('--live-agents', type=int, default=1, help="Simulated agents for /control; 0 skips it.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="Write the results as a baseline JSON file.")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative rps drop / p99 growth.")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    random.seed(options.seed)
+    results = {}
+    for endpoints in (int(size) for size in options.endpoints.split(',')):
+        results.update(run_fleet(options, endpoints, options.artifacts))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'artifacts': options.artifacts,
+            'artifact_size': options.artifact_size,
+            'requests': options.requests,
+            'concurrency': options.concurrency
+        },
+        'results': results
+    }
+    print(json.dumps(report, indent=2))
+
+    regressions = []
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+
+        print(f"\nAgainst {options.compare} (commit {baseline.get('meta', {}).get('commit')}):")
+        regressions = compare(results, baseline, options.tolerance)
+
+    if options.save:
+        with open(options.save, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    return 1 if regressions and options.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -43,7 +43,7 @@ function Content({ endpoints }) {
                     const existingImages = fileCache[chosenRow.ident] || [];
                     const newImages = fetchedImages.filter(img => !existingImages.includes(img)); // Avoid duplicates
 
-                    const updatedImages = [...newImages.reverse(), ...existingImages]; // Prepend new images and reverse
+                    const updatedImages = [...newImages, ...existingImages]; // Server lists newest first; prepend new images
                     fileCache[chosenRow.ident] = updatedImages; // Update the cache
                     setImages(updatedImages);
                     setCurrentSlide(0); // Reset to the first slide (newest image)
@@ -175,7 +175,7 @@ function Content({ endpoints }) {
                             images.map((imgSrc, index) => (
                                 <LazyImage
                                     key={index}
-                                    src={imgSrc}
+                                    src={`${imgSrc}?size=thumb`}
                                     alt={`Slide ${index + 1}`}
                                     onClick={() => handleImageClick(imgSrc)}
                                 />